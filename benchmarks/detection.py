@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter : a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+#
+
+"""This script benchmarks the detection of the document formats.
+
+For each generated format, it compares the time needed to detect
+the format by trying each parser in turn, like pkpgcounter used to
+do, with the time needed when only the parsers whose signature
+appears in the first block are tried. Both must detect the same
+format. Opening the file isn't timed.
+
+  $ python benchmarks/detection.py --repeat 200
+"""
+
+import sys
+import os
+import time
+import random
+import tempfile
+import optparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from pkpgpdls import analyzer, pdlparser, registry
+
+import generators
+
+class ReferenceAnalyzer(analyzer.PDLAnalyzer):
+    """Tries each parser in turn."""
+    def _detectPDLHandler(self):
+        """Tries to autodetect the document format."""
+        if self._parser:
+            return
+        if not os.stat(self.workname).st_size:
+            raise pdlparser.PDLParserError("input file %s is empty !" % self.name)
+        (firstblock, lastblock) = self.readFirstAndLastBlocks(self.workfile)
+        for entry in registry.BUILTINS + registry.FALLBACKS:
+            try:
+                self._parser = entry.getParser()(self, self.workname,
+                                                 (firstblock, lastblock))
+                break
+            except pdlparser.PDLParserError:
+                pass # try next parser
+        if not self._parser:
+            raise pdlparser.PDLParserError("Analysis of first data block failed.")
+
+def detect(klass, filename):
+    """Detects the format of filename, and returns it with the time taken.
+
+       Opening and closing the file aren't timed.
+    """
+    parser = klass(filename)
+    parser.openFile()
+    try:
+        before = time.perf_counter()
+        format = parser.pdlhandler.format
+        elapsed = time.perf_counter() - before
+    finally:
+        parser.closeFile()
+    return (format, elapsed)
+
+def compare(filename, repeat):
+    """Detects the format of filename repeat times with each analyzer in turn,
+       and returns their formats with their fastest times.
+    """
+    (refbest, curbest) = (None, None)
+    for i in range(repeat):
+        (refformat, reftime) = detect(ReferenceAnalyzer, filename)
+        (curformat, curtime) = detect(analyzer.PDLAnalyzer, filename)
+        refbest = min(reftime, refbest or reftime)
+        curbest = min(curtime, curbest or curtime)
+    return (refformat, refbest, curformat, curbest)
+
+def main():
+    """Runs the benchmark."""
+    parser = optparse.OptionParser(usage="python detection.py [options]")
+    parser.add_option("-r", "--repeat",
+                            type="int",
+                            default=1000,
+                            dest="repeat",
+                            help="Number of detections for each format, the fastest one is kept. Defaults to 1000.")
+    (options, arguments) = parser.parse_args()
+    repeat = max(1, options.repeat)
+    failed = False
+    sys.stdout.write("%-12s %-34s %12s %12s %9s\n" % ("JOB", "FORMAT", "REFERENCE", "CURRENT", "SPEEDUP"))
+    for (name, generator) in generators.GENERATORS:
+        datas = generator(2, random.Random(42))
+        (fd, filename) = tempfile.mkstemp(prefix="pkpgcounter_", suffix=".%s" % name)
+        try:
+            os.write(fd, datas)
+            os.close(fd)
+            (refformat, reftime, curformat, curtime) = compare(filename, repeat)
+        finally:
+            os.remove(filename)
+        if refformat != curformat:
+            failed = True
+            sys.stderr.write("ERROR: %s job detected as %s instead of %s !\n" % (name, curformat, refformat))
+        sys.stdout.write("%-12s %-34s %10.1fus %10.1fus %8.1fx\n" \
+                            % (name, curformat[:34], reftime * 1e6, curtime * 1e6, reftime / max(curtime, 1e-9)))
+        sys.stdout.flush()
+    if failed:
+        return -1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
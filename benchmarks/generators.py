@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter : a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+#
+
+"""Deterministic generators of synthetic print jobs.
+
+Each generator takes a number of pages and a random.Random instance,
+and returns the job as bytes. The jobs are only as valid as needed
+for pkpgcounter to detect their format and count their pages, which
+is what we want to benchmark.
+
+Microsoft Word documents have no generator: they can't be produced
+without Word itself, and are counted by converting them to PostScript
+with abiword, which only measures abiword.
+"""
+
+import io
+import struct
+import zipfile
+
+UEL = b"\033%-12345X"
+
+def randomBytes(rand, size, exclude=b""):
+    """Returns size random bytes, none of them in exclude."""
+    datas = bytes(rand.getrandbits(8) for i in range(size))
+    if exclude:
+        datas = datas.translate(bytes.maketrans(exclude, b"\x00" * len(exclude)))
+    return datas
+
+def pcl5(nbpages, rand):
+    """Returns a PCL5 job made of 300 DPI raster pages."""
+    job = [ UEL + b"@PJL SET COPIES=1\r\n@PJL ENTER LANGUAGE=PCL\r\n\033E\033&l26a0o1X" ]
+    row = randomBytes(rand, 300)
+    for pnum in range(nbpages):
+        job.append(b"\033*t300R\033*r2480S\033*r1A")
+        for i in range(600):
+            job.append(b"\033*b0m%iW" % len(row))
+            job.append(row)
+        job.append(b"\033*rB\014")
+    job.append(b"\033E" + UEL)
+    return b"".join(job)
+
+def pclxl(nbpages, rand):
+    """Returns a little endian PCLXL job with an image per page."""
+    job = [ UEL + b"@PJL ENTER LANGUAGE=PCLXL\r\n) HP-PCL XL;2;0;Comment\r\n",
+            b"\xd1\x58\x02\x58\x02\xf8\x89\xc0\x00\xf8\x86\x41", # BeginSession
+            b"\xc0\x00\xf8\x88\x48",                             # OpenDataSource
+          ]
+    image = randomBytes(rand, 64 * 1024)
+    for pnum in range(nbpages):
+        job.append(b"\xc0\x00\xf8\x28\xc0\x02\xf8\x25\x43")  # Orientation, MediaSize, BeginPage
+        for i in range(3):
+            job.append(b"\xb1\xfa" + struct.pack("<I", len(image)) + image) # ReadImage
+        job.append(b"\xc1\x01\x00\xf8\x31\x44")             # PageCopies, EndPage
+    job.append(b"\x49\x42" + UEL)                           # CloseDataSource, EndSession
+    return b"".join(job)
+
+def qpdl(nbpages, rand):
+    """Returns a big endian QPDL (aka SPL2) job."""
+    job = [ UEL + b"@PJL SET COPIES=1\r\n@PJL ENTER LANGUAGE=QPDL\r\n" ]
+    band = randomBytes(rand, 32 * 1024)
+    for pnum in range(nbpages):
+        job.append(b"\x00" + struct.pack(">BHB4sBBH4s", 0, 1, 2, b"\x00" * 4, 1, 0, 0, b"\x00" * 4)) # BeginPage, A4, Auto
+        for i in range(6):
+            job.append(b"\x0c" + struct.pack(">HHHI", i, 4960, 128, len(band)) + band)
+        job.append(b"\x01" + struct.pack(">H", 1))                                   # EndPage
+    job.append(b"\x09" + UEL)
+    return b"".join(job)
+
+def spl1(nbpages, rand):
+    """Returns an SPL1 (aka GDI) job."""
+    job = [ UEL + b"$PJL JOB\r\n@PJL ENTER LANGUAGE=SMART\r\n$PJL BITMAP START\r\n" ]
+    for pnum in range(nbpages):
+        for seqnum in range(8):
+            datas = randomBytes(rand, 16 * 1024)
+            job.append(struct.pack(">IH", len(datas) + 2, seqnum) + datas)
+    job.append(b"$PJL BITMAP END\r\n$PJL EOJ\r\n" + UEL)
+    return b"".join(job)
+
+def zjstream(nbpages, rand):
+    """Returns a little endian ZjStream job."""
+    def chunk(chunktype, datas=b""):
+        """Returns a ZjStream chunk."""
+        return struct.pack("<IIIHH", 16 + len(datas), chunktype, 0, 0, 0x5a5a) + datas
+    job = [ b"ZJZJ", chunk(0) ]                           # StartDoc
+    for pnum in range(nbpages):
+        job.append(chunk(2))                              # StartPage
+        for i in range(4):
+            job.append(chunk(5, randomBytes(rand, 48 * 1024))) # JBIG datas
+        job.append(chunk(3))                              # EndPage
+    job.append(chunk(1))                                  # EndDoc
+    return b"".join(job)
+
+def lidil(nbpages, rand):
+    """Returns an HP LIDIL job."""
+    def packet(packettype, command=0, datas=b""):
+        """Returns a LIDIL packet."""
+        return struct.pack(">cHBBBHH", b"$", 16, 0, packettype, command, 0, len(datas)) \
+                   + b"\xff" * 5 + b"$" + datas
+    job = [ b"$\x01\x00\x00\x07" + b"\x00" * 5 + b"\xff" * 245 + b"$" ]  # Sync
+    for pnum in range(nbpages):
+        job.append(packet(0, 1))                             # LoadPage
+        for i in range(12):
+            job.append(packet(0, 8, randomBytes(rand, 16 * 1024))) # PrintSweep
+        job.append(packet(0, 2))                             # EjectPage
+    job.append(b"$\x00\x10\x00\x08\x00\x00\x00\x00\x00\xff\xff\xff\xff\xff$"   # SyncComplete
+               b"$\x00\x10\x00\x06\x00\x00\x00\x00\x00\xff\xff\xff\xff\xff$")  # Reset
+    return b"".join(job)
+
+def tiff(nbpages, rand):
+    """Returns a little endian multipage bilevel TIFF image."""
+    (width, height) = (1728, 256)
+    strip = randomBytes(rand, (width // 8) * height)
+    job = [ b"II*\x00" + struct.pack("<I", 8 + len(strip)) ] # IFDs follow their strip
+    offset = 8
+    for pnum in range(nbpages):
+        stripoffset = offset
+        offset += len(strip)
+        entries = [ (256, 3, 1, width),         # ImageWidth
+                    (257, 3, 1, height),        # ImageLength
+                    (259, 3, 1, 1),             # Compression
+                    (262, 3, 1, 0),             # PhotometricInterpretation
+                    (273, 4, 1, stripoffset),   # StripOffsets
+                    (278, 3, 1, height),        # RowsPerStrip
+                    (279, 4, 1, len(strip)),    # StripByteCounts
+                  ]
+        ifdsize = 2 + 12 * len(entries) + 4
+        nextifd = (offset + ifdsize + len(strip)) if (pnum < nbpages - 1) else 0
+        ifd = [ struct.pack("<H", len(entries)) ]
+        for (tag, datatype, count, value) in entries:
+            ifd.append(struct.pack("<HHII", tag, datatype, count, value))
+        ifd.append(struct.pack("<I", nextifd))
+        job.append(strip)
+        job.append(b"".join(ifd))
+        offset += ifdsize
+    return b"".join(job)
+
+def postscript(nbpages, rand):
+    """Returns a DSC compliant PostScript document."""
+    job = [ b"%%!PS-Adobe-3.0\n%%%%Creator: pkpgcounter benchmarks\n%%%%Pages: %i\n%%%%EndComments\n" % nbpages ]
+    for pnum in range(1, nbpages + 1):
+        job.append(b"%%%%Page: %i %i\n%%%%BeginPageSetup\n<< /NumCopies 1 >> setpagedevice\n%%%%EndPageSetup\n" % (pnum, pnum))
+        for i in range(200):
+            job.append(b"newpath %i %i moveto (Line %i of page %i) show\n" % (rand.randrange(500), rand.randrange(800), i, pnum))
+        job.append(b"showpage\n")
+    job.append(b"%%Trailer\n%%EOF\n")
+    return b"".join(job)
+
+def pdf(nbpages, rand):
+    """Returns a PDF document, with an incremental update every 10 pages."""
+    datas = [ b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n" ]
+    offsets = {}
+    def size():
+        """Returns the current size of the document."""
+        return sum([len(d) for d in datas])
+    def addObject(num, body):
+        """Appends an object to the document."""
+        offsets[num] = size()
+        datas.append(b"%i 0 obj\n%s\nendobj\n" % (num, body))
+    def addSection(prev):
+        """Appends a cross reference section for the objects added since the previous one."""
+        xrefpos = size()
+        section = [ b"xref\n" ]
+        if prev is None:
+            section.append(b"0 1\n0000000000 65535 f \n")
+        for num in sorted(offsets):
+            section.append(b"%i 1\n%010i 00000 n \n" % (num, offsets[num]))
+        trailer = b"<< /Size %i /Root 1 0 R" % (max(allobjects) + 1)
+        if prev is not None:
+            trailer += b" /Prev %i" % prev
+        section.append(b"trailer\n%s >>\nstartxref\n%i\n%%%%EOF\n" % (trailer, xrefpos))
+        datas.append(b"".join(section))
+        offsets.clear()
+        return xrefpos
+    allobjects = set([1, 2])
+    kids = []
+    prev = None
+    for pnum in range(nbpages):
+        (pagenum, contentnum) = (3 + 2 * pnum, 4 + 2 * pnum)
+        allobjects.update((pagenum, contentnum))
+        content = b"".join([b"BT /F1 12 Tf %i %i Td (Line %i) Tj ET\n" % (rand.randrange(500), rand.randrange(800), i) for i in range(100)])
+        addObject(contentnum, b"<< /Length %i >>\nstream\n%s\nendstream" % (len(content), content))
+        addObject(pagenum, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %i 0 R >>" % contentnum)
+        kids.append(b"%i 0 R" % pagenum)
+        if (pnum % 10 == 9) or (pnum == nbpages - 1):
+            addObject(2, b"<< /Type /Pages /Kids [%s] /Count %i >>" % (b" ".join(kids), len(kids)))
+            if prev is None:
+                addObject(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+            prev = addSection(prev)
+    return b"".join(datas)
+
+def dvi(nbpages, rand):
+    """Returns a DVI document."""
+    job = [ b"\xf7\x02" + struct.pack(">III", 25400000, 473628672, 1000) + b"\x00" ]
+    previous = -1
+    for pnum in range(nbpages):
+        bop = sum([len(d) for d in job])
+        job.append(b"\x8b" + struct.pack(">10i", pnum + 1, *([0] * 9)) + struct.pack(">i", previous))
+        job.append(bytes([rand.randrange(32, 127) for i in range(2000)])) # set_char_i
+        job.append(b"\x8c")
+        previous = bop
+    post = sum([len(d) for d in job])
+    job.append(b"\xf8" + struct.pack(">iIIIIIHH", previous, 25400000, 473628672, 1000, 0, 0, 1, nbpages))
+    job.append(b"\xf9" + struct.pack(">I", post) + b"\x02" + b"\xdf" * 4)
+    return b"".join(job)
+
+def cfax(nbpages, rand):
+    """Returns a Structured Fax document."""
+    pages = []
+    for pnum in range(nbpages):
+        records = b"".join([b"\xd8" + randomBytes(rand, 216) for i in range(200)])
+        offsetnextpage = 1 if (pnum == nbpages - 1) else len(records)
+        pages.append(b"\xfe\x10" + struct.pack("<4BHHII", 0, 0, 0, 0, 1728, 200, 0, offsetnextpage) + records)
+    datas = b"".join(pages)
+    return struct.pack("<4sBBHHHII", b"Sfff", 1, 0, 0, nbpages, 20, 0, 20 + len(datas)) + datas
+
+def hbp(nbpages, rand):
+    """Returns a Brother HBP job."""
+    job = [ UEL + b"@PJL ENTER LANGUAGE = HBP\n" ]
+    for pnum in range(nbpages):
+        job.append(randomBytes(rand, 32 * 1024, exclude=b"@"))
+        job.append(b"@G\x00\x00\x01\xff@F")
+    job.append(UEL)
+    return b"".join(job)
+
+def bj(nbpages, rand):
+    """Returns a Canon BJ job."""
+    job = []
+    for pnum in range(nbpages):
+        job.append(b"\033[K\002\000\000\017")
+        job.append(randomBytes(rand, 32 * 1024, exclude=b"\033"))
+    return b"".join(job)
+
+def escp2(nbpages, rand):
+    """Returns an ESC/P2 job."""
+    job = [ b"\033@" ]
+    for pnum in range(nbpages):
+        for i in range(100):
+            job.append(b"\033(v\002\000\001\000" + randomBytes(rand, 256, exclude=b"\r\n\f\033@"))
+        job.append(b"\r\f\033@")
+    return b"".join(job)
+
+def escpages03(nbpages, rand):
+    """Returns an ESC/PageS03 job, whose size is in its EJL trailer."""
+    job = [ b"\033\001@EJL \n@EJL SE RS=FN\n@EJL EN LA=ESC/PAGES03\n" ]
+    for pnum in range(nbpages):
+        job.append(b"\x1d1pmI\x1d0;0;0;0bmI")
+        for i in range(16):
+            datas = randomBytes(rand, 4 * 1024)
+            job.append(b"\x1d%ieps{I" % len(datas) + datas)
+        job.append(b"\x1d0dpsE")
+    job.append(b"\033\001@EJL \n@EJL JI PAGES=%i\n@EJL EJ\n\033\001@EJL \n" % nbpages)
+    return b"".join(job)
+
+def pnmascii(nbpages, rand):
+    """Returns a series of ASCII PGM images, one per page."""
+    job = []
+    for pnum in range(nbpages):
+        job.append(b"P2\n# Page %i\n128 128\n255\n" % (pnum + 1))
+        for i in range(128):
+            job.append(b" ".join([b"%i" % rand.randrange(256) for j in range(128)]) + b"\n")
+    return b"".join(job)
+
+def pil(nbpages, rand):
+    """Returns a GIF image with a frame per page."""
+    from PIL import Image
+    frames = [ Image.frombytes("L", (256, 256), randomBytes(rand, 256 * 256)) for pnum in range(nbpages) ]
+    output = io.BytesIO()
+    frames[0].save(output, format="GIF", save_all=True, append_images=frames[1:])
+    return output.getvalue()
+
+def ooo(nbpages, rand):
+    """Returns an OpenDocument text whose size is in its metadata."""
+    words = [ "lorem", "ipsum", "dolor", "sit", "amet", "printer", "page", "counter" ]
+    paragraphs = "".join(["<text:p>%s</text:p>" % " ".join([rand.choice(words) for j in range(12)]) for i in range(60 * nbpages)])
+    output = io.BytesIO()
+    archive = zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED)
+    archive.writestr(zipfile.ZipInfo("mimetype"), "application/vnd.oasis.opendocument.text")
+    archive.writestr("meta.xml", '<office:document-meta><office:meta><meta:document-statistic meta:page-count="%i"/></office:meta></office:document-meta>' % nbpages)
+    archive.writestr("content.xml", "<office:document-content><office:body><office:text>%s</office:text></office:body></office:document-content>" % paragraphs)
+    archive.close()
+    return output.getvalue()
+
+def plain(nbpages, rand):
+    """Returns a plain text document, with form feeds between pages."""
+    words = [ b"lorem", b"ipsum", b"dolor", b"sit", b"amet", b"printer", b"page", b"counter" ]
+    pages = []
+    for pnum in range(nbpages):
+        pages.append(b"".join([b" ".join([rand.choice(words) for j in range(12)]) + b"\n" for i in range(60)]))
+    return b"\f".join(pages)
+
+GENERATORS = [ ("pcl5", pcl5),
+               ("pclxl", pclxl),
+               ("qpdl", qpdl),
+               ("spl1", spl1),
+               ("zjstream", zjstream),
+               ("lidil", lidil),
+               ("tiff", tiff),
+               ("postscript", postscript),
+               ("pdf", pdf),
+               ("dvi", dvi),
+               ("cfax", cfax),
+               ("hbp", hbp),
+               ("bj", bj),
+               ("escp2", escp2),
+               ("escpages03", escpages03),
+               ("pnmascii", pnmascii),
+               ("pil", pil),
+               ("ooo", ooo),
+               ("plain", plain),
+             ]
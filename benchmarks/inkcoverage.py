@@ -0,0 +1,155 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter : a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+#
+
+"""This script benchmarks the computation of ink coverage.
+
+It renders a synthetic A4 page at several resolutions, then compares
+the per-pixel reference algorithms with the ones in pkpgpdls.inkcoverage,
+both in speed and in accuracy, for each colorspace.
+
+  $ python benchmarks/inkcoverage.py --resolution 72 --resolution 150
+"""
+
+import sys
+import os
+import time
+import optparse
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import Image, ImageDraw
+
+from pkpgpdls import inkcoverage
+
+A4 = (8.27, 11.69) # in inches
+TOLERANCE = 1e-9   # in percents
+
+def referencePercent(img, nbpix):
+    """Per-pixel reference for the R, G, B and L bands."""
+    result = {}
+    for (i, bandname) in enumerate(img.getbands()):
+        total = 0
+        for value in img.getdata(band=i):
+            total += value
+        result[bandname] = 100.0 * (total / 255.0) / nbpix
+    return result
+
+def referenceBW(img, nbpix):
+    """Per-pixel reference for the BW colorspace."""
+    return { "B": 100.0 - referencePercent(img.convert("L"), nbpix)["L"] }
+
+def referenceRGB(img, nbpix):
+    """Per-pixel reference for the RGB colorspace."""
+    return referencePercent(img.convert("RGB"), nbpix)
+
+def referenceCMY(img, nbpix):
+    """Per-pixel reference for the CMY colorspace."""
+    result = referenceRGB(img, nbpix)
+    return { "C": 100.0 - result["R"],
+             "M": 100.0 - result["G"],
+             "Y": 100.0 - result["B"],
+           }
+
+def referenceCMYK(img, nbpix):
+    """Per-pixel reference for the CMYK colorspace (PrintBill's algorithm)."""
+    cyan = magenta = yellow = black = 0
+    for (r, g, b) in img.convert("RGB").getdata():
+        pixblack = 255 - max(r, g, b)
+        black += pixblack
+        cyan += 255 - r - pixblack
+        magenta += 255 - g - pixblack
+        yellow += 255 - b - pixblack
+    frac = 100.0 / nbpix
+    return { "C": frac * (cyan / 255.0),
+             "M": frac * (magenta / 255.0),
+             "Y": frac * (yellow / 255.0),
+             "K": frac * (black / 255.0),
+           }
+
+def referenceGC(img, nbpix):
+    """Per-pixel reference for the GC colorspace, without early exit."""
+    colored = False
+    for (r, g, b) in img.convert("RGB").getdata():
+        if not (r == g == b):
+            colored = True
+    if colored:
+        return { "G": 0.0, "C": 100.0 }
+    return { "G": 100.0, "C": 0.0 }
+
+def syntheticPage(dpi):
+    """Returns a deterministic RGB page at the given resolution,
+       with gray text-like lines and some coloured areas."""
+    (width, height) = (int(A4[0] * dpi), int(A4[1] * dpi))
+    img = Image.new("RGB", (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    step = max(1, dpi // 6)
+    for y in range(step, height // 2, step):
+        draw.line([(step, y), (width - step, y)], fill=(32, 32, 32), width=max(1, dpi // 72))
+    draw.rectangle([(width // 8, height // 2), (width // 2, 3 * height // 4)], fill=(0, 128, 255))
+    draw.ellipse([(width // 2, height // 2), (7 * width // 8, 7 * height // 8)], fill=(200, 30, 90))
+    return img
+
+def timeIt(function, img, nbpix):
+    """Returns the result of a computation and the time it took."""
+    before = time.time()
+    result = function(img, nbpix)
+    return (result, time.time() - before)
+
+def main():
+    """Runs the benchmark."""
+    parser = optparse.OptionParser(usage="python inkcoverage.py [options]")
+    parser.add_option("-r", "--resolution",
+                            type="int",
+                            action="append",
+                            dest="resolutions",
+                            help="Resolution in DPI to benchmark, can be repeated. Defaults to 72, 150 and 300.")
+    parser.add_option("-c", "--colorspace",
+                            action="append",
+                            dest="colorspaces",
+                            help="Colorspace to benchmark, can be repeated. Defaults to all of them.")
+    (options, arguments) = parser.parse_args()
+    warnings.simplefilter("ignore", DeprecationWarning) # Image.getdata() in recent Pillow
+    resolutions = options.resolutions or [72, 150, 300]
+    colorspaces = [c.upper() for c in (options.colorspaces or ["BW", "RGB", "CMY", "CMYK", "GC"])]
+    failed = False
+    sys.stdout.write("%-6s %5s %12s %12s %9s %12s\n" % ("CSPACE", "DPI", "REFERENCE", "CURRENT", "SPEEDUP", "MAXERROR"))
+    for dpi in resolutions:
+        img = syntheticPage(dpi)
+        nbpix = img.size[0] * img.size[1]
+        for cspace in colorspaces:
+            (expected, reftime) = timeIt(globals()["reference%s" % cspace], img, nbpix)
+            (result, curtime) = timeIt(getattr(inkcoverage, "getPercent%s" % cspace), img, nbpix)
+            maxerror = max([abs(expected[k] - result[k]) for k in expected])
+            if maxerror > TOLERANCE:
+                failed = True
+            sys.stdout.write("%-6s %5i %11.3fs %11.3fs %8.1fx %12g\n" \
+                                % (cspace, dpi, reftime, curtime, reftime / max(curtime, 1e-6), maxerror))
+            sys.stdout.flush()
+    if failed:
+        sys.stderr.write("ERROR: results differ by more than %g%% !\n" % TOLERANCE)
+        return -1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
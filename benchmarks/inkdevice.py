@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter : a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+#
+
+"""This script benchmarks Ghostscript's ink_cov device against the
+conversion to TIFF followed by the computation of CMYK ink coverage
+with PIL, both in speed and in accuracy.
+
+It analyzes the PostScript and PDF documents given on its command
+line, or a synthetic PostScript document if there's none. Ghostscript
+must be installed.
+
+  $ python benchmarks/inkdevice.py --resolution 72 --resolution 300 file1.pdf
+"""
+
+import sys
+import os
+import time
+import random
+import optparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pkpgpdls import analyzer, pdlparser
+
+def syntheticDocument(nbpages, rand):
+    """Returns a PostScript document with gray text and coloured areas."""
+    job = [ b"%%!PS-Adobe-3.0\n%%%%Pages: %i\n%%%%EndComments\n" % nbpages ]
+    for pnum in range(1, nbpages + 1):
+        job.append(b"%%%%Page: %i %i\n/Helvetica findfont 10 scalefont setfont 0.2 setgray\n" % (pnum, pnum))
+        for i in range(rand.randrange(10, 60)):
+            job.append(b"40 %i moveto (Line %i of page %i, with some words in it) show\n" % (800 - 12 * i, i, pnum))
+        for i in range(rand.randrange(4)):
+            job.append(b"%.2f %.2f %.2f setrgbcolor %i %i %i %i rectfill\n" \
+                          % (rand.random(), rand.random(), rand.random(),
+                             rand.randrange(400), rand.randrange(600), rand.randrange(20, 200), rand.randrange(20, 200)))
+        job.append(b"showpage\n")
+    job.append(b"%%EOF\n")
+    return b"".join(job)
+
+def inkCoverage(filename, dpi, inkdevice):
+    """Returns the CMYK ink coverage of a document and the time it took."""
+    before = time.time()
+    parser = analyzer.PDLAnalyzer(filename, analyzer.AnalyzerOptions(colorspace="cmyk",
+                                                                      resolution=dpi,
+                                                                      inkdevice=inkdevice))
+    (cspace, pages) = parser.getInkCoverage()
+    return (pages, time.time() - before)
+
+def main():
+    """Runs the benchmark."""
+    parser = optparse.OptionParser(usage="python inkdevice.py [options] [files]")
+    parser.add_option("-r", "--resolution",
+                            type="int",
+                            action="append",
+                            dest="resolutions",
+                            help="Resolution in DPI to benchmark, can be repeated. Defaults to 72 and 300.")
+    parser.add_option("-p", "--pages",
+                            type="int",
+                            default=20,
+                            dest="pages",
+                            help="Number of pages of the synthetic document. Default is 20.")
+    (options, arguments) = parser.parse_args()
+    if pdlparser.INKDEVICE not in pdlparser.getGhostScriptDevices():
+        sys.stderr.write("ERROR: Ghostscript or its %s device is missing.\n" % pdlparser.INKDEVICE)
+        return -1
+    resolutions = options.resolutions or [72, 300]
+    synthetic = None
+    if not arguments:
+        synthetic = tempfile.NamedTemporaryFile(prefix="pkpgcounter_", suffix=".ps")
+        synthetic.write(syntheticDocument(options.pages, random.Random(42)))
+        synthetic.flush()
+        arguments = [synthetic.name]
+    sys.stdout.write("%-30s %5s %6s %10s %10s %9s %9s %9s\n" \
+                        % ("FILE", "DPI", "PAGES", "TIFF+PIL", "INK_COV", "SPEEDUP", "MEANDIFF", "MAXDIFF"))
+    for filename in arguments:
+        for dpi in resolutions:
+            (expected, reftime) = inkCoverage(filename, dpi, False)
+            (result, curtime) = inkCoverage(filename, dpi, True)
+            if len(expected) != len(result):
+                sys.stderr.write("ERROR: %s has %i pages with TIFF+PIL but %i with %s\n" \
+                                    % (filename, len(expected), len(result), pdlparser.INKDEVICE))
+                continue
+            differences = [abs(e[k] - r[k]) for (e, r) in zip(expected, result) for k in "CMYK"]
+            sys.stdout.write("%-30s %5i %6i %9.3fs %9.3fs %8.1fx %8.3f%% %8.3f%%\n" \
+                                % (os.path.basename(filename)[-30:], dpi, len(result), reftime, curtime,
+                                   reftime / max(curtime, 1e-6),
+                                   sum(differences) / max(len(differences), 1),
+                                   max(differences or [0.0])))
+            sys.stdout.flush()
+    if synthetic is not None:
+        synthetic.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter : a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+#
+
+"""This script benchmarks the PCL3/4/5 page counter.
+
+It generates synthetic raster-heavy, text-heavy, HPGL2 and ImageRunner
+jobs, then compares the byte per byte reference scanner from pcl345ref.py,
+which shares no code with it, with the one in pkpgpdls.pcl345, both
+in speed and in the page dictionnaries they produce.
+
+  $ python benchmarks/pcl345.py --pages 100
+"""
+
+import sys
+import os
+import time
+import random
+import tempfile
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pkpgpdls import pcl345
+
+import pcl345ref
+
+def rasterJob(nbpages, rand):
+    """Returns a job made of 300 DPI raster pages."""
+    job = [ b"\033%-12345X@PJL SET COPIES=2\r\n@PJL ENTER LANGUAGE=PCL\r\n\033E\033&l26a0o1X" ]
+    row = bytes(rand.getrandbits(8) for i in range(300))
+    for pnum in range(nbpages):
+        job.append(b"\033*t300R\033*r2480S\033*r1A")
+        for i in range(600):
+            job.append(b"\033*b0m%iW" % len(row))
+            job.append(row)
+        job.append(b"\033*rB\014")
+    job.append(b"\033E\033%-12345X")
+    return b"".join(job)
+
+def textJob(nbpages, rand):
+    """Returns a job made of text pages with font changes."""
+    job = [ b"\033E\033&l2a0o1X" ]
+    line = b"The quick brown fox jumps over the lazy dog, again and again.\r\n"
+    for pnum in range(nbpages):
+        for i in range(60):
+            job.append(b"\033(s%ib0s3T" % (rand.getrandbits(1) * 3))
+            job.append(line)
+        job.append(b"\014")
+    job.append(b"\033E")
+    return b"".join(job)
+
+def hpgl2Job(nbpages, rand):
+    """Returns a job made of pages with HPGL2 blocks."""
+    job = [ b"\033E\033&l26A" ]
+    for pnum in range(nbpages):
+        job.append(b"\033%0BIN;SP1;")
+        for i in range(1000):
+            job.append(b"PU%i,%i;PD%i,%i;\n" % tuple(rand.randrange(10000) for j in range(4)))
+        job.append(b"\014\033%0A\014")
+    job.append(b"\033E")
+    return b"".join(job)
+
+def imageRunnerJob(nbpages, rand):
+    """Returns a job with Canon ImageRunner headers."""
+    header = b"\xcd\xca\x10\x00\x00\x00\x00\x00" + b"\x00" * 10
+    job = [ header, rasterJob(nbpages, rand) ]
+    return b"".join(job)
+
+JOBS = [ ("raster", rasterJob),
+         ("text", textJob),
+         ("hpgl2", hpgl2Job),
+         ("imagerunner", imageRunnerJob),
+       ]
+
+def runParser(klass, filename, datas):
+    """Runs a parser and returns its page count, page dictionnaries and time."""
+    before = time.time()
+    parser = klass(None, filename, (datas[:pcl345.pdlparser.FIRSTBLOCKSIZE], datas[-pcl345.pdlparser.LASTBLOCKSIZE:]))
+    pagecount = parser.getJobSize()
+    return (pagecount, parser.pages, time.time() - before)
+
+def main():
+    """Runs the benchmark."""
+    parser = optparse.OptionParser(usage="python pcl345.py [options]")
+    parser.add_option("-p", "--pages",
+                            type="int",
+                            default=50,
+                            dest="pages",
+                            help="Number of pages in each generated job. Defaults to 50.")
+    (options, arguments) = parser.parse_args()
+    rand = random.Random(42)
+    failed = False
+    sys.stdout.write("%-12s %9s %12s %12s %9s %6s\n" % ("JOB", "SIZE", "REFERENCE", "CURRENT", "SPEEDUP", "PAGES"))
+    for (name, generator) in JOBS:
+        datas = generator(options.pages, rand)
+        (fd, filename) = tempfile.mkstemp(suffix=".pcl")
+        try:
+            os.write(fd, datas)
+            os.close(fd)
+            (refcount, refpages, reftime) = runParser(pcl345ref.Parser, filename, datas)
+            (curcount, curpages, curtime) = runParser(pcl345.Parser, filename, datas)
+        finally:
+            os.remove(filename)
+        if (refcount, refpages) != (curcount, curpages):
+            failed = True
+            sys.stderr.write("ERROR: %s job: %s pages found instead of %s, or different page dictionnaries !\n" % (name, curcount, refcount))
+        sys.stdout.write("%-12s %8.1fM %11.3fs %11.3fs %8.1fx %6i\n" \
+                            % (name, len(datas) / float(pcl345.pdlparser.MEGABYTE), reftime, curtime, reftime / max(curtime, 1e-6), curcount))
+        sys.stdout.flush()
+    if failed:
+        return -1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter : a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+#
+
+"""This script benchmarks the PCLXL (aka PCL6) page counter.
+
+It generates synthetic jobs in both byte orders, with PJL copies,
+Canon ImageRunner headers, class 3.0 blocks, images or many small
+vector and text tokens, then compares the previous parser from
+pclxlref.py with the one in pkpgpdls.pclxl, both in speed and in
+the page details they produce.
+
+  $ python benchmarks/pclxl.py --pages 50
+"""
+
+import sys
+import os
+import time
+import struct
+import random
+import tempfile
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pkpgpdls import pclxl
+
+import pclxlref
+
+UEL = b"\033%-12345X"
+
+def header(byteorder, pjl=b"", prefix=b""):
+    """Returns the PJL header, stream header and session of a job."""
+    if byteorder == "<":
+        stream = b") HP-PCL XL;3;0;Comment\r\n"
+    else:
+        stream = b"( HP-PCL XL;3;0;Comment\r\n"
+    return b"".join([ prefix,
+                      UEL,
+                      b"@PJL JOB\r\n",
+                      pjl,
+                      b"@PJL ENTER LANGUAGE=PCLXL\r\n",
+                      stream,
+                      b"\xd1" + struct.pack(byteorder + "HH", 600, 600) + b"\xf8\x89\xc0\x00\xf8\x86\x41", # BeginSession
+                      b"\xc0\x00\xf8\x88\x48", # OpenDataSource
+                    ])
+
+def documentJob(nbpages, rand, byteorder="<", pjl=b"", prefix=b"", datasize=300):
+    """Returns a job whose pages have various media and embedded datas."""
+    job = [ header(byteorder, pjl, prefix) ]
+    for pnum in range(nbpages):
+        if pnum % 2:
+            job.append(b"\xc0\x02\xf8\x25")               # A4, by index
+        else:
+            job.append(b"\xc8\xc0\x06LETTER\xf8\x25")     # Letter, by name
+        job.append(b"\xc0\x01\xf8\x28")                   # Landscape
+        job.append(b"\xc0\x05\xf8\x26")                   # Lower cassette
+        job.append(b"\xc8\xc0\x06Glossy\xf8\x27")         # Media type
+        if not pnum % 3:
+            job.append(b"\xc0\x00\xf8\x35")               # Duplex
+        job.append(b"\x43")                               # BeginPage
+        job.append(b"\xc0\x02\xf8\x03\x6a")               # RGB color space
+        for i in range(rand.randrange(1, 5)):
+            datas = bytes(rand.getrandbits(8) for j in range(rand.randrange(1, datasize)))
+            if (len(datas) < 256) and (rand.random() < 0.5):
+                job.append(b"\xb0\xfb" + bytes((len(datas),)) + datas)
+            else:
+                job.append(b"\xb0\xfa" + struct.pack(byteorder + "I", len(datas)) + datas)
+            chars = bytes(rand.getrandbits(8) for j in range(20))
+            job.append(b"\xc9\xc1" + struct.pack(byteorder + "H", 10) + chars + b"\xf8\xa2\xa8")
+            job.append(b"\xd5" + bytes(8) + b"\xf8\x4c\x6b")
+        if pnum % 4 == 1:                                 # Class 3.0 blocks
+            block = bytes(rand.getrandbits(8) for j in range(100))
+            job.append(b"\xc2" + struct.pack(byteorder + "I", len(block)) + b"\xf8\x92\x46" + block)
+            job.append(b"\x31\x90" + struct.pack(byteorder + "I", 7) + bytes(range(1, 8)))
+        if pnum % 5 == 2:
+            job.append(b"\xc1" + struct.pack(byteorder + "H", 3) + b"\xf8\x31\x44") # EndPage with copies
+        else:
+            job.append(b"\x44")
+    job.append(b"\x49\x42" + UEL)
+    return b"".join(job)
+
+def vectorJob(nbpages, rand):
+    """Returns a job made of many small vector and text tokens."""
+    job = [ header("<") ]
+    for pnum in range(nbpages):
+        job.append(b"\xc0\x02\xf8\x25\xc0\x00\xf8\x28\x43")
+        for i in range(5000):
+            job.append(b"\xd3" + struct.pack("<hh", rand.randrange(5000), rand.randrange(5000)) + b"\xf8\x4c\x6b") # SetCursor
+            job.append(b"\xc1\x02\x00\xf8\x51\xc9\xc1\x02\x00\x41\x00\x42\x00\xf8\xa2\xa8") # Text
+        job.append(b"\x44")
+    job.append(b"\x49\x42" + UEL)
+    return b"".join(job)
+
+IMAGERUNNERHEADER = b"\xcd\xca\x10\x00" + bytes(15)
+
+JOBS = [ ("little", lambda nbpages, rand: documentJob(nbpages, rand)),
+         ("big", lambda nbpages, rand: documentJob(nbpages, rand, ">")),
+         ("pjl", lambda nbpages, rand: documentJob(nbpages, rand, pjl=b"@PJL SET COPIES=2\r\n@PJL SET DUPLEX=ON\r\n@PJL SET PAPER=A3\r\n")),
+         ("imagerunner", lambda nbpages, rand: documentJob(nbpages, rand, prefix=IMAGERUNNERHEADER)),
+         ("images", lambda nbpages, rand: documentJob(nbpages, rand, datasize=30000)),
+         ("vectors", vectorJob),
+       ]
+
+def runParser(klass, filename, datas):
+    """Runs a parser and returns its page count, page details and time."""
+    before = time.perf_counter()
+    parser = klass(None, filename, (datas[:pclxl.pdlparser.FIRSTBLOCKSIZE], datas[-pclxl.pdlparser.LASTBLOCKSIZE:]))
+    pagecount = parser.getJobSize()
+    return (pagecount, parser.pagesdetails, time.perf_counter() - before)
+
+def main():
+    """Runs the benchmark."""
+    parser = optparse.OptionParser(usage="python pclxl.py [options]")
+    parser.add_option("-p", "--pages",
+                            type="int",
+                            default=50,
+                            dest="pages",
+                            help="Number of pages in each generated job. Defaults to 50.")
+    (options, arguments) = parser.parse_args()
+    rand = random.Random(42)
+    failed = False
+    sys.stdout.write("%-12s %9s %12s %12s %9s %6s\n" % ("JOB", "SIZE", "REFERENCE", "CURRENT", "SPEEDUP", "PAGES"))
+    for (name, generator) in JOBS:
+        datas = generator(options.pages, rand)
+        (fd, filename) = tempfile.mkstemp(suffix=".pxl")
+        try:
+            os.write(fd, datas)
+            os.close(fd)
+            (refcount, refdetails, reftime) = runParser(pclxlref.Parser, filename, datas)
+            (curcount, curdetails, curtime) = runParser(pclxl.Parser, filename, datas)
+        finally:
+            os.remove(filename)
+        if (refcount, refdetails) != (curcount, curdetails):
+            failed = True
+            sys.stderr.write("ERROR: %s job: %s pages found instead of %s, or different page details !\n" % (name, curcount, refcount))
+        sys.stdout.write("%-12s %8.1fM %11.3fs %11.3fs %8.1fx %6i\n" \
+                            % (name, len(datas) / float(pclxl.pdlparser.MEGABYTE), reftime, curtime, reftime / max(curtime, 1e-6), curcount))
+        sys.stdout.flush()
+    if failed:
+        return -1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter : a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+#
+
+"""This script benchmarks the page counting throughput of each parser.
+
+For each format and number of pages, it generates a synthetic job,
+then counts its pages in a fresh interpreter, to measure its peak
+memory usage without interference from the other runs. Detection of
+the format is included in the timings, like when using pkpgcounter.
+
+Results are written as JSON, and can be compared with the results
+of a previous run, e.g. of another version:
+
+  $ python benchmarks/throughput.py --output before.json
+  $ (apply some changes)
+  $ python benchmarks/throughput.py --compare before.json
+"""
+
+import sys
+import os
+import time
+import json
+import random
+import platform
+import resource
+import tempfile
+import optparse
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from pkpgpdls import analyzer, pdlparser, version
+
+import generators
+
+# Formats known to pkpgcounter which have no generator, and why.
+SKIPPED = { "mscrap" : "Word documents can't be generated, and are counted by converting them with abiword.",
+          }
+
+def getPeakRSS():
+    """Returns the peak resident set size of this process, in KB."""
+    try:
+        # Contrary to ru_maxrss, VmHWM isn't inherited from our parent.
+        status = open("/proc/self/status")
+        try:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+        finally:
+            status.close()
+    except (IOError, OSError, ValueError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(filename, repeat):
+    """Counts the pages in filename, and returns the measures.
+
+       Meant to be run in a fresh interpreter.
+    """
+    result = { "rssbefore": getPeakRSS() }
+    try:
+        best = None
+        for i in range(repeat):
+            before = time.time()
+            parser = analyzer.PDLAnalyzer(filename)
+            pagecount = parser.getJobSize()
+            elapsed = time.time() - before
+            if (best is None) or (elapsed < best):
+                best = elapsed
+        result["detected"] = parser.pdlhandler.format
+        result["pagecount"] = pagecount
+        result["seconds"] = best
+    except Exception as msg:
+        result["error"] = "%s: %s" % (msg.__class__.__name__, msg)
+    result["rsspeak"] = getPeakRSS()
+    return result
+
+def runMeasure(filename, repeat):
+    """Runs measure() in a fresh interpreter and returns its result."""
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--measure", filename, "--repeat", str(repeat)],
+                             stdout=subprocess.PIPE)
+    (output, dummy) = child.communicate()
+    if child.returncode:
+        return { "error": "Measuring process exited with status %i" % child.returncode }
+    return json.loads(output.decode("utf-8"))
+
+def benchmark(formats, sizes, repeat):
+    """Runs the benchmark and returns the list of results."""
+    results = []
+    for (name, reason) in sorted(SKIPPED.items()):
+        if (not formats) or (name in formats):
+            sys.stderr.write("%-10s skipped: %s\n" % (name, reason))
+    for (name, generator) in generators.GENERATORS:
+        if formats and (name not in formats):
+            continue
+        for nbpages in sizes:
+            datas = generator(nbpages, random.Random(nbpages))
+            (fd, filename) = tempfile.mkstemp(prefix="pkpgcounter_", suffix=".%s" % name)
+            try:
+                os.write(fd, datas)
+                os.close(fd)
+                result = runMeasure(filename, repeat)
+            finally:
+                os.remove(filename)
+            result.update({ "format": name,
+                            "pages": nbpages,
+                            "size": len(datas),
+                          })
+            if "seconds" in result:
+                seconds = max(result["seconds"], 1e-6)
+                result["mbps"] = len(datas) / float(pdlparser.MEGABYTE) / seconds
+                result["pagesps"] = nbpages / seconds
+            results.append(result)
+            sys.stderr.write("%s\n" % formatResult(result))
+            sys.stderr.flush()
+    return results
+
+def formatResult(result, reference=None):
+    """Returns a result as a line of text."""
+    line = "%-10s %6i pages %8.2f MB" % (result["format"], result["pages"], result["size"] / float(pdlparser.MEGABYTE))
+    if "error" in result:
+        return "%s  ERROR: %s" % (line, result["error"])
+    line = "%s %9.1f MB/s %10.1f pages/s %8i KB peak RSS" % (line, result["mbps"], result["pagesps"], result["rsspeak"])
+    if result["pagecount"] != result["pages"]:
+        line = "%s  %i pages found as %s" % (line, result["pagecount"], result["detected"])
+    if reference is not None:
+        if "error" in reference:
+            line = "%s  (was in error)" % line
+        else:
+            line = "%s  %+.1f%% speed %+i KB RSS" % (line,
+                                                    100.0 * (result["mbps"] / reference["mbps"] - 1.0),
+                                                    result["rsspeak"] - reference["rsspeak"])
+    return line
+
+def main():
+    """Runs the benchmark."""
+    parser = optparse.OptionParser(usage="python throughput.py [options]")
+    parser.add_option("-f", "--format",
+                            action="append",
+                            dest="formats",
+                            help="Format to benchmark, can be repeated. Defaults to all of them : %s." \
+                                    % ", ".join([n for (n, g) in generators.GENERATORS]))
+    parser.add_option("-p", "--pages",
+                            type="int",
+                            action="append",
+                            dest="sizes",
+                            help="Number of pages in generated jobs, can be repeated. Defaults to 10 and 100.")
+    parser.add_option("-r", "--repeat",
+                            type="int",
+                            default=3,
+                            dest="repeat",
+                            help="Number of runs for each job, the fastest one is kept. Defaults to 3.")
+    parser.add_option("-o", "--output",
+                            dest="output",
+                            help="Writes the JSON results to this file instead of to stdout.")
+    parser.add_option("-c", "--compare",
+                            dest="compare",
+                            help="Compares the results with the ones previously saved in this JSON file.")
+    parser.add_option("--measure",
+                            dest="measure",
+                            help=optparse.SUPPRESS_HELP)
+    (options, arguments) = parser.parse_args()
+    if options.measure:
+        sys.stdout.write(json.dumps(measure(options.measure, max(1, options.repeat))))
+        return 0
+
+    results = { "version": version.__version__,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "repeat": options.repeat,
+                "results": benchmark(options.formats, options.sizes or [10, 100], max(1, options.repeat)),
+              }
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        outfile = open(options.output, "w")
+        try:
+            outfile.write("%s\n" % output)
+        finally:
+            outfile.close()
+    else:
+        sys.stdout.write("%s\n" % output)
+
+    if options.compare:
+        infile = open(options.compare)
+        try:
+            previous = json.load(infile)
+        finally:
+            infile.close()
+        references = dict([((r["format"], r["pages"]), r) for r in previous["results"]])
+        sys.stderr.write("Compared with version %s on Python %s :\n" % (previous["version"], previous["python"]))
+        for result in results["results"]:
+            sys.stderr.write("%s\n" % formatResult(result, references.get((result["format"], result["pages"]), None)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -26,29 +26,132 @@ input files, by automatically detecting the best parser to use."""
 
 import sys
 import os
+import stat
+import time
+import json
 import tempfile
+import shutil
 import logging
 import warnings
+import contextlib
 
-from . import version, pdlparser, postscript, pdf, pcl345, pclxl, hbp, \
-       pil, mscrap, cfax, lidil, escp2, dvi, tiff, ooo, zjstream, \
-       pnmascii, bj, qpdl, spl1, escpages03, plain
-from . import inkcoverage
+from . import version, pdlparser, registry
+from . import incremental
 
 LOG = logging.getLogger("pkpgcounter.analyzer")
 
 VALID_COLORSPACES = ["bw", "rgb", "cmyk", "cmy", "gc"]
 
+SPOOLCHUNK = 16 * pdlparser.MEGABYTE # Bytes copied by the kernel at once
+
+DEFAULTMAXERROR = 2.0   # Percents of error on a page's ink coverage before rendering it again
+MINSHARDPAGES = 4       # Pages below which launching one more Ghostscript isn't worth it
+
+def getProcPath(fd):
+    """Returns a path to the file opened as fd, which our child processes
+       can open too, or None if there's no such path.
+    """
+    path = "/proc/%i/fd/%i" % (os.getpid(), fd)
+    if os.path.exists(path):
+        return path
+    return None
+
+def getFileDescriptor(infile):
+    """Returns the file descriptor behind a file-like object, or None."""
+    try:
+        return infile.fileno()
+    except (AttributeError, IOError, ValueError):
+        return None
+
+def spoolFile(infile, infd, outfile):
+    """Copies what remains to be read from infile to outfile.
+
+       Regular files are copied with sendfile() and pipes with
+       splice(), so their content doesn't go through Python.
+       Other files are copied by reading them.
+    """
+    mode = os.fstat(infd).st_mode if (infd is not None) else 0
+    try:
+        if stat.S_ISREG(mode):
+            offset = infile.tell()
+            while True:
+                sent = os.sendfile(outfile.fileno(), infd, offset, SPOOLCHUNK)
+                if not sent:
+                    return
+                offset += sent
+        elif stat.S_ISFIFO(mode) and hasattr(os, "splice"):
+            if hasattr(infile, "peek"):
+                # Copies what was already read into infile's buffer, if anything
+                pending = infile.peek(1)
+                outfile.write(pending)
+                infile.read(len(pending))
+            outfile.flush()
+            while os.splice(infd, outfile.fileno(), SPOOLCHUNK):
+                pass
+            return
+    except OSError as msg:
+        LOG.debug("Impossible to spool with the kernel (%s)" % msg)
+        outfile.seek(0, 2)
+    while True:
+        data = infile.read(pdlparser.MEGABYTE)
+        if not data:
+            break
+        outfile.write(data)
+
+
+def planShards(nbpages, nbshards, minpages=MINSHARDPAGES):
+    """Splits the pages 1 to nbpages in at most nbshards ranges of at least
+       minpages consecutive pages, and returns the list of their (first, last)
+       pages numbers. The last range has None as its last page, so that it
+       goes up to the end of the job whatever its real number of pages.
+    """
+    nbshards = max(1, min(nbshards, nbpages // minpages))
+    (size, remainder) = divmod(nbpages, nbshards)
+    shards = []
+    first = 1
+    for snum in range(nbshards):
+        last = first + size - 1 + (snum < remainder)
+        shards.append((first, last))
+        first = last + 1
+    shards[-1] = (shards[-1][0], None)
+    return shards
+
 
 class AnalyzerOptions:
     """A class for use as the options parameter to PDLAnalyzer's constructor."""
     def __init__(self, debug=None,
                        colorspace=None,
-                       resolution=None):
+                       resolution=None,
+                       jobs=None,
+                       streaming=False,
+                       gspool=None,
+                       cache=None,
+                       cachesize=None,
+                       pageindex=False,
+                       dsctrailer=False,
+                       timings=None,
+                       adaptive=None,
+                       maxerror=None,
+                       thresholds=None,
+                       inkdevice=False,
+                       shards=None):
         """Sets initial attributes."""
         self.debug = debug
         self.colorspace = colorspace
         self.resolution = resolution
+        self.jobs = jobs
+        self.streaming = streaming
+        self.gspool = gspool
+        self.cache = cache
+        self.cachesize = cachesize
+        self.pageindex = pageindex
+        self.dsctrailer = dsctrailer
+        self.timings = timings
+        self.adaptive = adaptive
+        self.maxerror = maxerror
+        self.thresholds = thresholds
+        self.inkdevice = inkdevice
+        self.shards = shards
 
 
 class PDLAnalyzer:
@@ -58,32 +161,202 @@ class PDLAnalyzer:
 
            filename is the name of the file or '-' for stdin.
            filename can also be a file-like object which
-           supports read() and seek().
+           supports read() and seek(), or None if the job's
+           datas are given with feed().
         """
         self.options = options
         self.filename = filename
+        if isinstance(filename, str) and (filename != "-"):
+            self.jobname = filename
+        else:
+            self.jobname = None
+        if isinstance(filename, str):
+            self.name = filename
+        elif isinstance(getattr(filename, "name", None), str):
+            self.name = filename.name
+        else:
+            self.name = "-"     # Anonymous stream, or datas given with feed()
+        self.source = None      # Our own descriptor on the job's datas, unless they're in a named file
+        self.workname = None    # Path to the job's datas, for the parsers and their commands
         self.workfile = None
+        self.digest = None
+        self.firstblock = None
+        self.counter = None
+        self.pagesdetails = None    # Details of each page, once getOpenedJobSize() was called
+        if getattr(options, "timings", None):
+            self.timings = []
+        else:
+            self.timings = None
 
         self._parser = None
 
+    def timePhase(self, name, **details):
+        """Returns a context manager which times a phase of the analysis.
+
+           It yields the phase's record, to which details can be added,
+           or None if timings are disabled, in which case it does nothing.
+           Once the phase is finished, its record is appended to the
+           timings attribute, and passed to options.timings if it is
+           a function.
+        """
+        if self.timings is None:
+            return pdlparser.NOTIMING
+        return self.recordPhase(name, details)
+
+    @contextlib.contextmanager
+    def recordPhase(self, name, details):
+        """Times a phase of the analysis, see timePhase()."""
+        record = { "filename": self.jobname or "-", "phase": name }
+        record.update(details)
+        start = time.monotonic()
+        try:
+            yield record
+        except BaseException as msg:
+            record["error"] = msg.__class__.__name__
+            raise
+        finally:
+            record["seconds"] = time.monotonic() - start
+            self.timings.append(record)
+            if callable(self.options.timings):
+                self.options.timings(record)
+
+    def getCache(self):
+        """Returns the results cache to use, or None if caching is disabled."""
+        filename = getattr(self.options, "cache", None)
+        if not filename:
+            return None
+        from . import cache
+        return cache.getCache(filename, getattr(self.options, "cachesize", None))
+
+    def getCacheKey(self, kind, *parameters):
+        """Returns the cache key for a kind of result on the opened input file."""
+        from . import cache
+        if self.digest is None:
+            self.digest = cache.getFileDigest(self.workname)
+        return cache.makeKey(self.digest, kind, *parameters)
+
     def getJobSize(self):
         """Returns the job's size."""
-        size = 0
         self.openFile()
         try:
-            try:
-                self.pdlhandler.getJobSize()
-            except pdlparser.PDLParserError as msg:
-                raise pdlparser.PDLParserError("Unsupported file format for %s (%s)" % (self.filename, msg))
+            return self.getOpenedJobSize()
         finally:
             self.closeFile()
+
+    def getOpenedJobSize(self):
+        """Returns the size of the already opened job, from the cache if possible.
+
+           The details of each page, if the parser extracts them, are
+           cached along with the size and set as the pagesdetails
+           attribute.
+        """
+        indexname = self.getPageIndexFilename()
+        cache = self.getCache()
+        if cache is not None:
+            with self.timePhase("cache") as phase:
+                key = self.getCacheKey("jobsize", bool(getattr(self.options, "dsctrailer", False)))
+                cached = cache.get(key)
+                if phase is not None:
+                    phase["hit"] = cached is not None
+            if isinstance(cached, list) and ((indexname is None) or os.path.exists(indexname)):
+                (size, self.pagesdetails) = cached
+                return size
+        try:
+            pdlhandler = self.pdlhandler
+            with self.timePhase("parsing", parser=pdlhandler.format) as phase:
+                size = pdlhandler.getJobSize()
+                if phase is not None:
+                    phase["bytes"] = os.fstat(self.workfile.fileno()).st_size
+        except pdlparser.PDLParserError as msg:
+            raise pdlparser.PDLParserError("Unsupported file format for %s (%s)" % (self.name, msg))
+        self.pagesdetails = pdlhandler.pagesdetails
+        if indexname is not None:
+            self.savePageIndex(indexname)
+        if cache is not None:
+            cache.set(key, (size, self.pagesdetails))
         return size
 
-    def getInkCoverage(self, colorspace=None, resolution=None):
-        """Extracts the percents of ink coverage from the input file."""
-        result = None
+    def savePageIndex(self, indexname):
+        """Saves the page index built by the parser, if any."""
+        if self.pdlhandler.pageindex is not None:
+            try:
+                self.pdlhandler.pageindex.save(indexname)
+            except (IOError, OSError) as msg:
+                LOG.warning("Impossible to save the page index %s: %s" % (indexname, msg))
+            else:
+                LOG.debug("Page index saved to %s" % indexname)
+
+    def getPageIndexFilename(self):
+        """Returns the name of the page index to save next to the job, or None.
+
+           Only jobs given by their file name can have a page index.
+        """
+        if getattr(self.options, "pageindex", False) and (self.jobname is not None):
+            from . import pageindex
+            return pageindex.getIndexFilename(self.jobname)
+        return None
+
+    def feed(self, data):
+        """Adds a chunk of the job's datas, while it is being received.
+
+           Returns the number of pages seen so far, without copies,
+           or 0 if the job's format can't be counted incrementally,
+           see the incremental module. Call result() once all the
+           datas have been fed to get the job's size.
+        """
+        if self.source is None:
+            (self.source, self.workname) = self.createSpoolFile()
+            self.firstblock = b""
+        self.source.write(data)
+        if self.firstblock is not None:
+            self.firstblock += data
+            if len(self.firstblock) >= pdlparser.FIRSTBLOCKSIZE:
+                self.startCounter()
+        elif self.counter is not None:
+            return self.counter.feed(data)
+        return self.getRunningCount()
+
+    def startCounter(self):
+        """Chooses an incremental counter from the format of the first block of the job.
+
+           The job's last block isn't known yet, so formats detected
+           from it are only known once the whole job was received.
+        """
+        (firstblock, self.firstblock) = (self.firstblock, None)
+        self.source.flush()
+        (entry, parser, tried) = self.findParser(firstblock, firstblock[-pdlparser.LASTBLOCKSIZE:])
+        if entry is not None:
+            self.counter = incremental.getCounter(entry.modulename)
+        if self.counter is not None:
+            self.counter.feed(firstblock)
+
+    def getRunningCount(self):
+        """Returns the number of pages seen so far by feed()."""
+        if self.counter is None:
+            return 0
+        return self.counter.pagecount
+
+    def result(self):
+        """Returns the job's size, once all its datas have been fed."""
+        if self.source is None:
+            raise pdlparser.PDLParserError("No data was fed")
+        if self.firstblock is not None:
+            self.startCounter()
+        if self.counter is not None:
+            LOG.debug("Incremental count: %i pages" % self.counter.close())
+            self.counter = None
+        self.source.flush()
+        return self.getJobSize()
+
+    def getInkCoverageParameters(self, colorspace=None, resolution=None, jobs=None):
+        """Checks the parameters for the computation of ink coverage.
+
+           Returns the (colorspace, resolution, jobs) tuple to use,
+           with default values taken from the options.
+        """
         cspace = colorspace or self.options.colorspace
         res = resolution or self.options.resolution
+        nbjobs = jobs or getattr(self.options, "jobs", None) or 1
         if not res:
             raise RuntimeError("No resolution given")
         if not isinstance(res, int):
@@ -92,56 +365,376 @@ class PDLAnalyzer:
             raise RuntimeError("No colorspace given" % cspace)
         if not cspace in VALID_COLORSPACES:
             raise RuntimeError("Invalid colorspace %s given. Valid colorspaces are : %s" % (cspace, VALID_COLORSPACES))
+        if not isinstance(nbjobs, int) or (nbjobs < 1):
+            raise RuntimeError("Wrong number of jobs %s. Must be a positive int." % repr(nbjobs))
+        return (cspace, res, nbjobs)
 
+    def getAdaptiveParameters(self):
+        """Returns the (resolution, maxerror, thresholds) tuple to use to
+           render again the pages whose ink coverage isn't known precisely
+           enough, or None if the options don't ask for it.
+        """
+        highres = getattr(self.options, "adaptive", None)
+        if not highres:
+            return None
+        if not isinstance(highres, int):
+            raise RuntimeError("Wrong type of adaptive resolution. Not an int. %s" % type(highres))
+        maxerror = getattr(self.options, "maxerror", None)
+        if maxerror is None:
+            maxerror = DEFAULTMAXERROR
+        thresholds = tuple(sorted(getattr(self.options, "thresholds", None) or []))
+        return (highres, float(maxerror), thresholds)
+
+    def wantsInkDevice(self, cspace):
+        """Returns True if the options ask Ghostscript to compute the ink coverage in this colorspace, else False."""
+        return (cspace.lower() == "cmyk") and bool(getattr(self.options, "inkdevice", False))
+
+    def getShardsNumber(self):
+        """Returns the number of Ghostscript processes which may convert
+           ranges of pages of the job at the same time, one per CPU if the
+           shards option is 0, or 1 if it isn't set.
+        """
+        nbshards = getattr(self.options, "shards", None)
+        if nbshards is None:
+            return 1
+        if not isinstance(nbshards, int) or (nbshards < 0):
+            raise RuntimeError("Wrong number of shards %s. Must be a positive int or 0." % repr(nbshards))
+        return nbshards or os.cpu_count() or 1
+
+    def getInkCoverage(self, colorspace=None, resolution=None, jobs=None, streaming=None):
+        """Extracts the percents of ink coverage from the input file.
+
+           jobs is the number of processes to use to compute the
+           pages' ink coverage in parallel, defaults to 1.
+
+           If streaming is True, the input file is rendered page
+           per page instead of as a whole multi-page TIFF document,
+           see iterInkCoverage().
+
+           If the adaptive option is set, streaming is not possible,
+           see computeAdaptiveInkCoverage().
+        """
+        if streaming is None:
+            streaming = getattr(self.options, "streaming", False)
+        if streaming and (self.getAdaptiveParameters() is None):
+            (cspace, res, nbjobs) = self.getInkCoverageParameters(colorspace, resolution, jobs)
+            return (cspace.upper(), list(self.iterInkCoverage(cspace, res, nbjobs)))
+
+        (cspace, res, nbjobs) = self.getInkCoverageParameters(colorspace, resolution, jobs)
         self.openFile()
         try:
+            return self.getOpenedInkCoverage(cspace, res, nbjobs)
+        finally:
+            self.closeFile()
+
+    def getOpenedInkCoverage(self, cspace, res, nbjobs):
+        """Returns the ink coverage of the already opened job, from the cache if possible."""
+        adaptive = self.getAdaptiveParameters()
+        if adaptive is not None:
+            variant = adaptive
+        elif self.wantsInkDevice(cspace):
+            variant = (pdlparser.INKDEVICE,)
+        else:
+            variant = ()
+        cache = self.getCache()
+        if cache is not None:
+            with self.timePhase("cache") as phase:
+                key = self.getCacheKey("inkcoverage", cspace, res, *variant)
+                cached = cache.get(key)
+                if phase is not None:
+                    phase["hit"] = cached is not None
+            if cached is not None:
+                return tuple(cached)
+        try:
+            if adaptive is None:
+                result = self.computeInkCoverage(cspace, res, nbjobs)
+            else:
+                result = self.computeAdaptiveInkCoverage(cspace, res, nbjobs, adaptive)
+        except pdlparser.PDLParserError as msg:
+            raise pdlparser.PDLParserError("Unsupported file format for %s (%s)" % (self.name, msg))
+        if cache is not None:
+            cache.set(key, result)
+        return result
+
+    def computeInkCoverage(self, cspace, res, nbjobs, errors=False):
+        """Converts the already opened input file to a multi-page TIFF document,
+           and returns the ink coverage of its pages, with their error
+           estimates if errors is True.
+
+           If the options ask for it, Ghostscript computes the CMYK
+           ink coverage itself when it can, without any conversion.
+        """
+        pdlhandler = self.pdlhandler
+        if (not errors) and self.wantsInkDevice(cspace) and pdlhandler.canComputeInkCoverage():
             try:
-                dummyfile = tempfile.NamedTemporaryFile(mode="w+b",
-                                                        prefix="pkpgcounter_",
-                                                        suffix=".tiff",
-                                                        dir=os.environ.get("PYKOTADIRECTORY") or tempfile.gettempdir())
-                filename = dummyfile.name
-                try:
-                    self.pdlhandler.convertToTiffMultiPage24NC(filename, res)
-                    result = inkcoverage.getInkCoverage(filename, cspace)
-                finally:
-                    dummyfile.close()
+                with self.timePhase("inkdevice", parser=pdlhandler.format, resolution=res) as phase:
+                    pages = pdlhandler.computeInkCoverage(res)
+                    if phase is not None:
+                        phase["pages"] = len(pages)
+                return ("CMYK", pages)
+            except pdlparser.PDLParserError as msg:
+                LOG.debug("%s Converting %s to TIFF instead." % (msg, self.name))
+        if (self.getShardsNumber() > 1) and pdlhandler.canConvertShards():
+            try:
+                result = self.computeShardedInkCoverage(cspace, res, nbjobs, errors)
+            except pdlparser.PDLParserError as msg:
+                LOG.debug("%s Converting %s to TIFF as a whole instead." % (msg, self.name))
+            else:
+                if result is not None:
+                    return result
+        dummyfile = tempfile.NamedTemporaryFile(mode="w+b",
+                                                prefix="pkpgcounter_",
+                                                suffix=".tiff",
+                                                dir=os.environ.get("PYKOTADIRECTORY") or tempfile.gettempdir())
+        filename = dummyfile.name
+        try:
+            with self.timePhase("rasterization", parser=pdlhandler.format, resolution=res) as phase:
+                pdlhandler.convertToTiffMultiPage24NC(filename, res)
+                if phase is not None:
+                    phase["bytes"] = os.stat(filename).st_size
+            from . import inkcoverage
+            with self.timePhase("inkcoverage", colorspace=cspace) as phase:
+                result = inkcoverage.getInkCoverage(filename, cspace, nbjobs, errors)
+                if phase is not None:
+                    phase["pages"] = len(result[1])
+            return result
+        finally:
+            dummyfile.close()
+
+    def computeShardedInkCoverage(self, cspace, res, nbjobs, errors=False):
+        """Converts ranges of pages of the already opened input file to as many
+           multi-page TIFF documents at the same time, and returns the ink
+           coverage of its pages, in order, with their error estimates if
+           errors is True.
+
+           The ranges are planned from the number of pages in the job,
+           without copies. Returns None if the job is too small to be
+           split, or if only Ghostscript could count its pages.
+        """
+        pdlhandler = self.pdlhandler
+        nbpages = pdlhandler.getNbPages()
+        if not nbpages:
+            return None
+        shards = planShards(nbpages, self.getShardsNumber())
+        if len(shards) < 2:
+            return None
+        from . import inkcoverage
+        tempdir = os.environ.get("PYKOTADIRECTORY") or tempfile.gettempdir()
+        dummyfiles = [tempfile.NamedTemporaryFile(mode="w+b", prefix="pkpgcounter_", suffix=".tiff", dir=tempdir)
+                          for shard in shards]
+        filenames = [dummyfile.name for dummyfile in dummyfiles]
+        try:
+            with self.timePhase("rasterization", parser=pdlhandler.format, resolution=res, shards=len(shards)) as phase:
+                pdlhandler.convertShardsToTiff(filenames, res, shards)
+                if phase is not None:
+                    phase["bytes"] = sum([os.stat(filename).st_size for filename in filenames if os.path.exists(filename)])
+            pages = []
+            ended = False
+            with self.timePhase("inkcoverage", colorspace=cspace) as phase:
+                for (filename, (first, last)) in zip(filenames, shards):
+                    if os.path.exists(filename) and os.stat(filename).st_size:
+                        shardpages = inkcoverage.getInkCoverage(filename, cspace, nbjobs, errors)[1]
+                    else:
+                        shardpages = []
+                    planned = len(shardpages) if (last is None) else (last - first + 1)
+                    # The job may still end before the last range, e.g. if
+                    # some DSC comments are wrong. Any other difference
+                    # means the ranges weren't honoured.
+                    if (len(shardpages) > planned) or (ended and shardpages):
+                        raise pdlparser.PDLParserError("Unexpected number of pages in range %i to %s." % (first, last or "end"))
+                    ended = len(shardpages) < planned
+                    pages.extend(shardpages)
+                if phase is not None:
+                    phase["pages"] = len(pages)
+            if not pages:
+                raise pdlparser.PDLParserError("Problem during conversion to TIFF.")
+            return (cspace.upper(), pages)
+        finally:
+            for dummyfile in dummyfiles:
+                dummyfile.close()
+
+    def computeAdaptiveInkCoverage(self, cspace, res, nbjobs, adaptive):
+        """Returns the ink coverage of the already opened job's pages rendered
+           at res dpi, except for the pages whose ink coverage isn't known
+           precisely enough, which are rendered again at a higher resolution.
+
+           adaptive is the (resolution, maxerror, thresholds) tuple returned
+           by getAdaptiveParameters(). Each page also contains the resolution
+           it was rendered at as "dpi", and the error estimate of its ink
+           coverage as "error", in percents.
+        """
+        (highres, maxerror, thresholds) = adaptive
+        from . import inkcoverage
+        (cspace, pages) = self.computeInkCoverage(cspace, res, nbjobs, errors=True)
+        for page in pages:
+            page["dpi"] = res
+        uncertain = [pnum for (pnum, page) in enumerate(pages)
+                         if inkcoverage.isUncertain(page, cspace, maxerror, thresholds)]
+        if (not uncertain) or (highres <= res):
+            return (cspace, pages)
+        pdlhandler = self.pdlhandler
+        if not pdlhandler.canRenderPages():
+            LOG.debug("Impossible to render some pages of %s again at %i dpi" % (self.name, highres))
+            return (cspace, pages)
+        outdir = tempfile.mkdtemp(prefix="pkpgcounter_",
+                                  dir=os.environ.get("PYKOTADIRECTORY") or tempfile.gettempdir())
+        try:
+            with self.timePhase("refinement", colorspace=cspace, resolution=highres, pages=len(uncertain)):
+                pagefiles = pdlhandler.convertToRasterPages(outdir, highres, [pnum + 1 for pnum in uncertain])
+                refined = list(inkcoverage.iterInkCoverage(pagefiles, cspace, nbjobs, errors=True))
+        finally:
+            shutil.rmtree(outdir, ignore_errors=True)
+        if (len(refined) == len(pages)) and (len(refined) != len(uncertain)):
+            # Ghostscript doesn't know how to select pages in this file format
+            refined = [refined[pnum] for pnum in uncertain]
+        elif len(refined) != len(uncertain):
+            LOG.debug("%i pages of %s rendered again instead of %i" % (len(refined), self.name, len(uncertain)))
+            return (cspace, pages)
+        for (pnum, page) in zip(uncertain, refined):
+            page["dpi"] = highres
+            pages[pnum] = page
+        return (cspace, pages)
+
+    def iterInkCoverage(self, colorspace=None, resolution=None, jobs=None):
+        """Generator which yields, for each page, a dictionnary containing
+           the percent of ink coverage for each color component.
+
+           Pages are rendered one file per page in a temporary directory,
+           and each page's file is deleted as soon as its ink coverage
+           is known, so the first results are available while rendering
+           goes on and only a few pages are on disk at any time.
+
+           File formats which can't be rendered this way are converted
+           to a multi-page TIFF document first, as getInkCoverage() does.
+        """
+        (cspace, res, nbjobs) = self.getInkCoverageParameters(colorspace, resolution, jobs)
+        self.openFile()
+        try:
+            cache = self.getCache()
+            if cache is not None:
+                key = self.getCacheKey("inkcoverage", cspace, res)
+                cached = cache.get(key)
+                if cached is not None:
+                    for page in cached[1]:
+                        yield page
+                    return
+            pages = []
+            try:
+                if not self.pdlhandler.canRenderPages():
+                    for page in self.computeInkCoverage(cspace, res, nbjobs)[1]:
+                        pages.append(page)
+                        yield page
+                else:
+                    outdir = tempfile.mkdtemp(prefix="pkpgcounter_",
+                                              dir=os.environ.get("PYKOTADIRECTORY") or tempfile.gettempdir())
+                    try:
+                        pagefiles = self.pdlhandler.convertToRasterPages(outdir, res)
+                        from . import inkcoverage
+                        # Includes the rasterization, and the time taken by our caller
+                        with self.timePhase("inkcoverage", colorspace=cspace, streaming=True) as phase:
+                            for page in inkcoverage.iterInkCoverage(pagefiles, cspace, nbjobs):
+                                pages.append(page)
+                                yield page
+                            if phase is not None:
+                                phase["pages"] = len(pages)
+                    finally:
+                        shutil.rmtree(outdir, ignore_errors=True)
             except pdlparser.PDLParserError as msg:
-                raise pdlparser.PDLParserError("Unsupported file format for %s (%s)" % (self.filename, msg))
+                raise pdlparser.PDLParserError("Unsupported file format for %s (%s)" % (self.name, msg))
+            if cache is not None:
+                cache.set(key, (cspace.upper(), pages))
         finally:
             self.closeFile()
-        return result
 
     def openFile(self):
         """Opens the job's data stream for reading."""
+        with self.timePhase("open") as phase:
+            self.openInput()
+            if phase is not None:
+                phase["bytes"] = os.fstat(self.workfile.fileno()).st_size
+
+    def openInput(self):
+        """Opens the job's data stream for reading."""
+        self.digest = None
+        if self.workname is None:
+            self.workname = self.openSource()
+        self.workfile = open(self.workname, "rb")
+
+    def openSource(self):
+        """Returns a path to the job's datas, which the parsers and
+           their child processes can open.
+
+           Unless filename is the name of a file, the job's datas are
+           kept opened in the source attribute for the analyzer's
+           lifetime, so that this path stays valid. Standard input
+           and file-like objects which are regular files read from
+           their start are used directly. Others are spooled to a
+           temporary file, in memory if possible.
+        """
         if hasattr(self.filename, "read") and hasattr(self.filename, "seek"):
             # filename is in fact a file-like object
             infile = self.filename
         elif self.filename == "-":
             # we must read from stdin
-            infile = sys.stdin
+            infile = sys.stdin.buffer
         else:
             # normal file
-            self.workfile = open(self.filename, "rb")
-            return
+            return self.filename
+
+        infd = getFileDescriptor(infile)
+        if infd is not None:
+            try:
+                direct = stat.S_ISREG(os.fstat(infd).st_mode) and (infile.tell() == 0)
+            except (IOError, OSError):
+                direct = False
+            if direct:
+                self.source = os.fdopen(os.dup(infd), "rb")
+                path = getProcPath(self.source.fileno())
+                if path is not None:
+                    LOG.debug("Reading %s directly." % self.name)
+                    return path
+                self.source.close()
 
         # Use a temporary file, always seekable contrary to standard input.
-        self.workfile = tempfile.NamedTemporaryFile(mode="w+b",
-                                                    prefix="pkpgcounter_",
-                                                    suffix=".prn",
-                                                    dir=os.environ.get("PYKOTADIRECTORY") or tempfile.gettempdir())
-        self.filename = self.workfile.name
-        while True:
-            data = infile.read(pdlparser.MEGABYTE)
-            if not data:
-                break
-            self.workfile.write(data)
-        self.workfile.flush()
-        self.workfile.seek(0)
+        (self.source, path) = self.createSpoolFile()
+        spoolFile(infile, infd, self.source)
+        self.source.flush()
+        return path
+
+    def createSpoolFile(self):
+        """Returns a new temporary file and its name.
+
+           The file lives in memory, unless $PYKOTADIRECTORY
+           tells us where to put temporary files.
+        """
+        directory = os.environ.get("PYKOTADIRECTORY")
+        if (not directory) and hasattr(os, "memfd_create"):
+            try:
+                fd = os.memfd_create("pkpgcounter")
+            except OSError as msg:
+                LOG.debug("Impossible to create a memory file (%s)" % msg)
+            else:
+                path = getProcPath(fd)
+                if path is not None:
+                    return (os.fdopen(fd, "w+b"), path)
+                os.close(fd)
+        workfile = tempfile.NamedTemporaryFile(mode="w+b",
+                                               prefix="pkpgcounter_",
+                                               suffix=".prn",
+                                               dir=directory or tempfile.gettempdir())
+        return (workfile, workfile.name)
 
     def closeFile(self):
         """Closes the job's data stream if we have to."""
-        self.workfile.close()
+        if self.workfile is not None:
+            self.workfile.close()
+
+    def close(self):
+        """Releases the job's datas, once the analyzer isn't needed anymore."""
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+        self.workname = None
 
     def readFirstAndLastBlocks(self, inputfile):
         """Reads the first and last blocks of data."""
@@ -166,6 +759,23 @@ class PDLAnalyzer:
         warnings.warn("deprecated - use property self.pdlhandler", DeprecationWarning)
         return self.pdlhandler
 
+    def findParser(self, firstblock, lastblock):
+        """Returns the registry entry of the first parser which accepts the job,
+           the parser, and the number of parsers tried, or (None, None, tried).
+        """
+        tried = 0
+        for entry in registry.getRegistry().getCandidates(firstblock):
+            tried += 1
+            try:
+                parser = entry.getParser()(self, self.workname,
+                                           (firstblock, lastblock))
+            except pdlparser.PDLParserError:
+                pass # try next parser
+            else:
+                LOG.debug("Parser = %s" % entry.modulename)
+                return (entry, parser, tried)
+        return (None, None, tried)
+
     def _detectPDLHandler(self):
         """Tries to autodetect the document format.
 
@@ -175,45 +785,125 @@ class PDLAnalyzer:
         if self._parser:
             return
 
-        if not os.stat(self.filename).st_size:
-            raise pdlparser.PDLParserError("input file %s is empty !" % str(self.filename))
-        (firstblock, lastblock) = self.readFirstAndLastBlocks(self.workfile)
-        # IMPORTANT: the order is important below. FIXME.
-        for module in (postscript, \
-                       pclxl, \
-                       pdf, \
-                       qpdl, \
-                       spl1, \
-                       dvi, \
-                       tiff, \
-                       cfax, \
-                       zjstream, \
-                       ooo, \
-                       hbp, \
-                       lidil, \
-                       pcl345, \
-                       escp2, \
-                       escpages03, \
-                       bj, \
-                       pnmascii, \
-                       pil, \
-                       mscrap, \
-                       plain):     # IMPORTANT: don't move this one up !
-            try:
-                self._parser = module.Parser(self, self.filename,
-                                           (firstblock, lastblock))
-                LOG.debug("Parser = %s" % module.__name__)
-                break
-            except pdlparser.PDLParserError:
-                pass # try next parser
+        with self.timePhase("detection") as phase:
+            (firstblock, lastblock) = self.readFirstAndLastBlocks(self.workfile)
+            if not firstblock:
+                raise pdlparser.PDLParserError("input file %s is empty !" % self.name)
+            (entry, self._parser, tried) = self.findParser(firstblock, lastblock)
+            if phase is not None:
+                phase["tried"] = tried
+                if self._parser:
+                    phase["parser"] = self._parser.format
 
         if not self._parser:
             raise pdlparser.PDLParserError("Analysis of first data block failed.")
 
+def analyzeFile(filename, options=AnalyzerOptions()):
+    """Analyzes a file, for the batch and JSON Lines modes.
+
+       Returns a dictionnary with the file's name, format, number
+       of pages, the details of each page if the parser extracted
+       them, its ink coverage if options.colorspace is set, the
+       seconds taken, and the timings of each phase if options.timings
+       is set. If the analysis failed, an error is set instead of the
+       results.
+    """
+    before = time.time()
+    record = { "filename": filename }
+    try:
+        parser = PDLAnalyzer(filename, options)
+        parser.openFile()
+        try:
+            record["format"] = parser.pdlhandler.format
+            record["pages"] = parser.getOpenedJobSize()
+            if parser.pagesdetails is not None:
+                record["details"] = parser.pagesdetails
+            if options.colorspace:
+                (cspace, res, nbjobs) = parser.getInkCoverageParameters()
+                (cspace, pages) = parser.getOpenedInkCoverage(cspace, res, nbjobs)
+                record["inkcoverage"] = { "colorspace": cspace, "pages": pages }
+        finally:
+            parser.closeFile()
+            parser.close()
+            if parser.timings is not None:
+                record["timings"] = parser.timings
+    except (IOError, OSError, RuntimeError, pdlparser.PDLParserError) as msg:
+        record["error"] = str(msg)
+    except Exception as msg: # One broken file mustn't stop the whole batch
+        record["error"] = "%s: %s" % (msg.__class__.__name__, msg)
+    record["seconds"] = time.time() - before
+    return record
+
+def writeTiming(record):
+    """Outputs the record of a phase of an analysis, for --timings."""
+    details = ", ".join(["%s=%s" % (k, v) for (k, v) in sorted(record.items()) if k not in ("filename", "phase", "seconds")])
+    sys.stderr.write("TIMING\t%s\t%s\t%.6f\t%s\n" % (record["filename"], record["phase"], record["seconds"], details))
+    sys.stderr.flush()
+
+def writeRecord(record, outputformat):
+    """Outputs the results of analyzeFile() as a line of JSON, or of tab separated values."""
+    if outputformat == "jsonl":
+        line = json.dumps(record, sort_keys=True)
+    else:
+        line = "%s\t%s\t%i\t%.3f\t%s" % (record["filename"],
+                                         record.get("format", ""),
+                                         record.get("pages", 0),
+                                         record["seconds"],
+                                         record.get("error", ""))
+    sys.stdout.write("%s\n" % line)
+    sys.stdout.flush()
+
+def readFileList(filename):
+    """Returns the names of the files listed one per line in a file, '-' for stdin."""
+    if filename == "-":
+        listfile = sys.stdin
+    else:
+        listfile = open(filename)
+    try:
+        return [line.rstrip("\r\n") for line in listfile if line.strip()]
+    finally:
+        if listfile is not sys.stdin:
+            listfile.close()
+
+def runBatch(filenames, options, processes):
+    """Analyzes files in a pool of processes, printing a line per
+       file as soon as it is analyzed, then a line with the totals
+       except in JSON Lines mode.
+    """
+    import concurrent.futures
+    totalsize = totaltime = 0
+    nberrors = 0
+    pending = set()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+    try:
+        remaining = iter(filenames)
+        while True:
+            # Only a few files per process are submitted at once,
+            # and records are output as soon as each file is analyzed.
+            for filename in remaining:
+                pending.add(executor.submit(analyzeFile, filename, options))
+                if len(pending) >= 4 * processes:
+                    break
+            if not pending:
+                break
+            (done, pending) = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                record = future.result()
+                if "error" in record:
+                    nberrors += 1
+                totalsize += record.get("pages", 0)
+                totaltime += record["seconds"]
+                writeRecord(record, options.outputformat)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    if options.outputformat != "jsonl":
+        sys.stdout.write("TOTAL\t%i files\t%i\t%.3f\t%i errors\n" % (len(filenames), totalsize, totaltime, nberrors))
+
 def main():
     """Entry point for PDL Analyzer."""
     import optparse
     from copy import copy
+    from . import cache
 
     def check_cichoice(option, opt, value):
         """To add a CaseIgnore Choice option type."""
@@ -253,42 +943,253 @@ def main():
                             default=72,
                             dest="resolution",
                             help="The resolution in DPI to use when checking ink usage. Lower resolution is faster but less accurate. Default is 72 dpi.")
+    parser.add_option("--adaptive",
+                            type="int",
+                            default=0,
+                            dest="adaptive",
+                            help="Render again at this higher resolution the pages whose ink usage isn't known precisely enough at --resolution, and output the resolution used and the error estimate of each page. This can't be used with --streaming. Default is 0, which disables this.")
+    parser.add_option("--max-error",
+                            type="float",
+                            default=DEFAULTMAXERROR,
+                            dest="maxerror",
+                            help="With --adaptive, render again the pages whose error estimate is greater than this percent. Default is %.1f%%." % DEFAULTMAXERROR)
+    parser.add_option("--thresholds",
+                            dest="thresholds",
+                            help="With --adaptive, a comma separated list of percents of ink usage which change the price of a page. Pages whose ink usage is within their error estimate of one of them are rendered again.")
+    parser.add_option("--ink-device",
+                            action="store_true",
+                            dest="inkdevice",
+                            help="Let Ghostscript compute the CMYK ink usage of PostScript and PDF documents with its ink_cov device when available, instead of converting them to TIFF first. This is much faster, but Ghostscript converts colours to CMYK its own way, so results differ a bit.")
+    parser.add_option("-j", "--jobs",
+                            type="int",
+                            default=1,
+                            dest="jobs",
+                            help="The number of processes to use to compute ink usage in parallel, one page per process at a time. Default is 1.")
+    parser.add_option("--shards",
+                            type="int",
+                            default=1,
+                            dest="shards",
+                            help="The number of Ghostscript processes which convert ranges of pages of PostScript and PDF documents at the same time when computing ink usage, planned from their number of pages. 0 means one per CPU. Default is 1.")
+    parser.add_option("-s", "--streaming",
+                            action="store_true",
+                            dest="streaming",
+                            help="Render the documents page per page when computing ink usage, instead of as a whole, and output each page's ink usage as soon as it is known. This needs much less temporary disk space.")
+    parser.add_option("-g", "--gspool",
+                            type="int",
+                            default=0,
+                            dest="gspool",
+                            help="The number of long-lived Ghostscript interpreters to reuse across documents, instead of launching Ghostscript for each of them. Default is 0, which disables this.")
+    parser.add_option("-C", "--cache",
+                            action="store_true",
+                            dest="usecache",
+                            help="Activate the on-disk cache of results, so that documents already analyzed are not analyzed again.")
+    parser.add_option("--cachefile",
+                            dest="cache",
+                            help="The cache's database file. Default is %s" % cache.getDefaultCacheFile())
+    parser.add_option("--cachesize",
+                            type="int",
+                            default=int(cache.DEFAULTSIZE / pdlparser.MEGABYTE),
+                            dest="cachesize",
+                            help="The maximal size of the cache in megabytes. Least recently used results are evicted first. Default is %i MB." % int(cache.DEFAULTSIZE / pdlparser.MEGABYTE))
+    parser.add_option("--cachestats",
+                            action="store_true",
+                            dest="cachestats",
+                            help="Show statistics about the cache's content and exit.")
+    parser.add_option("--cachepurge",
+                            action="store_true",
+                            dest="cachepurge",
+                            help="Delete all results from the cache and exit.")
+    parser.add_option("--page-index",
+                            action="store_true",
+                            dest="pageindex",
+                            help="Save an index of the pages of PCLXL, QPDL and SPL1 documents next to them, named after them with .pgidx appended, to extract or count page ranges later without analyzing them again.")
+    parser.add_option("--dsc-trailer",
+                            action="store_true",
+                            dest="dsctrailer",
+                            help="Count the pages of big PostScript documents from the %%Pages: comment in their trailer, reading only their start and their end, unless copies are set in their pages. Only use this if the documents come from well-behaved drivers.")
+    parser.add_option("--timings",
+                            action="store_true",
+                            dest="timings",
+                            help="Output to stderr how long each phase of the analysis of each document took: opening, cache lookup, format detection, parsing, Ghostscript, rasterization and ink coverage computation, along with details like the number of bytes and the parser used.")
+    parser.add_option("--serve",
+                            dest="serve",
+                            help="Run as a daemon which analyzes documents on request, listening on this Unix socket. Use --connect to send requests to it.")
+    parser.add_option("--workers",
+                            type="int",
+                            default=4,
+                            dest="workers",
+                            help="The number of requests the daemon handles at the same time. Default is 4.")
+    parser.add_option("--connect",
+                            dest="connect",
+                            help="Ask the daemon listening on this Unix socket to analyze the documents, instead of doing it in this process. The output is the same.")
+    parser.add_option("-P", "--parallel",
+                            type="int",
+                            default=0,
+                            dest="parallel",
+                            help="Analyze the documents in this number of processes, and output a tab separated line per document with its name, format, number of pages, the time taken and the error if any, then a line with the totals. Default is 0, which disables this.")
+    parser.add_option("--files-from",
+                            dest="filesfrom",
+                            help="Also analyze the documents listed in this file, one per line, or in the standard input if '-'.")
+    parser.add_option("-f", "--format",
+                            dest="outputformat",
+                            type="cichoice",
+                            cichoices=["text", "jsonl"],
+                            default="text",
+                            help="The output format. 'jsonl' outputs a line of JSON per document as soon as it is analyzed, with its format, number of pages, the copies, media and duplex mode of each page when known, its ink coverage if --colorspace is used, the time taken, and the timings of each phase if --timings is used. Default is 'text'.")
     (options, arguments) = parser.parse_args()
+    if options.usecache or options.cachestats or options.cachepurge:
+        options.cache = options.cache or cache.getDefaultCacheFile()
+    else:
+        options.cache = None
+    options.cachesize *= pdlparser.MEGABYTE
+    if options.timings:
+        options.timings = writeTiming
+    try:
+        options.thresholds = [float(t) for t in (options.thresholds or "").split(",") if t.strip()]
+    except ValueError:
+        options.thresholds = None
     if options.version:
         sys.stdout.write("%s\n" % version.__version__)
+    elif options.cachestats or options.cachepurge:
+        resultcache = cache.getCache(options.cache, options.cachesize)
+        if resultcache is None:
+            sys.stderr.write("ERROR: impossible to open the cache %s\n" % options.cache)
+            sys.stderr.flush()
+        elif options.cachepurge:
+            resultcache.purge()
+        else:
+            for (k, v) in sorted(resultcache.getStatistics().items()):
+                sys.stdout.write("%s: %s\n" % (k, v))
     elif not (72 <= options.resolution <= 1200):
         sys.stderr.write("ERROR: the argument to the --resolution command line option must be between 72 and 1200.\n")
         sys.stderr.flush()
+    elif options.adaptive and not (options.resolution < options.adaptive <= 1200):
+        sys.stderr.write("ERROR: the argument to the --adaptive command line option must be greater than the resolution and at most 1200.\n")
+        sys.stderr.flush()
+    elif options.adaptive and options.streaming:
+        sys.stderr.write("ERROR: the --adaptive and --streaming command line options can't be used together.\n")
+        sys.stderr.flush()
+    elif options.maxerror < 0:
+        sys.stderr.write("ERROR: the argument to the --max-error command line option can't be negative.\n")
+        sys.stderr.flush()
+    elif options.thresholds is None:
+        sys.stderr.write("ERROR: the argument to the --thresholds command line option must be a comma separated list of percents.\n")
+        sys.stderr.flush()
+    elif options.jobs < 1:
+        sys.stderr.write("ERROR: the argument to the --jobs command line option must be at least 1.\n")
+        sys.stderr.flush()
+    elif options.shards < 0:
+        sys.stderr.write("ERROR: the argument to the --shards command line option can't be negative.\n")
+        sys.stderr.flush()
+    elif options.gspool < 0:
+        sys.stderr.write("ERROR: the argument to the --gspool command line option can't be negative.\n")
+        sys.stderr.flush()
+    elif options.workers < 1:
+        sys.stderr.write("ERROR: the argument to the --workers command line option must be at least 1.\n")
+        sys.stderr.flush()
+    elif options.parallel < 0:
+        sys.stderr.write("ERROR: the argument to the --parallel command line option can't be negative.\n")
+        sys.stderr.flush()
+    elif options.parallel and options.connect:
+        sys.stderr.write("ERROR: the --parallel and --connect command line options can't be used together.\n")
+        sys.stderr.flush()
+    elif options.parallel and options.colorspace and (options.outputformat != "jsonl"):
+        sys.stderr.write("ERROR: the --parallel command line option can only compute ink usage with --format jsonl.\n")
+        sys.stderr.flush()
+    elif (options.outputformat == "jsonl") and options.connect:
+        sys.stderr.write("ERROR: the --format jsonl and --connect command line options can't be used together.\n")
+        sys.stderr.flush()
+    elif options.serve:
+        from . import server
+        try:
+            server.serve(options.serve, options, options.workers)
+        except (OSError, server.ServerError) as msg:
+            sys.stderr.write("ERROR: %s\n" % msg)
+            sys.stderr.flush()
     else:
-        if (not arguments) or ((not sys.stdin.isatty()) and ("-" not in arguments)):
+        def formatCoverage(cspace, page):
+            """Formats a page's ink coverage as a line of text."""
+            lineparts = []
+            for k in cspace: # NB: this way we preserve the order of the planes
+                try:
+                    lineparts.append("%s: %s%%" % (k, ("%f" % page[k]).rjust(10)))
+                except KeyError:
+                    pass
+            if "dpi" in page:
+                lineparts.append("(%i dpi, error: %f%%)" % (page["dpi"], page["error"]))
+            return "      ".join(lineparts)
+
+        if options.filesfrom:
+            try:
+                arguments.extend(readFileList(options.filesfrom))
+            except IOError as msg:
+                sys.stderr.write("ERROR: %s\n" % msg)
+                sys.stderr.flush()
+                return
+        elif (not arguments) or ((not sys.stdin.isatty()) and ("-" not in arguments) and not options.parallel):
             arguments.append("-")
+        if options.parallel:
+            if "-" in arguments:
+                sys.stderr.write("ERROR: the standard input can't be analyzed with the --parallel command line option.\n")
+                sys.stderr.flush()
+                return
+            try:
+                runBatch(arguments, options, options.parallel)
+            except KeyboardInterrupt:
+                sys.stderr.write("WARN: Aborted at user's request.\n")
+                sys.stderr.flush()
+            return
+        if options.outputformat == "jsonl":
+            try:
+                for arg in arguments:
+                    writeRecord(analyzeFile(arg, options), options.outputformat)
+            except KeyboardInterrupt:
+                sys.stderr.write("WARN: Aborted at user's request.\n")
+                sys.stderr.flush()
+            return
         totalsize = 0
         lines = []
+        client = None
         try:
             for arg in arguments:
                 try:
+                    if options.connect:
+                        from . import server
+                        if client is None:
+                            client = server.Client(options.connect)
+                        if not options.colorspace:
+                            totalsize += client.getJobSize(arg)
+                        else:
+                            (cspace, pages) = client.getInkCoverage(arg, options.colorspace, options.resolution)
+                            for page in pages:
+                                if options.streaming:
+                                    sys.stdout.write("%s\n" % formatCoverage(cspace, page))
+                                else:
+                                    lines.append(formatCoverage(cspace, page))
+                        continue
                     parser = PDLAnalyzer(arg, options)
                     if not options.colorspace:
                         totalsize += parser.getJobSize()
+                    elif options.streaming:
+                        cspace = options.colorspace.upper()
+                        for page in parser.iterInkCoverage():
+                            sys.stdout.write("%s\n" % formatCoverage(cspace, page))
+                            sys.stdout.flush()
                     else:
                         (cspace, pages) = parser.getInkCoverage()
                         for page in pages:
-                            lineparts = []
-                            for k in cspace: # NB: this way we preserve the order of the planes
-                                try:
-                                    lineparts.append("%s: %s%%" % (k, ("%f" % page[k]).rjust(10)))
-                                except KeyError:
-                                    pass
-                            lines.append("      ".join(lineparts))
+                            lines.append(formatCoverage(cspace, page))
                 except (IOError, pdlparser.PDLParserError) as msg:
                     sys.stderr.write("ERROR: %s\n" % msg)
                     sys.stderr.flush()
         except KeyboardInterrupt:
             sys.stderr.write("WARN: Aborted at user's request.\n")
             sys.stderr.flush()
+        if client is not None:
+            client.close()
         if not options.colorspace:
             sys.stdout.write("%i\n" % totalsize)
-        else:
+        elif not options.streaming:
             sys.stdout.write("%s\n" % ("\n".join(lines)))
 
 if __name__ == "__main__":
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter: a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+
+"""This modules implements an analyzer for asyncio applications.
+
+   AsyncPDLAnalyzer has coroutine counterparts of PDLAnalyzer's
+   methods, which never block the event loop: jobs are scanned in
+   an executor, while Ghostscript and the other external commands
+   are run as asyncio subprocesses, killed if the coroutine waiting
+   for them is cancelled. Many jobs can be analyzed at once:
+
+     async def account(filenames):
+         analyzers = [AsyncPDLAnalyzer(f) for f in filenames]
+         return await asyncio.gather(*[a.getJobSize() for a in analyzers])
+"""
+
+import os
+import tempfile
+
+from . import pdlparser
+from . import analyzer
+
+class AsyncPDLAnalyzer:
+    """Class for PDL autodetection and analysis from coroutines."""
+    def __init__(self, filename, options=analyzer.AnalyzerOptions(), executor=None):
+        """Initializes the PDL analyzer.
+
+           filename and options are the same as PDLAnalyzer's ones.
+           Blocking work is done in executor, which defaults to the
+           event loop's default executor.
+        """
+        self.analyzer = analyzer.PDLAnalyzer(filename, options)
+        self.executor = executor
+
+    async def run(self, function, *args):
+        """Runs a blocking function in the executor, and returns its result.
+
+           If the coroutine is cancelled, this still waits for the
+           function to return, so the job can't be closed under it.
+        """
+        return await pdlparser.runInExecutor(self.executor, function, *args)
+
+    def lookupCache(self, kind, *parameters):
+        """Returns the results cache, the key and the cached result
+           of a kind of result, or (None, None, None) if caching is
+           disabled.
+        """
+        cache = self.analyzer.getCache()
+        if cache is None:
+            return (None, None, None)
+        with self.analyzer.timePhase("cache") as phase:
+            key = self.analyzer.getCacheKey(kind, *parameters)
+            cached = cache.get(key)
+            if phase is not None:
+                phase["hit"] = cached is not None
+        return (cache, key, cached)
+
+    async def getPDLHandler(self):
+        """Returns the parser for the already opened job, detecting its format if needed."""
+        return await self.run(getattr, self.analyzer, "pdlhandler")
+
+    async def getJobSize(self):
+        """Returns the job's size."""
+        try:
+            await self.run(self.analyzer.openFile)
+            return await self.getOpenedJobSize()
+        finally:
+            self.analyzer.closeFile()
+
+    async def getOpenedJobSize(self):
+        """Returns the size of the already opened job, from the cache if possible."""
+        indexname = self.analyzer.getPageIndexFilename()
+        (cache, key, cached) = await self.run(self.lookupCache,
+                                              "jobsize",
+                                              bool(getattr(self.analyzer.options, "dsctrailer", False)))
+        if isinstance(cached, list) and ((indexname is None) or os.path.exists(indexname)):
+            (size, self.analyzer.pagesdetails) = cached
+            return size
+        try:
+            handler = await self.getPDLHandler()
+            with self.analyzer.timePhase("parsing", parser=handler.format) as phase:
+                size = await handler.asyncGetJobSize(self.executor)
+                if phase is not None:
+                    phase["bytes"] = os.fstat(self.analyzer.workfile.fileno()).st_size
+        except pdlparser.PDLParserError as msg:
+            raise pdlparser.PDLParserError("Unsupported file format for %s (%s)" % (self.analyzer.name, msg))
+        self.analyzer.pagesdetails = handler.pagesdetails
+        if indexname is not None:
+            await self.run(self.analyzer.savePageIndex, indexname)
+        if cache is not None:
+            await self.run(cache.set, key, (size, self.analyzer.pagesdetails))
+        return size
+
+    async def getInkCoverage(self, colorspace=None, resolution=None, jobs=None):
+        """Extracts the percents of ink coverage from the input file.
+
+           Contrary to PDLAnalyzer.getInkCoverage(), the job is always
+           rendered as a whole, by a single process and at a single
+           resolution, whatever the streaming, shards and adaptive
+           options say.
+        """
+        (cspace, res, nbjobs) = self.analyzer.getInkCoverageParameters(colorspace, resolution, jobs)
+        try:
+            await self.run(self.analyzer.openFile)
+            (cache, key, cached) = await self.run(self.lookupCache, "inkcoverage", cspace, res)
+            if cached is not None:
+                return tuple(cached)
+            try:
+                result = await self.computeInkCoverage(cspace, res, nbjobs)
+            except pdlparser.PDLParserError as msg:
+                raise pdlparser.PDLParserError("Unsupported file format for %s (%s)" % (self.analyzer.name, msg))
+            if cache is not None:
+                await self.run(cache.set, key, result)
+            return result
+        finally:
+            self.analyzer.closeFile()
+
+    async def computeInkCoverage(self, cspace, res, nbjobs):
+        """Converts the already opened input file to a multi-page TIFF document,
+           and returns the ink coverage of its pages.
+        """
+        handler = await self.getPDLHandler()
+        dummyfile = tempfile.NamedTemporaryFile(mode="w+b",
+                                                prefix="pkpgcounter_",
+                                                suffix=".tiff",
+                                                dir=os.environ.get("PYKOTADIRECTORY") or tempfile.gettempdir())
+        try:
+            with self.analyzer.timePhase("rasterization", parser=handler.format, resolution=res) as phase:
+                await handler.asyncConvertToTiffMultiPage24NC(dummyfile.name, res, self.executor)
+                if phase is not None:
+                    phase["bytes"] = os.stat(dummyfile.name).st_size
+            from . import inkcoverage
+            with self.analyzer.timePhase("inkcoverage", colorspace=cspace) as phase:
+                result = await self.run(inkcoverage.getInkCoverage, dummyfile.name, cspace, nbjobs)
+                if phase is not None:
+                    phase["pages"] = len(result[1])
+            return result
+        finally:
+            dummyfile.close()
@@ -52,13 +52,13 @@ class Parser(pdlparser.PDLParser):
         try:
             try:
                 while True:
-                    if minfile[pos] == "\033":
+                    if minfile[pos] == 0x1b:
                         # Look if we've found an initialization sequence
                         # through the Set Initial Condition command
                         pageheader = minfile[pos:pos+7]
-                        if pageheader in ("\033[K\002\000\000\017",
-                                          "\033[K\002\000\000\044",
-                                          "\033[K\002\000\004\044"):
+                        if pageheader in (b"\033[K\002\000\000\017",
+                                          b"\033[K\002\000\000\044",
+                                          b"\033[K\002\000\004\044"):
                             pagecount += 1
                             pos += 6
                     pos += 1
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter: a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+
+"""This modules implements an on-disk cache for analysis results.
+
+   Results are stored in an SQLite database, keyed by a digest of
+   the input file's content, the kind of result, its parameters
+   (e.g. colorspace and resolution) and pkpgcounter's version.
+   The least recently used results are evicted when the cache
+   grows over its maximal size.
+"""
+
+import os
+import time
+import json
+import hashlib
+import sqlite3
+import logging
+import threading
+
+from . import pdlparser
+from . import version
+
+LOG = logging.getLogger("pkpgcounter.cache")
+
+DEFAULTSIZE = 64 * pdlparser.MEGABYTE
+
+def getDefaultCacheFile():
+    """Returns the default path to the cache's database."""
+    directory = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(directory, "pkpgcounter", "results.sqlite")
+
+def getFileDigest(filename):
+    """Returns a digest of a file's content."""
+    digest = hashlib.blake2b(digest_size=20)
+    infile = open(filename, "rb")
+    try:
+        while True:
+            data = infile.read(pdlparser.MEGABYTE)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        infile.close()
+    return digest.hexdigest()
+
+def makeKey(digest, kind, *parameters):
+    """Returns the cache key for a kind of result on a file with the given digest."""
+    return ":".join([digest, kind] + [str(p) for p in parameters] + [version.__version__])
+
+class ResultCache:
+    """A size-bounded cache of results, with LRU eviction."""
+    def __init__(self, filename, maxsize=DEFAULTSIZE):
+        """Opens the cache's database, creating it if needed."""
+        self.filename = filename
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, atime REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_atime ON results (atime)")
+        self.db.commit()
+
+    def close(self):
+        """Closes the cache's database."""
+        self.db.close()
+
+    def get(self, key):
+        """Returns the value stored for key, or None."""
+        with self.lock:
+            try:
+                row = self.db.execute("SELECT value FROM results WHERE key=?", (key,)).fetchone()
+                if row is None:
+                    LOG.debug("Cache miss for %s" % key)
+                    return None
+                self.db.execute("UPDATE results SET atime=? WHERE key=?", (time.time(), key))
+                self.db.commit()
+            except sqlite3.Error as msg:
+                LOG.debug("Cache error: %s" % msg)
+                return None
+        LOG.debug("Cache hit for %s" % key)
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """Stores value for key, then evicts the least recently used values if needed."""
+        data = json.dumps(value)
+        with self.lock:
+            try:
+                self.db.execute("INSERT OR REPLACE INTO results (key, value, size, atime) VALUES (?, ?, ?, ?)",
+                                (key, data, len(key) + len(data), time.time()))
+                self.evict()
+                self.db.commit()
+            except sqlite3.Error as msg:
+                LOG.debug("Cache error: %s" % msg)
+
+    def evict(self):
+        """Deletes the least recently used values until the cache fits in its maximal size."""
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total > self.maxsize:
+            cursor = self.db.execute("SELECT key, size FROM results ORDER BY atime")
+            tobedeleted = []
+            for (key, size) in cursor:
+                if total <= self.maxsize:
+                    break
+                tobedeleted.append((key,))
+                total -= size
+            self.db.executemany("DELETE FROM results WHERE key=?", tobedeleted)
+            LOG.debug("Evicted %i values from the cache." % len(tobedeleted))
+
+    def getStatistics(self):
+        """Returns a dictionnary describing the cache's content."""
+        with self.lock:
+            (entries, size, oldest, newest) = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), MIN(atime), MAX(atime) FROM results").fetchone()
+        return { "filename": self.filename,
+                 "entries": entries,
+                 "size": size,
+                 "maxsize": self.maxsize,
+                 "oldest": oldest,
+                 "newest": newest,
+               }
+
+    def purge(self):
+        """Deletes all values from the cache."""
+        with self.lock:
+            self.db.execute("DELETE FROM results")
+            self.db.commit()
+            self.db.execute("VACUUM")
+
+_caches = {}
+_cacheslock = threading.Lock()
+
+def getCache(filename, maxsize=None):
+    """Returns the process wide cache stored in filename, opening it if needed.
+
+       Returns None if the cache can't be opened.
+    """
+    with _cacheslock:
+        cache = _caches.get(filename)
+        if cache is None:
+            try:
+                cache = _caches[filename] = ResultCache(filename, maxsize or DEFAULTSIZE)
+            except (OSError, sqlite3.Error) as msg:
+                LOG.debug("Impossible to open cache %s: %s" % (filename, msg))
+                return None
+        elif maxsize:
+            cache.maxsize = maxsize
+        return cache
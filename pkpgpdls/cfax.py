@@ -83,7 +83,7 @@ class Parser(pdlparser.PDLParser):
                     pageheader = self.infile.read(17)
                     if not pageheader:
                         break
-                    headerlen = ord(pageheader[0])
+                    headerlen = pageheader[0]
                     if not headerlen:
                         break # End Of Document
                     (vres,
@@ -57,8 +57,8 @@ class Parser(pdlparser.PDLParser):
         minfile = mmap.mmap(infileno, os.fstat(infileno)[6], prot=mmap.PROT_READ, flags=mmap.MAP_SHARED)
         pagecount = 0
         pos = -1
-        eofchar = b"\xdf"
-        postchar = b"\xf8"
+        eofchar = 0xdf
+        postchar = 0xf8
         try:
             try:
                 while minfile[pos] == eofchar:
@@ -42,21 +42,21 @@ class Parser(pdlparser.PDLParser):
         """Counts pages in an ESC/P2 document."""
         # with Gimpprint, at least, for each page there
         # are two Reset Printer sequences (ESC + @)
-        marker1 = "\033@"
+        marker1 = b"\033@"
 
         # with other software or printer driver, we
         # may prefer to search for "\r\n\fESCAPE"
         # or "\r\fESCAPE"
-        marker2r = "\r\f\033"
-        marker2rn = "\r\n\f\033"
+        marker2r = b"\r\f\033"
+        marker2rn = b"\r\n\f\033"
 
         # and ghostscript's stcolor for example seems to
         # output ESC + @ + \f for each page plus one
-        marker3 = "\033@\f"
+        marker3 = b"\033@\f"
 
         # while ghostscript's escp driver outputs instead
         # \f + ESC + @
-        marker4 = "\f\033@"
+        marker4 = b"\f\033@"
 
         data = self.infile.read()
         pagecount1 = data.count(marker1)
@@ -49,15 +49,15 @@ class Parser(pdlparser.PDLParser):
         infileno = self.infile.fileno()
         minfile = mmap.mmap(infileno, os.fstat(infileno)[6], prot=mmap.PROT_READ, flags=mmap.MAP_SHARED)
         pagecount = 0
-        marker = "=ESC/PAGES03\n"
+        marker = b"=ESC/PAGES03\n"
         startpos = minfile.find(marker)
-        startsequence = b"\x1d"
+        startsequence = 0x1d
         if startpos == -1:
             raise pdlparser.PDLParserError("Invalid ESC/PageS03 file.")
         startpos += len(marker)
         if minfile[startpos] != startsequence:
             raise pdlparser.PDLParserError("Invalid ESC/PageS03 file.")
-        endsequence = "eps{I"
+        endsequence = b"eps{I"
         lgendsequence = len(endsequence)
         try:
             try:
@@ -66,7 +66,7 @@ class Parser(pdlparser.PDLParser):
                         skiplen = 0
                         while True:
                             startpos += 1
-                            c = minfile[startpos]
+                            c = chr(minfile[startpos])
                             if not c.isdigit():
                                 break
                             else:
@@ -74,10 +74,10 @@ class Parser(pdlparser.PDLParser):
                         if minfile[startpos:startpos+lgendsequence] == endsequence:
                             startpos += (skiplen + lgendsequence)
                     else:
-                        if minfile[startpos:startpos+6] == "\033\1@EJL":
+                        if minfile[startpos:startpos+6] == b"\033\1@EJL":
                             # Probably near the end of the file.
                             # Test suite was too small to be sure.
-                            ejlparser = pjl.EJLParser(minfile[startpos:])
+                            ejlparser = pjl.EJLParser(minfile[startpos:].decode("latin-1"))
                             pagecount = ejlparser.environment_variables.get("PAGES", "1")
                             if pagecount.startswith('"') and pagecount.endswith('"'):
                                 pagecount = pagecount[1:-1]
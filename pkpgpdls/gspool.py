@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter: a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+
+"""This modules implements a pool of long-lived Ghostscript interpreters.
+
+   Each interpreter runs in interactive mode and reads PostScript
+   commands on its standard input, so the cost of launching gs is
+   paid once per interpreter instead of once per job. Each job is
+   run inside a save/restore pair and a stopped context, and ends
+   by printing a marker which tells us the job is done.
+
+   Interpreters run with -dSAFER, and may only read and write files
+   in their own private directory, where each job's input file is
+   linked to and where its output file is written to. Path control
+   can't be changed once -dSAFER is active, so the interpreter stays
+   locked down for its whole life.
+"""
+
+import os
+import uuid
+import shutil
+import tempfile
+import select
+import atexit
+import logging
+import threading
+import subprocess
+import contextlib
+
+from . import pdlparser
+
+LOG = logging.getLogger("pkpgcounter.gspool")
+
+GSCOMMAND = [ "gs", "-q", "-dSAFER", "-dNOPAUSE", "-dNOPROMPT", "-dNODISPLAY" ]
+JOBINPUT = "input"      # Name of the link to the current job's input file
+JOBOUTPUT = "output"    # Name of the current job's output file
+DEFAULTMAXJOBS = 100    # Recycle interpreters after this number of jobs
+HEALTHTIMEOUT = 5       # Seconds to wait for an answer to a health check
+JOBTIMEOUT = 600        # Seconds to wait for a job to complete
+
+class GhostScriptError(pdlparser.PDLParserError):
+    """An exception for Ghostscript interpreters related stuff."""
+    pass
+
+def psString(value):
+    """Returns value as a PostScript string literal."""
+    return "(%s)" % value.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+class GhostScriptWorker:
+    """A long-lived Ghostscript interpreter."""
+    def __init__(self):
+        """Launches the interpreter."""
+        self.nbjobs = 0
+        self.jobdir = tempfile.mkdtemp(prefix="pkpgcounter_gs_",
+                                       dir=os.environ.get("PYKOTADIRECTORY") or tempfile.gettempdir())
+        permitted = os.path.join(self.jobdir, "*")
+        # NB: unbuffered, otherwise select() could miss already read lines.
+        try:
+            self.child = subprocess.Popen(GSCOMMAND + [ "--permit-file-read=%s" % permitted,
+                                                        "--permit-file-write=%s" % permitted,
+                                                        "--permit-file-write=/dev/null" ],
+                                          bufsize=0,
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT)
+        except OSError:
+            shutil.rmtree(self.jobdir, ignore_errors=True)
+            raise
+        LOG.debug("Ghostscript interpreter %i started." % self.child.pid)
+
+    def close(self):
+        """Stops the interpreter."""
+        if self.child.poll() is None:
+            try:
+                self.child.stdin.write(b"quit\n")
+                self.child.stdin.close()
+            except (IOError, OSError):
+                pass
+            try:
+                self.child.wait(HEALTHTIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.child.kill()
+                self.child.wait()
+        self.child.stdout.close()
+        shutil.rmtree(self.jobdir, ignore_errors=True)
+        LOG.debug("Ghostscript interpreter %i stopped after %i jobs." % (self.child.pid, self.nbjobs))
+
+    def isAlive(self):
+        """Returns True if the interpreter is still running, else False."""
+        return self.child.poll() is None
+
+    def send(self, commands):
+        """Sends PostScript commands to the interpreter."""
+        try:
+            self.child.stdin.write(commands.encode("utf-8", "surrogateescape") + b"\n")
+            self.child.stdin.flush()
+        except (IOError, OSError) as msg:
+            raise GhostScriptError("Ghostscript interpreter %i is gone (%s)" % (self.child.pid, msg))
+
+    def readUntil(self, marker, timeout):
+        """Reads the interpreter's output lines until the marker line.
+
+           Returns the list of lines read before the marker, and the
+           rest of the marker line.
+        """
+        lines = []
+        stdout = self.child.stdout
+        bmarker = marker.encode("ascii")
+        while True:
+            (ready, dummy, dummy) = select.select([stdout], [], [], timeout)
+            if not ready:
+                raise GhostScriptError("Ghostscript interpreter %i timed out." % self.child.pid)
+            line = stdout.readline()
+            if not line:
+                raise GhostScriptError("Ghostscript interpreter %i exited unexpectedly." % self.child.pid)
+            if line.startswith(bmarker):
+                return (lines, line[len(bmarker):].strip())
+            lines.append(line)
+
+    def ping(self):
+        """Returns True if the interpreter answers, else False."""
+        if not self.isAlive():
+            return False
+        marker = "PKPGPING-%s" % uuid.uuid4().hex
+        try:
+            self.send("%s = flush" % psString(marker))
+            self.readUntil(marker, HEALTHTIMEOUT)
+        except GhostScriptError as msg:
+            LOG.debug("%s" % msg)
+            return False
+        return True
+
+    def runJob(self, commands, timeout=JOBTIMEOUT):
+        """Runs a job, protected by save/restore and stopped.
+
+           Returns the list of output lines, or raises GhostScriptError
+           if the job failed.
+        """
+        self.nbjobs += 1
+        marker = "PKPGDONE-%s" % uuid.uuid4().hex
+        self.send("save mark { %s } stopped { (ERROR) } { (OK) } ifelse %s print = flush cleartomark restore" \
+                      % (commands, psString(marker)))
+        (lines, status) = self.readUntil(marker, timeout)
+        if status != b"OK":
+            raise GhostScriptError("Ghostscript job failed: %s" % repr(b"".join(lines[-5:])))
+        return lines
+
+    @contextlib.contextmanager
+    def jobFiles(self, infname):
+        """Links the input file in the private directory for the duration
+           of a with block, and yields the names the interpreter may use
+           for the input and output files.
+        """
+        (jobinput, joboutput) = (os.path.join(self.jobdir, JOBINPUT), os.path.join(self.jobdir, JOBOUTPUT))
+        try:
+            os.symlink(os.path.abspath(infname), jobinput)
+        except OSError as msg:
+            raise GhostScriptError("Impossible to give %s to Ghostscript (%s)" % (infname, msg))
+        try:
+            yield (jobinput, joboutput)
+        finally:
+            for fname in (jobinput, joboutput):
+                try:
+                    os.remove(fname)
+                except OSError:
+                    pass
+
+    def countPages(self, infname):
+        """Counts the pages in a PostScript or PDF document, using the bbox device."""
+        with self.jobFiles(infname) as (jobinput, joboutput):
+            lines = self.runJob("(bbox) selectdevice %s run" % psString(jobinput))
+        return len([l for l in lines if l.startswith(b"%%HiResBoundingBox:")])
+
+    def convertToTiffMultiPage24NC(self, infname, outfname, dpi):
+        """Converts a PostScript or PDF document to TIFF format, X dpi, 24 bits per pixel, uncompressed."""
+        with self.jobFiles(infname) as (jobinput, joboutput):
+            self.runJob("(tiff24nc) selectdevice " \
+                        "<< /OutputFile %s /HWResolution [%i %i] >> setpagedevice " \
+                        "%s run " \
+                        "<< /OutputFile (/dev/null) >> setpagedevice" \
+                            % (psString(joboutput), dpi, dpi, psString(jobinput)))
+            if not (os.path.exists(joboutput) and os.stat(joboutput).st_size):
+                raise GhostScriptError("Ghostscript produced no output.")
+            shutil.move(joboutput, outfname)
+
+class GhostScriptPool:
+    """A pool of long-lived Ghostscript interpreters."""
+    def __init__(self, size, maxjobs=DEFAULTMAXJOBS):
+        """Initializes the pool, interpreters are launched when needed."""
+        self.size = size
+        self.maxjobs = maxjobs
+        self.idle = []
+        self.lock = threading.Lock()
+        self.available = threading.BoundedSemaphore(size)
+
+    def getWorker(self):
+        """Returns a healthy idle interpreter, or a new one."""
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                worker = self.idle.pop()
+            if worker.ping():
+                return worker
+            LOG.debug("Ghostscript interpreter %i failed its health check." % worker.child.pid)
+            worker.close()
+        try:
+            return GhostScriptWorker()
+        except OSError as msg:
+            raise GhostScriptError("Impossible to launch Ghostscript (%s)" % msg)
+
+    @contextlib.contextmanager
+    def borrow(self):
+        """Lends an interpreter for the duration of a with block.
+
+           Interpreters which failed a job, or which have run
+           more than maxjobs jobs, are stopped instead of being
+           given back to the pool.
+        """
+        self.available.acquire()
+        try:
+            worker = self.getWorker()
+            try:
+                yield worker
+            except:
+                worker.close()
+                raise
+            else:
+                if worker.nbjobs >= self.maxjobs:
+                    worker.close()
+                else:
+                    with self.lock:
+                        self.idle.append(worker)
+        finally:
+            self.available.release()
+
+    def close(self):
+        """Stops all idle interpreters."""
+        with self.lock:
+            (workers, self.idle) = (self.idle, [])
+        for worker in workers:
+            worker.close()
+
+_pool = None
+_poollock = threading.Lock()
+
+def getPool(size, maxjobs=DEFAULTMAXJOBS):
+    """Returns the process wide pool of Ghostscript interpreters, creating it if needed."""
+    global _pool
+    with _poollock:
+        if _pool is None:
+            _pool = GhostScriptPool(size, maxjobs)
+            atexit.register(_pool.close)
+        return _pool
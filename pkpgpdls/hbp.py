@@ -61,7 +61,7 @@ class Parser(pdlparser.PDLParser):
         try:
             try:
                 while True:
-                    if (minfile[pos] == "@") \
+                    if (minfile[pos] == 0x40) \
                        and (minfile[pos:pos+fflen] == formfeed):
                         pagecount += 1
                         pos += fflen
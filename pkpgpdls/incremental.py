@@ -0,0 +1,517 @@
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter: a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+
+"""This modules implements page counters which work while a job is
+   still being received.
+
+   Each counter is fed the job's data chunk by chunk, and keeps a
+   running count of the pages seen so far. It only moves forward,
+   so it never needs more than the current chunk in memory, plus
+   the few bytes of an incomplete header.
+
+   The running count doesn't take into account the number of copies,
+   nor the final adjustments made by the parsers once the whole job
+   is known, so it is usually a bit lower than the number of pages
+   PDLAnalyzer.getJobSize() will return. It is meant to abort jobs
+   clearly over quota before they are fully received.
+"""
+
+import re
+import struct
+import logging
+
+from . import pdlparser, registry
+from . import pclxl, pcl345, qpdl, postscript
+
+LOG = logging.getLogger("pkpgcounter.incremental")
+
+MAXLINESIZE = 64 * pdlparser.KILOBYTE  # Longer PostScript lines are binary datas
+
+class Counter:
+    """Generic incremental page counter.
+
+       Subclasses implement scan() as a generator which reads the
+       job's data with read(), peek() and skip(), and yields
+       whenever these need more data.
+    """
+    format = "Unknown"
+    def __init__(self):
+        """Initializes the counter."""
+        self.pagecount = 0
+        self.buffer = bytearray()
+        self.pos = 0            # Position in the buffer
+        self.offset = 0         # Position of the buffer in the job
+        self.eof = False
+        self.scanner = self.scan()
+        self.resume()
+
+    def scan(self):
+        """Counts the pages, as a generator."""
+        raise RuntimeError("Not implemented !")
+
+    def resume(self):
+        """Lets the scanner process the data available."""
+        if self.scanner is not None:
+            try:
+                next(self.scanner)
+            except StopIteration:
+                self.scanner = None
+            except pdlparser.PDLParserError as msg:
+                LOG.debug("Incremental counting stopped at %i pages: %s" % (self.pagecount, msg))
+                self.scanner = None
+
+    def feed(self, data):
+        """Processes a chunk of data and returns the number of pages seen so far."""
+        if self.scanner is not None:
+            self.offset += self.pos
+            del self.buffer[:self.pos]
+            self.pos = 0
+            self.buffer += data
+            self.resume()
+        return self.pagecount
+
+    def close(self):
+        """Processes the end of the job and returns the number of pages seen."""
+        self.eof = True
+        self.resume()
+        self.buffer = bytearray()
+        self.pos = 0
+        return self.pagecount
+
+    def tell(self):
+        """Returns the current position in the job."""
+        return self.offset + self.pos
+
+    def peek(self, size):
+        """Returns the next size bytes without consuming them, fewer at EOF."""
+        while (len(self.buffer) - self.pos < size) and not self.eof:
+            yield
+        return bytes(self.buffer[self.pos:self.pos+size])
+
+    def read(self, size):
+        """Returns the next size bytes, fewer at EOF."""
+        data = yield from self.peek(size)
+        self.pos += len(data)
+        return data
+
+    def skip(self, size):
+        """Skips size bytes, without keeping them in memory."""
+        while True:
+            available = len(self.buffer) - self.pos
+            if (size <= available) or self.eof:
+                self.pos += min(size, available)
+                return
+            size -= available
+            self.pos = len(self.buffer)
+            yield
+
+    def match(self, regexp):
+        """Matches regexp at the current position, waiting for more data
+           while the match reaches the end of the buffer.
+        """
+        while True:
+            match = regexp.match(self.buffer, self.pos)
+            if self.eof or (match.end() < len(self.buffer)):
+                return match
+            yield
+
+    def skipPJL(self):
+        """Skips the PJL statements following an UEL."""
+        match = yield from self.match(pcl345.PJLRE)
+        self.pos = match.end()
+
+class ZjStreamCounter(Counter):
+    """Incremental page counter for ZjStream documents."""
+    format = "Zenographics ZjStream"
+
+    def scan(self):
+        """Counts the StartPage and EndPage chunks."""
+        magic = yield from self.read(4)
+        if magic == b"ZJZJ":
+            header = struct.Struct("<IIIHH")
+        else:
+            header = struct.Struct(">IIIHH")
+        startpagecount = endpagecount = 0
+        while True:
+            datas = yield from self.read(header.size)
+            if not datas:
+                return
+            try:
+                (totalChunkSize, chunkType, numberOfItems, reserved, signature) = header.unpack(datas)
+            except struct.error:
+                raise pdlparser.PDLParserError("Truncated chunk header")
+            if totalChunkSize < header.size:
+                raise pdlparser.PDLParserError("Invalid chunk size %i" % totalChunkSize)
+            if chunkType == 2:
+                startpagecount += 1
+            elif chunkType == 3:
+                endpagecount += 1
+            self.pagecount = max(startpagecount, endpagecount)
+            yield from self.skip(totalChunkSize - header.size)
+
+class LIDILCounter(Counter):
+    """Incremental page counter for HP LIDIL documents."""
+    format = "Hewlett-Packard LIDIL"
+
+    def scan(self):
+        """Counts the LoadPage and EjectPage commands."""
+        header = struct.Struct(">BHBBBHH")
+        loadpage = ejectpage = 0
+        while True:
+            datas = yield from self.read(header.size)
+            if not datas:
+                return
+            if (len(datas) != header.size) or (datas[:1] != b"$"):
+                raise pdlparser.PDLParserError("Invalid packet header")
+            (framesync,
+             cmdlength,
+             dummy,
+             packettype,
+             commandnumber,
+             referencenumber,
+             datalength) = header.unpack(datas)
+            if packettype == 0:         # PACKET_TYPE_COMMAND
+                if commandnumber == 1:  # LDL_LOAD_PAGE
+                    loadpage += 1
+                elif commandnumber == 2: # LDL_EJECT_PAGE
+                    ejectpage += 1
+                self.pagecount = max(loadpage, ejectpage)
+            if cmdlength + datalength < header.size:
+                raise pdlparser.PDLParserError("Invalid packet length")
+            yield from self.skip(cmdlength + datalength - header.size)
+
+class QPDLCounter(Counter):
+    """Incremental page counter for QPDL (aka SPL2) documents."""
+    format = "QPDL (aka SPL2)"
+
+    def scan(self):
+        """Counts the page headers, skipping over bands."""
+        unpackLong = struct.Struct(">I").unpack
+        while True:
+            tag = yield from self.read(1)
+            if not tag:
+                return
+            tag = tag[0]
+            if tag == 0x00:     # Page header
+                self.pagecount += 1
+                yield from self.skip(qpdl.PAGEHEADERSIZE)
+            elif tag == 0x01:   # Page footer
+                yield from self.skip(qpdl.PAGEFOOTERSIZE)
+            elif tag == 0x09:   # Maybe the EOF marker
+                marker = yield from self.peek(len(qpdl.EOFMARKER))
+                if marker == qpdl.EOFMARKER:
+                    yield from self.skip(len(marker))
+            elif tag == 0x0c:   # Band header
+                header = yield from self.read(qpdl.BANDHEADERSIZE)
+                if len(header) < qpdl.BANDHEADERSIZE:
+                    return
+                yield from self.skip(unpackLong(header[6:10])[0])
+            elif tag == 0x1b:
+                marker = yield from self.peek(len(registry.UEL) - 1)
+                if marker == registry.UEL[1:]:
+                    self.pos += len(marker)
+                    yield from self.skipPJL()
+
+class PCLXLCounter(Counter):
+    """Incremental page counter for PCLXL (aka PCL6) documents."""
+    format = "PCLXL (aka PCL6)"
+    streamheader = re.compile(b"([()]) (?:HP-PCL XL|BROTHER XL2HB);[^\n]*\n")
+
+    def skipPJL(self):
+        """Skips the PJL statements following an UEL, and the stream header if any."""
+        start = self.tell()
+        yield from Counter.skipPJL(self)
+        header = self.streamheader.search(self.buffer, start - self.offset, self.pos)
+        if header is not None:
+            self.unpackers = pclxl.UNPACKERS[header.group(1)[0]]
+            self.pos = header.end()
+
+    def readInteger(self, datatype):
+        """Reads an integer of the given data type, as unsigned."""
+        unpacker = self.unpackers.get(datatype)
+        if unpacker is None:
+            raise pdlparser.PDLParserError("Unexpected data type 0x%02x at %x" % (datatype, self.tell()))
+        datas = yield from self.read(unpacker.size)
+        if len(datas) != unpacker.size:
+            raise pdlparser.PDLParserError("Truncated data type 0x%02x at %x" % (datatype, self.tell()))
+        return unpacker.unpack(datas)[0]
+
+    def scan(self):
+        """Counts the BeginPage operators, skipping over datas."""
+        skips = pclxl.SKIPS
+        self.unpackers = pclxl.UNPACKERS[0x28]
+        value = None            # Last integer value
+        blocklength = None      # Length of the block announced by the undocumented tag 0x46
+        while True:
+            tag = yield from self.read(1)
+            if not tag:
+                return
+            tag = tag[0]
+            size = skips[tag]
+            if tag in self.unpackers:
+                value = yield from self.readInteger(tag)
+            elif tag == 0xf8:   # attr_ubyte
+                attribute = yield from self.read(1)
+                if attribute == b"\x92":
+                    blocklength = value
+            elif size > 1:
+                yield from self.skip(size - 1)
+            elif (size < 0) or (tag == 0xcd): # Arrays, 0xcd is a real32_array
+                marker = yield from self.peek(3)
+                if (tag == 0xcd) and (marker in pclxl.IMAGERUNNERMARKERS):
+                    header = yield from self.read(19)
+                    if len(header) < 19:
+                        return
+                    toskip = 0
+                    if marker != pclxl.IMAGERUNNERMARKERS[1]:
+                        toskip = pclxl.UNPACKERS[0x28][0xc1].unpack_from(header, 7)[0]
+                    yield from self.skip(toskip)
+                else:
+                    datatype = yield from self.read(1)
+                    if not datatype:
+                        return
+                    length = yield from self.readInteger(datatype[0])
+                    if size < 0:
+                        yield from self.skip(length * -size)
+                    else:
+                        yield from self.skip(length * 4)
+            elif tag == 0xfa:   # dataLength
+                length = yield from self.readInteger(0xc2)
+                yield from self.skip(length)
+            elif tag == 0xfb:   # dataLengthByte
+                length = yield from self.readInteger(0xc0)
+                yield from self.skip(length)
+            elif tag in (0x28, 0x29):
+                self.unpackers = pclxl.UNPACKERS[tag]
+                statement = yield from self.peek(15)
+                if statement.startswith(b" HP-PCL XL;") or statement.startswith(b" BROTHER XL"):
+                    while True:
+                        line = yield from self.read(1)
+                        if line in (b"\n", b""):
+                            break
+            elif tag == 0x1b:
+                marker = yield from self.peek(len(registry.UEL) - 1)
+                if marker == registry.UEL[1:]:
+                    self.pos += len(marker)
+                    yield from self.skipPJL()
+            elif tag == 0x31:   # Undocumented, in class 3.0 streams
+                marker = yield from self.peek(1)
+                if marker == b"\x90":
+                    self.pos += 1
+                    length = yield from self.readInteger(0xc2)
+                    yield from self.skip(length)
+            elif tag == 0x46:   # Undocumented, in class 3.0 streams
+                if blocklength:
+                    yield from self.skip(blocklength)
+            elif tag == 0x43:   # BeginPage
+                self.pagecount += 1
+            if tag < 0xc0:      # Operators consume their attributes
+                blocklength = None
+
+class PCL345Counter(Counter):
+    """Incremental page counter for PCL3/4/5 documents."""
+    format = "PCL3/4/5"
+    markers = re.compile(b"[\x0c\x1b\x80\xcd]")
+    parameter = re.compile(b"[0-9.+-]*")
+    datatags = { b"*b": b"VWvw", b"&p": b"X" } # Others only have data after W
+
+    def scan(self):
+        """Counts the form feeds outside of HPGL2 blocks, skipping over datas."""
+        hpgl2 = False
+        search = self.markers.search
+        while True:
+            match = search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                if self.eof:
+                    return
+                yield
+                continue
+            self.pos = match.end()
+            tag = match.group()
+            if tag == b"\x0c":
+                if not hpgl2:
+                    self.pagecount += 1
+            elif tag == b"\x80":
+                yield from self.skip(1)
+            elif tag == b"\xcd":
+                marker = yield from self.peek(1)
+                if marker == pcl345.IMAGERUNNERMARKER1[1:]:
+                    header = yield from self.read(19)
+                    if len(header) < 19:
+                        return
+                    if header[1:3] != pcl345.IMAGERUNNERMARKER2:
+                        yield from self.skip(struct.unpack(">H", header[7:9])[0])
+            else:
+                command = yield from self.peek(2)
+                if command[:1] == b"E":
+                    self.pos += 1
+                elif command == b"%-":
+                    marker = yield from self.peek(len(registry.UEL) - 1)
+                    if marker == registry.UEL[1:]:
+                        self.pos += len(marker)
+                        yield from self.skipPJL()
+                elif command[:1] == b"%":
+                    self.pos += 1
+                    match = yield from self.match(self.parameter)
+                    mode = self.buffer[match.end():match.end()+1]
+                    if mode == b"B":
+                        hpgl2 = True
+                    elif mode == b"A":
+                        hpgl2 = False
+                elif (len(command) == 2) and (0x21 <= command[0] <= 0x2f) and (0x60 <= command[1] <= 0x7e):
+                    self.pos += 2
+                    yield from self.skipParameters(self.datatags.get(command, b"W"))
+
+    def skipParameters(self, datamarkers):
+        """Skips the parameters of an escape sequence, and the datas they announce."""
+        while True:
+            match = yield from self.match(self.parameter)
+            end = match.end()
+            if end >= len(self.buffer):
+                return
+            char = self.buffer[end]
+            if not (0x40 <= char <= 0x7e):
+                self.pos = end
+                return
+            self.pos = end + 1
+            if bytes((char,)) in datamarkers:
+                try:
+                    length = int(match.group().split(b".")[0] or b"0")
+                except ValueError:
+                    length = 0
+                yield from self.skip(max(length, 0))
+            if char <= 0x5e: # Uppercase, end of the sequence
+                return
+
+class PostScriptCounter(Counter):
+    """Incremental page counter for DSC compliant PostScript documents."""
+    format = "PostScript"
+    endofline = re.compile(b"[\r\n]")
+
+    def readLine(self):
+        """Returns the next line, None at EOF.
+
+           Lines too long to be DSC comments are returned truncated.
+        """
+        while True:
+            match = self.endofline.search(self.buffer, self.pos)
+            if match is not None:
+                line = bytes(self.buffer[self.pos:match.start()])
+                self.pos = match.end()
+                return line
+            if self.eof:
+                if self.pos < len(self.buffer):
+                    line = bytes(self.buffer[self.pos:])
+                    self.pos = len(self.buffer)
+                    return line
+                return None
+            if len(self.buffer) - self.pos > MAXLINESIZE:
+                line = bytes(self.buffer[self.pos:self.pos+MAXLINESIZE])
+                self.pos = len(self.buffer)
+                while True: # Skips the rest of the line
+                    yield
+                    match = self.endofline.search(self.buffer, self.pos)
+                    if match is not None:
+                        self.pos = match.end()
+                        return line
+                    self.pos = len(self.buffer)
+                    if self.eof:
+                        return line
+            yield
+
+    def scan(self):
+        """Counts the %%Page: comments, the same way postscript.Parser does."""
+        oldpagenum = 0
+        pagescomment = 0
+        while True:
+            line = yield from self.readLine()
+            if line is None:
+                break
+            line = line.decode("latin-1")
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == r"%%Pages:":
+                try:
+                    pagescomment = max(pagescomment, int(parts[1]))
+                except (ValueError, IndexError):
+                    pass
+            elif parts[0] in postscript.PAGECOMMENTS:
+                newpagenum = postscript.getPageNumber(line)
+                if (newpagenum is not None) and (newpagenum > oldpagenum):
+                    oldpagenum = newpagenum
+                    self.pagecount += 1
+        if not self.pagecount:
+            self.pagecount = pagescomment
+
+class TIFFCounter(Counter):
+    """Incremental page counter for TIFF documents."""
+    format = "TIFF"
+
+    def scan(self):
+        """Follows the chain of image file directories.
+
+           This works as long as each directory comes after the
+           previous one in the file, which is the common case.
+        """
+        header = yield from self.read(8)
+        if header[:2] == b"II":
+            (unpackShort, unpackLong) = (struct.Struct("<H").unpack, struct.Struct("<I").unpack)
+        else:
+            (unpackShort, unpackLong) = (struct.Struct(">H").unpack, struct.Struct(">I").unpack)
+        if len(header) != 8:
+            return
+        nextifdoffset = unpackLong(header[4:])[0]
+        while nextifdoffset:
+            if nextifdoffset < self.tell():
+                raise pdlparser.PDLParserError("Image file directory at %x is before the current position" % nextifdoffset)
+            yield from self.skip(nextifdoffset - self.tell())
+            datas = yield from self.read(2)
+            if len(datas) != 2:
+                return
+            yield from self.skip(unpackShort(datas)[0] * 12)
+            datas = yield from self.read(4)
+            if len(datas) != 4:
+                return
+            nextifdoffset = unpackLong(datas)[0]
+            self.pagecount += 1
+
+# Incremental counters of the parser modules which have one
+COUNTERS = { "%s.postscript" % __package__: PostScriptCounter,
+             "%s.pclxl" % __package__: PCLXLCounter,
+             "%s.qpdl" % __package__: QPDLCounter,
+             "%s.tiff" % __package__: TIFFCounter,
+             "%s.zjstream" % __package__: ZjStreamCounter,
+             "%s.lidil" % __package__: LIDILCounter,
+             "%s.pcl345" % __package__: PCL345Counter,
+           }
+
+def getCounter(modulename):
+    """Returns a new incremental counter for a job whose format was detected
+       by the parser from the modulename module, or None if this format
+       is not supported.
+    """
+    counterclass = COUNTERS.get(modulename)
+    if counterclass is None:
+        return None
+    LOG.debug("Incremental counter = %s" % counterclass.__name__)
+    return counterclass()
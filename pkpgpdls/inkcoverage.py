@@ -19,41 +19,56 @@
 # $Id$
 #
 
-"""This modules implements the computation of ink coverage in different colorspaces."""
+"""This modules implements the computation of ink coverage in different colorspaces.
+
+   All computations work on whole pages at once, using PIL's band
+   operations and histograms, instead of looping over each pixel
+   in Python. The sums involved are exact integer sums, so results
+   are identical to the ones of the original per-pixel algorithms
+   (tolerance: 0.0, the floating point formulas are unchanged).
+"""
 
 import sys
+import os
+import collections
 
 from . import pdlparser
-from functools import reduce
 
 try:
-    from PIL import Image
+    from PIL import Image, ImageChops, ImageFilter
 except ImportError:
     sys.stderr.write("ERROR: You MUST install the Python Imaging Library (python-imaging) for pkpgcounter to work.\n")
     raise pdlparser.PDLParserError("The Python Imaging Library is missing.")
 
+def getBandSum(band):
+    """Returns the sum of all the pixels' values in a single band picture."""
+    return sum([value * count for (value, count) in enumerate(band.histogram())])
+
 def getPercent(img, nbpix):
     """Extracts the percents per color component from a picture."""
     result = {}
-    bands = img.split()
-    for (i, bandname) in enumerate(img.getbands()):
-        result[bandname] = 100.0 * (reduce(lambda current, next: current + (next[1] * next[0]), enumerate(bands[i].histogram()), 0) / 255.0) / nbpix
+    for (bandname, band) in zip(img.getbands(), img.split()):
+        result[bandname] = 100.0 * (getBandSum(band) / 255.0) / nbpix
     return result
 
 def getPercentCMYK(img, nbpix):
     """Extracts the percents of Cyan, Magenta, Yellow, and Black from a picture.
 
        PIL doesn't produce useable CMYK for our algorithm, so we use the algorithm from PrintBill.
+
+       For each pixel black is 255 - max(r, g, b) and cyan is 255 - r - black,
+       that is max(r, g, b) - r, so everything can be derived from the
+       sums of the red, green, blue and max(r, g, b) bands.
     """
     if img.mode != "RGB":
         img = img.convert("RGB")
-    cyan = magenta = yellow = black = 0
-    for (r, g, b) in img.getdata():
-        pixblack = 255 - max(r, g, b)
-        black += pixblack
-        cyan += 255 - r - pixblack
-        magenta += 255 - g - pixblack
-        yellow += 255 - b - pixblack
+    (red, green, blue) = img.split()
+    maxband = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+    summax = getBandSum(maxband)
+    black = (255 * img.size[0] * img.size[1]) - summax
+    cyan = summax - getBandSum(red)
+    magenta = summax - getBandSum(green)
+    yellow = summax - getBandSum(blue)
 
     frac = 100.0 / nbpix
     return { "C": frac * (cyan / 255.0),
@@ -66,11 +81,13 @@ def getPercentGC(img, nbpix):
     """Determines if a page is in grayscale or colour mode."""
     if img.mode != "RGB":
         img = img.convert("RGB")
-    gray = 0
-    for (r, g, b) in img.getdata():
-        if not (r == g == b):
-            # optimize: if a single pixel is not gray the whole page is colored.
-            return { "G": 0.0, "C": 100.0 }
+    (red, green, blue) = img.split()
+    # A pixel is gray when r == g == b, so the page is coloured
+    # as soon as a single difference between bands is not null.
+    differences = ImageChops.lighter(ImageChops.difference(red, green),
+                                     ImageChops.difference(green, blue))
+    if differences.getbbox() is not None:
+        return { "G": 0.0, "C": 100.0 }
     return { "G": 100.0, "C": 0.0 }
 
 def getPercentBW(img, nbpix):
@@ -93,29 +110,160 @@ def getPercentCMY(img, nbpix):
              "Y": 100.0 - result["B"],
            }
 
-def getInkCoverage(fname, colorspace):
+def getErrorEstimate(img, nbpix):
+    """Returns an estimate of the error, in percents, made on the ink
+       coverage of a picture because of its resolution.
+
+       The limits of inked areas are only known to within half a
+       pixel, and each of them marks as edges the pixels on both of
+       its sides, so each edge pixel is worth a quarter of a pixel.
+    """
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")
+    (width, height) = img.size
+    if (width < 3) or (height < 3):
+        return 0.0
+    # The filter doesn't compute the outermost pixels, so they are cropped
+    edges = img.filter(ImageFilter.FIND_EDGES).crop((1, 1, width - 1, height - 1))
+    if edges.mode == "RGB":
+        (red, green, blue) = edges.split()
+        edges = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+    nbedges = ((width - 2) * (height - 2)) - edges.histogram()[0]
+    return 25.0 * nbedges / nbpix
+
+def computePage(image, colorspace, errors=False):
+    """Returns the ink coverage of the current page of an opened picture,
+       with its error estimate if errors is True.
+    """
+    nbpixels = image.size[0] * image.size[1]
+    result = globals()["getPercent%s" % colorspace](image, nbpixels)
+    if errors:
+        result["error"] = getErrorEstimate(image, nbpixels)
+    return result
+
+def isUncertain(page, colorspace, maxerror=None, thresholds=None):
+    """Returns True if the ink coverage of a page isn't known precisely
+       enough: if its error estimate is greater than maxerror, or if
+       one of its components is within the error estimate of one of
+       the thresholds, else False.
+    """
+    error = page.get("error", 0.0)
+    if (maxerror is not None) and (error > maxerror):
+        return True
+    for component in colorspace.upper():
+        value = page.get(component)
+        if value is not None:
+            for threshold in thresholds or []:
+                if abs(value - threshold) <= error:
+                    return True
+    return False
+
+def openImage(fname):
+    """Opens a (possibly multi-page) picture, raising PDLParserError on failure."""
+    try:
+        return Image.open(fname)
+    except (IOError, OverflowError) as msg:
+        raise pdlparser.PDLParserError("%s (%s)" % (msg, fname))
+
+def getNbPages(image):
+    """Returns the number of pages (aka frames) in an opened picture."""
+    nbpages = getattr(image, "n_frames", None)
+    if nbpages is None:
+        nbpages = 1
+        try:
+            while True:
+                image.seek(nbpages)
+                nbpages += 1
+        except EOFError:
+            image.seek(0)
+    return nbpages
+
+def getPageInkCoverage(fname, colorspace, index, errors=False):
+    """Returns a dictionnary containing for each color component
+       the percent of ink coverage on a single page of a picture,
+       and the error estimate if errors is True.
+
+       This is a module level function so that it can be sent
+       to the worker processes of a process pool.
+    """
+    image = openImage(fname)
+    try:
+        image.seek(index)
+    except EOFError:
+        raise pdlparser.PDLParserError("No page %i in %s" % (index + 1, fname))
+    return computePage(image, colorspace.upper(), errors)
+
+def getInkCoverage(fname, colorspace, jobs=None, errors=False):
     """Returns a list of dictionnaries containing for each page,
        for each color component, the percent of ink coverage on
        that particular page.
+
+       If errors is True, each dictionnary also contains the error
+       estimate of the page's ink coverage, see getErrorEstimate().
+
+       If jobs is greater than 1, pages are decoded and computed
+       in a pool of at most jobs processes. Results are always
+       returned in page order.
     """
     result = []
     colorspace = colorspace.upper()
-    computation = globals()["getPercent%s" % colorspace]
     index = 0
+    image = openImage(fname)
+    if jobs and (jobs > 1):
+        nbpages = getNbPages(image)
+        if nbpages > 1:
+            from concurrent import futures
+            with futures.ProcessPoolExecutor(max_workers=min(jobs, nbpages)) as executor:
+                result = list(executor.map(getPageInkCoverage,
+                                           [fname] * nbpages,
+                                           [colorspace] * nbpages,
+                                           range(nbpages),
+                                           [errors] * nbpages))
+            return (colorspace, result)
     try:
-        image = Image.open(fname)
-    except (IOError, OverflowError) as msg:
-        raise pdlparser.PDLParserError("%s (%s)" % (msg, fname))
+        while True:
+            result.append(computePage(image, colorspace, errors))
+            index += 1
+            image.seek(index)
+    except EOFError:
+        pass
+    return (colorspace, result)
+
+def iterInkCoverage(pagefiles, colorspace, jobs=None, errors=False):
+    """Generator which yields, for each single page picture file from
+       the pagefiles iterable, a dictionnary containing for each
+       color component the percent of ink coverage on that page,
+       and the error estimate if errors is True.
+
+       Each file is deleted once its ink coverage is known.
+
+       If jobs is greater than 1, pages are computed in a pool of
+       at most jobs processes. Results are always yielded in page order.
+    """
+    colorspace = colorspace.upper()
+    if jobs and (jobs > 1):
+        from concurrent import futures
+        with futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            pending = collections.deque()
+            def nextResult():
+                """Waits for the oldest pending page and deletes its file."""
+                (fname, future) = pending.popleft()
+                try:
+                    return future.result()
+                finally:
+                    os.remove(fname)
+            for fname in pagefiles:
+                pending.append((fname, executor.submit(getPageInkCoverage, fname, colorspace, 0, errors)))
+                while pending and ((len(pending) > jobs) or pending[0][1].done()):
+                    yield nextResult()
+            while pending:
+                yield nextResult()
     else:
-        try:
-            while True:
-                nbpixels = image.size[0] * image.size[1]
-                result.append(computation(image, nbpixels))
-                index += 1
-                image.seek(index)
-        except EOFError:
-            pass
-        return (colorspace, result)
+        for fname in pagefiles:
+            try:
+                yield getPageInkCoverage(fname, colorspace, 0, errors)
+            finally:
+                os.remove(fname)
 
 if __name__ == "__main__":
     # NB: length of result gives number of pages !
@@ -76,7 +76,7 @@ class Parser(pdlparser.PDLParser):
                 header = self.infile.read(HEADERSIZE)
                 if not header:
                     break
-                if (len(header) != HEADERSIZE) or (header[0] != "$"):
+                if (len(header) != HEADERSIZE) or (header[:1] != b"$"):
                     # Invalid header or no Frame Sync byte.
                     raise pdlparser.PDLParserError("This file doesn't seem to be valid Hewlett-Packard LIDIL datas.")
                 (framesync,
@@ -27,6 +27,8 @@ import tempfile
 from . import pdlparser
 from . import version
 
+DOCTOPS = 'xvfb-run -a abiword --import-extension=.doc --print="%(outfname)s" "%(infname)s"'
+
 class Parser(pdlparser.PDLParser):
     """A parser for that MS crap thing."""
     totiffcommands = [ 'xvfb-run -a abiword --import-extension=.doc --print="| gs -sDEVICE=tiff24nc -dPARANOIDSAFER -dNOPAUSE -dBATCH -dQUIET -r\"%(dpi)i\" -sOutputFile=\"%(outfname)s\" -" "%(infname)s"' ]
@@ -58,7 +60,6 @@ class Parser(pdlparser.PDLParser):
 
            First we convert from .doc to .ps, then we use the PostScript parser.
         """
-        doctops = 'xvfb-run -a abiword --import-extension=.doc --print="%(outfname)s" "%(infname)s"'
         workfile = tempfile.NamedTemporaryFile(mode="w+b",
                                                prefix="pkpgcounter_",
                                                suffix=".ps",
@@ -66,7 +67,7 @@ class Parser(pdlparser.PDLParser):
         try:
             outfname = workfile.name
             infname = self.filename
-            status = os.system(doctops % locals())
+            status = os.system(DOCTOPS % locals())
             if status or not os.stat(outfname).st_size:
                 raise pdlparser.PDLParserError("Impossible to convert input document %(infname)s to PostScript" % locals())
             psinputfile = open(outfname, "rb")
@@ -81,3 +82,30 @@ class Parser(pdlparser.PDLParser):
         finally:
             workfile.close()
         raise pdlparser.PDLParserError("Impossible to count pages in %(infname)s" % locals())
+
+    async def asyncGetJobSize(self, executor=None):
+        """Same as getJobSize(), but without blocking the event loop.
+
+           The conversion to PostScript is killed if the coroutine is cancelled.
+        """
+        workfile = tempfile.NamedTemporaryFile(mode="w+b",
+                                               prefix="pkpgcounter_",
+                                               suffix=".ps",
+                                               dir=os.environ.get("PYKOTADIRECTORY") or tempfile.gettempdir())
+        try:
+            outfname = workfile.name
+            infname = self.filename
+            status = await pdlparser.runCommand(DOCTOPS % locals())
+            if status or not os.stat(outfname).st_size:
+                raise pdlparser.PDLParserError("Impossible to convert input document %(infname)s to PostScript" % locals())
+            psinputfile = open(outfname, "rb")
+            try:
+                (first, last) = self.parent.readFirstAndLastBlocks(psinputfile)
+                from . import postscript
+                return await postscript.Parser(self.parent,
+                                               outfname,
+                                               (first, last)).asyncGetJobSize(executor)
+            finally:
+                psinputfile.close()
+        finally:
+            workfile.close()
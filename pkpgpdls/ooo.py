@@ -33,7 +33,7 @@ class Parser(pdlparser.PDLParser):
     format = "ISO/IEC DIS 26300"
     def isValid(self):
         """Returns True if data is OpenDocument, else False."""
-        if self.firstblock[:2] == "PK":
+        if self.firstblock[:2] == b"PK":
             try:
                 self.archive = zipfile.ZipFile(self.filename)
                 self.contentxml = self.archive.read("content.xml")
@@ -53,11 +53,11 @@ class Parser(pdlparser.PDLParser):
         pagecount = 0
         try:
             # First try with Text documents
-            index = self.metaxml.index("meta:page-count=")
-            pagecount = int(self.metaxml[index:].split('"')[1])
+            index = self.metaxml.index(b"meta:page-count=")
+            pagecount = int(self.metaxml[index:].split(b'"')[1])
         except:
             # Now try with Impress documents
-            pagecount = self.contentxml.count("<draw:page ")
+            pagecount = self.contentxml.count(b"<draw:page ")
             if not pagecount:
                 # Probably a Spreadsheet document
                 raise pdlparser.PDLParserError("OpenOffice.org's spreadsheet documents are not yet supported.")
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter: a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+
+"""This module implements compact page indexes for binary jobs.
+
+   Parsers which know where each page starts and ends while counting
+   (PCLXL, QPDL and SPL1) can build an index of the pages, with their
+   copies, media size, duplex and colour modes, and save it next to
+   the job. Page ranges can then be extracted or counted again without
+   scanning the whole job.
+
+   Each page is a fixed size record packed with the struct module. The
+   saved file is made of a header, the media sizes names separated by
+   NUL bytes, then the records.
+"""
+
+import os
+import struct
+
+from . import pdlparser
+
+MAGIC = b"PKPGIDX1"
+SUFFIX = ".pgidx"
+
+# magic, size of the indexed job, number of pages, length of the media names
+HEADER = struct.Struct("<8sQII")
+# start offset, end offset, copies, media size, duplex mode, colour mode
+RECORD = struct.Struct("<QQIHBB")
+
+UNKNOWN = 0
+(SIMPLEX, DUPLEX) = (1, 2)
+(BW, COLOR) = (1, 2)
+DUPLEXMODES = { UNKNOWN: None, SIMPLEX: "Simplex", DUPLEX: "Duplex" }
+COLORMODES = { UNKNOWN: None, BW: "BW", COLOR: "Color" }
+
+def getIndexFilename(filename):
+    """Returns the name of the page index saved next to a job."""
+    return filename + SUFFIX
+
+class PageIndex:
+    """The start and end offsets, copies, media size, duplex and
+       colour modes of each page of a job.
+    """
+    def __init__(self, jobsize=0):
+        """Initializes an empty index for a job of jobsize bytes."""
+        self.jobsize = jobsize
+        self.records = bytearray()
+        self.medias = [""]      # Media size 0 is unknown
+        self.mediacodes = { "": 0 }
+
+    def __len__(self):
+        """Returns the number of pages in the index."""
+        return len(self.records) // RECORD.size
+
+    def __getitem__(self, pagenum):
+        """Returns the details of a page, numbered from 0."""
+        if not (0 <= pagenum < len(self)):
+            raise IndexError("page index out of range")
+        (start, end, copies, media, duplex, color) = RECORD.unpack_from(self.records, pagenum * RECORD.size)
+        return { "start": start,
+                 "end": end,
+                 "copies": copies,
+                 "mediasize": self.medias[media] or None,
+                 "duplex": DUPLEXMODES[duplex],
+                 "colormode": COLORMODES[color],
+               }
+
+    def getMediaCode(self, mediasize):
+        """Returns the code of a media size, adding it if needed."""
+        mediasize = str(mediasize or "")
+        code = self.mediacodes.get(mediasize)
+        if code is None:
+            code = self.mediacodes[mediasize] = len(self.medias)
+            self.medias.append(mediasize)
+        return code
+
+    def addPage(self, start, end, copies=1, mediasize=None, duplex=None, colormode=None):
+        """Adds a page to the index."""
+        if not duplex:
+            duplexcode = UNKNOWN
+        elif str(duplex).lower() == "simplex":
+            duplexcode = SIMPLEX
+        else:
+            duplexcode = DUPLEX
+        colorcode = { "bw": BW, "color": COLOR }.get(str(colormode).lower(), UNKNOWN)
+        self.records += RECORD.pack(start, end, max(copies, 0), self.getMediaCode(mediasize), duplexcode, colorcode)
+
+    def addPages(self, starts, ends, pagesdetails=None):
+        """Adds pages from the lists of their offsets and their details.
+
+           Pages with None as their end offset end with the job.
+        """
+        for (pnum, (start, end)) in enumerate(zip(starts, ends)):
+            if (end is None) or (end > self.jobsize):
+                end = self.jobsize
+            if pagesdetails and (pnum < len(pagesdetails)):
+                details = pagesdetails[pnum]
+                self.addPage(start, end,
+                             details.get("copies", 1),
+                             details.get("mediasize"),
+                             details.get("duplex"),
+                             details.get("colormode"))
+            else:
+                self.addPage(start, end)
+
+    def getSpan(self, first, last):
+        """Returns the (start, end) offsets of the pages first to last, numbered from 1."""
+        if not (1 <= first <= last <= len(self)):
+            raise pdlparser.PDLParserError("Invalid page range %i-%i for a job of %i pages" % (first, last, len(self)))
+        return (RECORD.unpack_from(self.records, (first - 1) * RECORD.size)[0],
+                RECORD.unpack_from(self.records, (last - 1) * RECORD.size)[1])
+
+    def countPages(self, first=1, last=None):
+        """Returns the number of pages to print for the pages first to last, copies included."""
+        if last is None:
+            last = len(self)
+        self.getSpan(first, last) # Checks the range
+        return sum([record[2] for record in RECORD.iter_unpack(self.records[(first - 1) * RECORD.size:last * RECORD.size])])
+
+    def readPages(self, infile, first, last):
+        """Returns the datas of the pages first to last from the job opened as infile."""
+        (start, end) = self.getSpan(first, last)
+        infile.seek(start)
+        return infile.read(end - start)
+
+    def save(self, filename):
+        """Saves the index to a file, atomically."""
+        medias = "\0".join(self.medias).encode("utf-8")
+        tempname = "%s.%i.tmp" % (filename, os.getpid())
+        outfile = open(tempname, "wb")
+        try:
+            outfile.write(HEADER.pack(MAGIC, self.jobsize, len(self), len(medias)))
+            outfile.write(medias)
+            outfile.write(self.records)
+        finally:
+            outfile.close()
+        os.replace(tempname, filename)
+
+def load(filename, jobsize=None):
+    """Loads a page index from a file.
+
+       If jobsize is given, the index must be the one of a job of
+       this size, or it is considered to be out of date.
+    """
+    infile = open(filename, "rb")
+    try:
+        datas = infile.read()
+    finally:
+        infile.close()
+    try:
+        (magic, size, nbpages, mediaslength) = HEADER.unpack_from(datas)
+    except struct.error:
+        magic = None
+    if magic != MAGIC:
+        raise pdlparser.PDLParserError("%s is not a page index" % filename)
+    if (jobsize is not None) and (jobsize != size):
+        raise pdlparser.PDLParserError("The page index %s is out of date" % filename)
+    start = HEADER.size + mediaslength
+    index = PageIndex(size)
+    index.medias = datas[HEADER.size:start].decode("utf-8").split("\0")
+    index.mediacodes = dict([(m, i) for (i, m) in enumerate(index.medias)])
+    index.records = bytearray(datas[start:start + nbpages * RECORD.size])
+    if len(index) != nbpages:
+        raise pdlparser.PDLParserError("The page index %s is truncated" % filename)
+    return index
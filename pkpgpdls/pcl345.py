@@ -23,17 +23,28 @@
 
 import sys
 import os
+import re
 import mmap
 from struct import unpack
 
 from . import pdlparser
 from . import pjl
 
-NUL = chr(0x00)
-LINEFEED = chr(0x0a)
-FORMFEED = chr(0x0c)
-ESCAPE = chr(0x1b)
-ASCIILIMIT = chr(0x80)
+NUL = 0x00
+LINEFEED = 0x0a
+FORMFEED = 0x0c
+ESCAPE = 0x1b
+ASCIILIMIT = 0x80
+IMAGERUNNER = 0xcd
+STOPBYTES = frozenset((NUL, ESCAPE, FORMFEED, ASCIILIMIT))
+
+MARKERSRE = re.compile(b"[\x0a\x0c\x1b\x80\xcd]")   # Only bytes which have a meaning outside of escape sequences
+INTEGERRE = re.compile(b"[0-9-]*")                    # Sign and digits of a parameter
+RASTERROWRE = re.compile(b"\x1b\\*b(?:[0-9]*[a-uxyz])*([0-9]+)[VWvw]") # Raster row, by far the most common sequence
+PJLRE = re.compile(b'(?:[^\x00\x0c\x1b"\x80-\xff]|"[^\x00\x0c\x1b"]*"?)*') # Escaped datas, quotes allow 8 bits
+UELMARKER = b"-12345X"
+IMAGERUNNERMARKER1 = b"\xcd\xca" # Markers for Canon ImageRunner printers
+IMAGERUNNERMARKER2 = b"\x10\x02" # Blocks with this command have no datas
 
 class Parser(pdlparser.PDLParser):
     """A parser for PCL3, PCL4, PCL5 documents."""
@@ -94,7 +105,7 @@ class Parser(pdlparser.PDLParser):
         """Returns True if data is PCL3/4/5, else False."""
         try:
             pos = 0
-            while self.firstblock[pos] == chr(0):
+            while self.firstblock[pos] == NUL:
                 pos += 1
         except IndexError:
             return False
@@ -104,7 +115,7 @@ class Parser(pdlparser.PDLParser):
                firstblock.startswith(b"\033(") or \
                firstblock.startswith(b"\033%1BBPIN;") or \
                ((pos == 11000) and firstblock.startswith(b"\033")) or \
-               (firstblock.startswith(b"\033*rbC") and (not self.lastblock[-3:] == "\f\033@")) or \
+               (firstblock.startswith(b"\033*rbC") and (not self.lastblock[-3:] == b"\f\033@")) or \
                firstblock.startswith(b"\033*rB\033") or \
                firstblock.startswith(b"\033%8\033") or \
                (firstblock.find(b"\033%-12345X") != -1) or \
@@ -141,28 +152,24 @@ class Parser(pdlparser.PDLParser):
 
     def escPercent(self):
         """Handles the ESC% sequence."""
-        if self.minfile[self.pos: self.pos+7] == r"-12345X":
+        minfile = self.minfile
+        if minfile[self.pos: self.pos+7] == UELMARKER:
             #self.logdebug("Generic ESCAPE sequence at %08x" % self.pos)
-            self.pos += 7
-            buffer = []
-            quotes = 0
-            char = chr(self.readByte())
-            while ((char < ASCIILIMIT) or (quotes % 2)) and (char not in (FORMFEED, ESCAPE, NUL)):
-                buffer.append(char)
-                if char == '"':
-                    quotes += 1
-                char = chr(self.readByte())
-            self.setPageDict("escaped", "".join(buffer))
-            #self.logdebug("ESCAPED: %s" % "".join(buffer))
-            self.pos -= 1   # Adjust position
+            start = self.pos + 7
+            end = PJLRE.match(minfile, start).end()
+            minfile[end] # Raises IndexError at EOF
+            self.setPageDict("escaped", minfile[start:end].decode("latin-1"))
+            #self.logdebug("ESCAPED: %s" % minfile[start:end])
+            self.pos = end
         else:
             while 1:
                 (value, end) = self.getInteger()
                 if end == 'B':
                     self.enterHPGL2()
-                    while self.minfile[self.pos] != ESCAPE:
-                        self.pos += 1
-                    self.pos -= 1
+                    pos = minfile.find(b"\033", self.pos)
+                    if pos == -1:
+                        raise IndexError("No end of HPGL2 block")
+                    self.pos = pos - 1
                     return
                 elif end == 'A':
                     self.exitHPGL2()
@@ -337,37 +344,65 @@ class Parser(pdlparser.PDLParser):
 
     def getInteger(self):
         """Returns an integer value and the end character."""
-        sign = 1
-        value = None
-        while 1:
-            char = chr(self.readByte())
-            if char in (NUL, ESCAPE, FORMFEED, ASCIILIMIT):
-                self.pos -= 1 # Adjust position
-                return (None, None)
-            if char == '-':
-                sign = -1
-            elif not char.isdigit():
-                if value is not None:
-                    return (sign*value, char)
-                else:
-                    return (value, char)
-            else:
-                value = ((value or 0) * 10) + int(char)
+        minfile = self.minfile
+        start = self.pos
+        end = INTEGERRE.match(minfile, start).end()
+        char = minfile[end]
+        if char in STOPBYTES:
+            self.pos = end
+            return (None, None)
+        self.pos = end + 1
+        if end == start:
+            return (None, chr(char))
+        digits = minfile[start:end]
+        if b"-" in digits:
+            digits = digits.replace(b"-", b"")
+            if not digits:
+                return (None, chr(char))
+            return (-int(digits), chr(char))
+        return (int(digits), chr(char))
 
     def skipByte(self):
         """Skips a byte."""
         #self.logdebug("SKIPBYTE %08x ===> %02x" % (self.pos, ord(self.minfile[self.pos])))
         self.pos += 1
 
+    def scanTags(self, tags):
+        """Dispatches each marker byte to its handler.
+
+           All other bytes are ignored outside of escape sequences,
+           so we jump from one marker to the next instead of
+           reading the input byte per byte, and skip raster rows
+           without going through the escape sequences handlers.
+        """
+        minfile = self.minfile
+        search = MARKERSRE.search
+        rasterrow = RASTERROWRE.match
+        while 1:
+            match = search(minfile, self.pos)
+            if match is None:
+                return
+            pos = match.start()
+            tag = minfile[pos]
+            if tag == ESCAPE:
+                row = rasterrow(minfile, pos)
+                if row is not None:
+                    self.pos = row.end() + int(row.group(1))
+                    if minfile[self.pos] not in STOPBYTES:
+                        self.escStarb() # Other parameters follow
+                    continue
+            self.pos = pos + 1
+            tags[tag]()
+
     def handleImageRunner(self):
         """Handles Canon ImageRunner tags."""
         tag = self.readByte()
-        if tag == self.imagerunnermarker1[-1]:
+        if tag == IMAGERUNNERMARKER1[-1]:
             oldpos = self.pos-2
             codop = self.minfile[self.pos:self.pos+2]
             length = unpack(">H", self.minfile[self.pos+6:self.pos+8])[0]
             self.pos += 18
-            if codop != self.imagerunnermarker2:
+            if codop != IMAGERUNNERMARKER2:
                 self.pos += length
             self.logdebug("ImageRunner tag: Skip %i bytes from 0x%08x to 0x%08x" % (self.pos-oldpos,
                                                                                      oldpos,
@@ -409,16 +444,14 @@ class Parser(pdlparser.PDLParser):
         self.startgfx = []
         self.endgfx = []
         self.hpgl2 = False
-        self.imagerunnermarker1 = b"\xcd\xca" # Markers for Canon ImageRunner printers
-        self.imagerunnermarker2 = b"\x10\x02"
-        self.isimagerunner = (minfile[:2] == self.imagerunnermarker1)
+        self.isimagerunner = (minfile[:2] == IMAGERUNNERMARKER1)
 
         tags = [ lambda: None] * 256
-        tags[ord(LINEFEED)] = self.newLine
-        tags[ord(FORMFEED)] = self.endPage
-        tags[ord(ESCAPE)] = self.escape
-        tags[ord(ASCIILIMIT)] = self.skipByte
-        tags[ord(self.imagerunnermarker1[0])] = self.handleImageRunner
+        tags[LINEFEED] = self.newLine
+        tags[FORMFEED] = self.endPage
+        tags[ESCAPE] = self.escape
+        tags[ASCIILIMIT] = self.skipByte
+        tags[IMAGERUNNER] = self.handleImageRunner
 
         self.esctags = [ lambda: None ] * 256
         self.esctags[ord('%')] = self.escPercent
@@ -463,8 +496,7 @@ class Parser(pdlparser.PDLParser):
         self.pos = 0
         try:
             try:
-                while 1:
-                    tags[self.readByte()]()
+                self.scanTags(tags)
             except IndexError: # EOF ?
                 pass
         finally:
@@ -534,6 +566,7 @@ class Parser(pdlparser.PDLParser):
         oldpjlcopies = -1
         oldduplexmode = ""
         oldpapersize = ""
+        self.pagesdetails = []
         for pnum in range(self.pagecount):
             # if no number of copies defined, take the preceding one else the one set before any page else 1.
             page = self.pages.get(pnum, self.pages.get(pnum - 1, self.pages.get(0, { "copies": 1, "mediasource": "Main", "mediasize": "Default", "mediatype": "Plain", "orientation": "Portrait", "escaped": "", "duplex": 0})))
@@ -606,6 +639,13 @@ class Parser(pdlparser.PDLParser):
             oldpapersize = papersize
             copies = max(pjlcopies, page["copies"]) # Was: pjlcopies * page["copies"]
             self.pagecount += (copies - 1)
+            self.pagesdetails.append({ "copies": copies,
+                                       "mediatype": page["mediatype"],
+                                       "mediasize": papersize,
+                                       "orientation": page["orientation"],
+                                       "mediasource": page["mediasource"],
+                                       "duplex": duplexmode,
+                                     })
             self.logdebug("%s*%s*%s*%s*%s*%s*BW" % (copies, \
                                               page["mediatype"], \
                                               papersize, \
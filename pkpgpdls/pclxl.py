@@ -21,14 +21,43 @@
 
 """This modules implements a page counter for PCLXL (aka PCL6) documents."""
 
-import sys
 import os
 import mmap
-from struct import unpack
+import struct
 
 from . import pdlparser
 from . import pjl
-import collections
+
+# Unpackers of the integer data types, for each byte order.
+# Signed and real values are only used as sizes, so they're read unsigned.
+UNPACKERS = {}
+for (byteorder, marker) in ((">", 0x28), ("<", 0x29)):
+    (uint16, uint32) = (struct.Struct(byteorder + "H"), struct.Struct(byteorder + "I"))
+    UNPACKERS[marker] = { 0xc0: struct.Struct("B"), # ubyte
+                          0xc1: uint16,             # uint16
+                          0xc2: uint32,             # uint32
+                          0xc3: uint16,             # sint16
+                          0xc4: uint32,             # sint32
+                          0xc5: uint32,             # real32
+                        }
+
+# Size of each token which is neither handled specially nor an array,
+# tag included, or item size of arrays as a negative number. Tokens
+# with a null size are handled specially.
+SKIPS = [1] * 256 # Operators
+for (tag, size) in ((0xc0, 1), (0xc1, 2), (0xc2, 4), (0xc3, 2), (0xc4, 4), (0xc5, 4), # scalars
+                    (0xd0, 2), (0xd1, 4), (0xd2, 8), (0xd3, 4), (0xd4, 8), (0xd5, 8), # xy
+                    (0xe0, 4), (0xe1, 8), (0xe2, 16), (0xe3, 8), (0xe4, 16), (0xe5, 16), # boxes
+                    (0xf8, 1), (0xf9, 2)): # attribute identifiers
+    SKIPS[tag] = 1 + size
+for (tag, size) in ((0xc8, 1), (0xc9, 2), (0xca, 4), (0xcb, 2), (0xcc, 4)): # arrays
+    SKIPS[tag] = -size
+for tag in (0x1b, 0x21, 0x28, 0x29, 0x31, 0x43, 0x44, 0x46, 0x6a, 0xcd, 0xfa, 0xfb):
+    SKIPS[tag] = 0
+
+IMAGERUNNERMARKERS = (b"\xca\x10\x00", b"\xca\x10\x02") # Following 0xcd
+RGBCOLORSPACE = b"\x02\xf8\x03"
+SETNUMBEROFCOPIES = b"\xf8\x31"
 
 class Parser(pdlparser.PDLParser):
     """A parser for PCLXL (aka PCL6) documents."""
@@ -111,36 +140,38 @@ class Parser(pdlparser.PDLParser):
 
         # Now go upstream to decode media type, size, source, and orientation
         # this saves time because we don't need a complete parser !
-        minfile = self.minfile
+        data = self.data
+        start = nextpos - 1
         pos = nextpos - 2
         while pos > 0: # safety check: don't go back to far !
-            val = minfile[pos]
+            val = data[pos]
             if val in (0x44, 0x48, 0x41): # if previous endPage or openDataSource or beginSession (first page)
+                start = pos + 1
                 break
             if val == 0x26:
-                mediasource = ord(minfile[pos - 2])
+                mediasource = data[pos - 2]
                 mediasourcelabel = self.mediasources.get(mediasource, str(mediasource))
                 pos -= 4
             elif val == 0x25:
-                while (pos > 0) and (ord(minfile[pos]) != 0xc0):
+                while (pos > 0) and (data[pos] != 0xc0):
                     # we search the preceding ubyte tag
                     pos -= 1
                 if pos > 0:
-                    if ord(minfile[pos-1]) == 0xc8:
+                    if data[pos-1] == 0xc8:
                         # if we found an ubyte_array then the media
                         # size is completely spelled
-                        arraylength = ord(minfile[pos+1])
-                        mediasizelabel = minfile[pos+2:pos+2+arraylength].title()
+                        arraylength = data[pos+1]
+                        mediasizelabel = bytes(data[pos+2:pos+2+arraylength]).decode("latin-1").title()
                         pos -= 1
                     else:
                         # if we just found an ubyte, then the media
                         # size is known by its index
-                        mediasize = ord(minfile[pos+1])
+                        mediasize = data[pos+1]
                         mediasizelabel = self.mediasizes.get(mediasize, str(mediasize))
                     pos -= 1
                     # self.logdebug("Media size: %s" % mediasizelabel)
             elif val == 0x28:
-                orientation = ord(minfile[pos - 2])
+                orientation = data[pos - 2]
                 orientationlabel = self.orientations.get(orientation, str(orientation))
                 pos -= 4
             elif val == 0x27:
@@ -148,26 +179,19 @@ class Parser(pdlparser.PDLParser):
                 pos -= 1
                 startpos = size = None
                 while pos > 0: # safety check: don't go back to far !
-                    val = ord(minfile[pos])
+                    val = data[pos]
                     pos -= 1
                     if val == 0xc8:
-                        length = self.tags[ord(minfile[pos+2])] # will probably always be a byte or uint16
-                        if length == 1:
-                            startpos = pos + 4
-                            size = unpack("B", self.minfile[pos+3:startpos])[0]
-                        elif length == 2:
-                            startpos = pos + 5
-                            size = unpack(self.unpackShort, self.minfile[pos+3:startpos])[0]
-                        elif length == 4:
-                            startpos = pos + 7
-                            size = unpack(self.unpackLong, self.minfile[pos+3:startpos])[0]
-                        else:
-                            raise pdlparser.PDLParserError("Error on size at %s: %s" % (pos+2, length))
+                        unpacker = self.unpackers.get(data[pos+2]) # will probably always be a byte or uint16
+                        if (unpacker is None) or (unpacker.size > 4):
+                            raise pdlparser.PDLParserError("Error on size at %s" % (pos+2))
+                        startpos = pos + 3 + unpacker.size
+                        size = unpacker.unpack_from(data, pos+3)[0]
                         break
-                try:
-                    mediatypelabel = minfile[startpos:startpos+size]
-                except TypeError:
+                if startpos is None:
                     self.logdebug("PCL/XL parser problem at %i" % savepos)
+                else:
+                    mediatypelabel = bytes(data[startpos:startpos+size]).decode("latin-1")
                 # self.logdebug("Media type: %s" % mediatypelabel)
             elif val == 0x34:
                 duplexmode = "Simplex"
@@ -185,20 +209,26 @@ class Parser(pdlparser.PDLParser):
                                        "mediasource": mediasourcelabel,
                                        "duplex": duplexmode,
                                      }
+        # A page starts where the previous one ended, its attributes included.
+        if self.pageends and (self.pageends[-1] is not None):
+            start = self.pageends[-1]
+        self.pagestarts.append(start)
+        self.pageends.append(None)
         return 0
 
     def endPage(self, nextpos):
         """Indicates the end of a page."""
         # self.logdebug("EndPage at %x" % nextpos)
+        if self.pageends:
+            self.pageends[-1] = nextpos
         pos3 = nextpos - 3
-        minfile = self.minfile
-        if minfile[pos3:nextpos-1] == self.setNumberOfCopies:
+        if self.data[pos3:nextpos-1] == SETNUMBEROFCOPIES:
             # The EndPage operator may be preceded by a PageCopies attribute
             # So set number of copies for current page.
             # From what I read in PCLXL documentation, the number
             # of copies is an unsigned 16 bits integer
             try:
-                nbcopies = unpack(self.unpackShort, minfile[pos3-2:pos3])[0]
+                nbcopies = self.unpackers[0xc1].unpack_from(self.data, pos3-2)[0]
                 # self.logdebug("Number of copies: %i" % nbcopies)
                 self.pages[self.pagecount]["copies"] = nbcopies
             except KeyError:
@@ -207,170 +237,113 @@ class Parser(pdlparser.PDLParser):
 
     def setColorSpace(self, nextpos):
         """Changes the color space."""
-        if self.minfile[nextpos-4:nextpos-1] == self.RGBColorSpace: # TODO: doesn't seem to handle all cases !
+        if self.data[nextpos-4:nextpos-1] == RGBCOLORSPACE: # TODO: doesn't seem to handle all cases !
             self.iscolor = True
         return 0
 
     def array_Generic(self, nextpos, size):
         """Handles all arrays."""
-        pos = nextpos
-        datatype = ord(self.minfile[pos])
-        pos += 1
-        length = self.tags[datatype]
-        if isinstance(length, collections.Callable):
-            length = length(pos)
-        try:
-            return 1 + length + size * unpack(self.unpackType[length], self.minfile[pos:pos+length])[0]
-        except KeyError:
+        unpacker = self.unpackers.get(self.data[nextpos])
+        if unpacker is None:
             raise pdlparser.PDLParserError("Error on array size at %x" % nextpos)
+        return 1 + unpacker.size + size * unpacker.unpack_from(self.data, nextpos + 1)[0]
 
-    def array_8(self, nextpos):
-        """Handles byte arrays."""
-        return self.array_Generic(nextpos, 1)
-
-    def array_16(self, nextpos):
-        """Handles 16 bits arrays."""
-        return self.array_Generic(nextpos, 2)
-
-    def array_32(self, nextpos):
-        """Handles 32 bits arrays and Canon ImageRunner tags."""
-        minfile = self.minfile
-        irtag = minfile[nextpos-1:nextpos+3]
-        if irtag in (self.imagerunnermarker1, self.imagerunnermarker2):
+    def array_32_ImageRunner(self, nextpos):
+        """Handles real32 arrays and Canon ImageRunner tags."""
+        data = self.data
+        irtag = data[nextpos:nextpos+3]
+        if irtag in IMAGERUNNERMARKERS:
             # This is the beginning of a Canon ImageRunner tag
             # self.logdebug("Canon ImageRunner tag at %x" % (nextpos-1))
-            codop = minfile[nextpos+1:nextpos+3]
-            length = unpack(">H", minfile[nextpos+7:nextpos+9])[0]
-            # self.logdebug("Canon ImageRunner block length=%04x" % length)
             toskip = 19
-            if irtag != self.imagerunnermarker2:
-                toskip += length
+            if irtag != IMAGERUNNERMARKERS[1]:
+                toskip += UNPACKERS[0x28][0xc1].unpack_from(data, nextpos+7)[0]
             # self.logdebug("Canon ImageRunner skip until %x" % (nextpos+toskip))
             return toskip
         else:
             # This is a normal PCLXL array
             return self.array_Generic(nextpos, 4)
 
-    def embeddedDataSmall(self, nextpos):
-        """Handle small amounts of data."""
-        return 1 + ord(self.minfile[nextpos])
-
-    def embeddedData(self, nextpos):
-        """Handle normal amounts of data."""
-        return 4 + unpack(self.unpackLong, self.minfile[nextpos:nextpos+4])[0]
-
     def skipHPPCLXL(self, nextpos):
         """Skip the 'HP-PCL XL' statement if needed."""
-        minfile = self.minfile
-        if nextpos \
-           and ((minfile[nextpos:nextpos+11] == " HP-PCL XL;") \
-             or (minfile[nextpos:nextpos+14] == " BROTHER XLHB;")):
-            pos = nextpos
-            while minfile[pos] != '\n':
-                pos += 1
-            length = (pos - nextpos + 1)
-            # self.logdebug("Skip HP PCLXL statement until %x" % (nextpos + length))
-            return length
+        statement = self.data[nextpos:nextpos+15]
+        if (statement[:11] == b" HP-PCL XL;") or (statement == b" BROTHER XL2HB;"):
+            pos = self.minfile.find(b"\n", nextpos)
+            if pos == -1:
+                pos = len(self.data)
+            # self.logdebug("Skip HP PCLXL statement until %x" % (pos + 1))
+            return pos - nextpos + 1
         else:
             return 0
 
     def littleEndian(self, nextpos):
         """Toggles to little endianness."""
-        self.unpackType = { 1: "B", 2: "<H", 4: "<I" }
-        self.unpackShort = self.unpackType[2]
-        self.unpackLong = self.unpackType[4]
+        self.unpackers = UNPACKERS[0x29]
         # self.logdebug("LittleEndian at %x" % (nextpos - 1))
         return self.skipHPPCLXL(nextpos)
 
     def bigEndian(self, nextpos):
         """Toggles to big endianness."""
-        self.unpackType = { 1: "B", 2: ">H", 4: ">I" }
-        self.unpackShort = self.unpackType[2]
-        self.unpackLong = self.unpackType[4]
+        self.unpackers = UNPACKERS[0x28]
         # self.logdebug("BigEndian at %x" % (nextpos - 1))
         return self.skipHPPCLXL(nextpos)
 
-    def reservedForFutureUse(self, nextpos):
-        """Outputs something when a reserved byte is encountered."""
-        self.logdebug("Byte at %x is out of the PCLXL Protocol Class 2.0 Specification" % nextpos)
-        return 0
-
     def x31_class3(self, nextpos):
         """Undocumented tag 0x13 in class 3.0 streams."""
         #self.logdebug("x31 at 0x%08x" % (nextpos-1))
-        minfile = self.minfile
-        val = ord(minfile[nextpos])
-        if val == 0x90: # Should we take care of this or not ? It's undocumented after all !
+        if self.data[nextpos] == 0x90: # Should we take care of this or not ? It's undocumented after all !
             # BTW we don't know if it's the 0x31 or the 0x90 which counts, since 0x90 is reserved for future use
-            try:
-                return unpack(self.unpackType[4], self.minfile[nextpos+1:nextpos+5])[0] + 5
-            except KeyError:
-                raise pdlparser.PDLParserError("Error at %x" % nextpos+1)
+            return self.unpackers[0xc2].unpack_from(self.data, nextpos+1)[0] + 5
         return 0
 
     def x46_class3(self, nextpos):
         """Undocumented tag 0x46 in class 3.0 streams."""
         #self.logdebug("x46 at 0x%08x" % (nextpos-1))
+        data = self.data
         pos = nextpos - 3
-        minfile = self.minfile
-        val = ord(minfile[pos])
-        while val == 0xf8:
-            #self.logdebug("x46 continues at 0x%08x with 0x%02x" % (pos, val))
-            funcid = ord(minfile[pos+1])
-            try:
-                offset = self.x46_functions[funcid]
-            except KeyError:
+        if data[pos] == 0xf8:
+            funcid = data[pos+1]
+            if funcid == 0x92: # we want to skip these blocks
+                pos -= 5
+                unpacker = self.unpackers.get(data[pos])
+                if unpacker is None:
+                    raise pdlparser.PDLParserError("Error on size at %x" % (pos+1))
+                return unpacker.unpack_from(data, pos+1)[0]
+            elif funcid not in self.x46_functions:
                 self.logdebug("Unexpected subfunction 0x%02x for undocumented tag 0x46 at %x" % (funcid, nextpos))
-                break
-            else:
-                #self.logdebug("x46 funcid 0x%02x" % funcid)
-                pos -= offset
-                #self.logdebug("x46 new position 0x%08x" % pos)
-                length = self.tags[ord(self.minfile[pos])]
-                if isinstance(length, collections.Callable):
-                    length = length(pos+1)
-                #self.logdebug("x46 length %i" % length)
-                if funcid == 0x92: # we want to skip these blocks
-                    try:
-                        return unpack(self.unpackType[length], self.minfile[pos+1:pos+length+1])[0]
-                    except KeyError:
-                        raise pdlparser.PDLParserError("Error on size '%s' at %x" % (length, pos+1))
-            val = ord(minfile[pos])
         return 0
 
     def escape(self, nextpos):
         """Handles the ESC code."""
         pos = endpos = nextpos
-        minfile = self.minfile
-        if minfile[pos: pos+8] == r"%-12345X":
+        data = self.data
+        if data[pos: pos+8] == b"%-12345X":
             endpos = pos + 9
-            endmark = chr(0x0c) + chr(0x00) + chr(0x1b)
-            asciilimit = chr(0x80)
             quotes = 0
-            while (minfile[endpos] not in endmark) and \
-                   ((minfile[endpos] < asciilimit) or (quotes % 2)):
-                if minfile[endpos] == '"':
+            while (data[endpos] not in (0x0c, 0x00, 0x1b)) and \
+                   ((data[endpos] < 0x80) or (quotes % 2)):
+                if data[endpos] == 0x22: # '"'
                     quotes += 1
                 endpos += 1
 
             # Store this in a per page mapping.
             # NB: First time will be at page 0 (i.e. **before** page 1) !
             stuff = self.escapedStuff.setdefault(self.pagecount, [])
-            stuff.append(minfile[pos: endpos])
-            self.logdebug("Escaped datas: [%s]" % repr(minfile[pos: endpos]))
+            stuff.append(bytes(data[pos: endpos]).decode("latin-1"))
+            self.logdebug("Escaped datas: [%s]" % repr(stuff[-1]))
         return endpos - pos
 
     def skipKyoceraPrescribe(self, nextpos):
         """Skips Kyocera Prescribe commands."""
         pos = nextpos - 1
-        minfile = self.minfile
-        if minfile[pos:pos+3] == "!R!":
+        data = self.data
+        if data[pos:pos+3] == b"!R!":
             while (pos - nextpos) < 1024:   # This is a realistic upper bound, to avoid infinite loops
-                if (minfile[pos] == ";") and (minfile[pos-4:pos] == "EXIT"):
+                if (data[pos] == 0x3b) and (data[pos-4:pos] == b"EXIT"): # ';'
                     pos += 1
                     prescribe = self.prescribeStuff.setdefault(self.pagecount, [])
-                    prescribe.append(minfile[nextpos-1:pos])
-                    self.logdebug("Prescribe commands: [%s]" % repr(minfile[nextpos-1:pos]))
+                    prescribe.append(bytes(data[nextpos-1:pos]).decode("latin-1"))
+                    self.logdebug("Prescribe commands: [%s]" % repr(prescribe[-1]))
                     break
                 pos += 1
             return (pos - nextpos)
@@ -393,6 +366,9 @@ class Parser(pdlparser.PDLParser):
 
            Protocol Class 3.0 Supplement
            xl_refsup30r089.pdf
+
+           The scanner walks a memoryview of the mapped file, and
+           skips over embedded datas and arrays at once.
         """
 
         infileno = self.infile.fileno()
@@ -410,11 +386,9 @@ class Parser(pdlparser.PDLParser):
                 pos = line.find(b" BROTHER XL2HB;")
             if pos != -1:
                 found = True
-                endian = ord(line[pos - 1])
-                if endian == 0x29:
-                    self.littleEndian(0)
-                elif endian == 0x28:
-                    self.bigEndian(0)
+                endian = line[pos - 1]
+                if endian in UNPACKERS:
+                    self.unpackers = UNPACKERS[endian]
                 # elif endian == 0x27: # TODO: This is the ASCII binding code: what does it do exactly ?
                 #
                 else:
@@ -426,159 +400,29 @@ class Parser(pdlparser.PDLParser):
         for i in range(8, 256):
             self.mediasources[i] = "ExternalTray%03i" % (i - 7)
 
-        # Initialize table of tags
-        self.tags = [ 0 ] * 256
+        # Initialize table of handlers, for the tags which have
+        # a null size in SKIPS.
+        self.tags = tags = [ None ] * 256
 
-        self.tags[0x1b] = self.escape # The escape code
+        tags[0x1b] = self.escape # The escape code
 
-        self.tags[0x21] = self.skipKyoceraPrescribe # 0x21 is not normally used
+        tags[0x21] = self.skipKyoceraPrescribe # 0x21 is not normally used
 
         # GhostScript's sources tell us that HP printers
         # only accept little endianness, but we can handle both.
-        self.tags[0x28] = self.bigEndian    # BigEndian
-        self.tags[0x29] = self.littleEndian # LittleEndian
-
-        self.tags[0x31] = self.x31_class3   # What's this ? Does it always follow 0x46 ?
-        self.tags[0x43] = self.beginPage    # BeginPage
-        self.tags[0x44] = self.endPage      # EndPage
-        self.tags[0x45] = self.reservedForFutureUse # reserved
-
-        self.tags[0x46] = self.x46_class3
-
-        self.tags[0x4a] = self.reservedForFutureUse # reserved
-        self.tags[0x4b] = self.reservedForFutureUse # reserved
-        self.tags[0x4c] = self.reservedForFutureUse # reserved
-        self.tags[0x4d] = self.reservedForFutureUse # reserved
-        self.tags[0x4e] = self.reservedForFutureUse # reserved
-
-        self.tags[0x56] = self.reservedForFutureUse # TODO: documentation not clear about reserved status
-
-        self.tags[0x57] = self.reservedForFutureUse # reserved
-
-        self.tags[0x59] = self.reservedForFutureUse # reserved
-        self.tags[0x5a] = self.reservedForFutureUse # reserved
-
-        self.tags[0x6a] = self.setColorSpace    # to detect color/b&w mode
-
-        self.tags[0x87] = self.reservedForFutureUse # reserved
-        self.tags[0x88] = self.reservedForFutureUse # reserved
-        self.tags[0x89] = self.reservedForFutureUse # reserved
-        self.tags[0x8a] = self.reservedForFutureUse # reserved
-
-        self.tags[0x8b] = self.reservedForFutureUse # reserved
-
-        self.tags[0x8c] = self.reservedForFutureUse # reserved
-        self.tags[0x8d] = self.reservedForFutureUse # reserved
-        self.tags[0x8e] = self.reservedForFutureUse # reserved
-        self.tags[0x8f] = self.reservedForFutureUse # reserved
-        self.tags[0x90] = self.reservedForFutureUse # reserved
-
-        self.tags[0x9a] = self.reservedForFutureUse # reserved
-        self.tags[0x9c] = self.reservedForFutureUse # reserved
-
-        self.tags[0xa4] = self.reservedForFutureUse # reserved
-        self.tags[0xa5] = self.reservedForFutureUse # reserved
-        self.tags[0xa6] = self.reservedForFutureUse # reserved
-        self.tags[0xa7] = self.reservedForFutureUse # reserved
-
-        self.tags[0xaa] = self.reservedForFutureUse # reserved
-        self.tags[0xab] = self.reservedForFutureUse # reserved
-        self.tags[0xac] = self.reservedForFutureUse # reserved
-        self.tags[0xad] = self.reservedForFutureUse # reserved
-        self.tags[0xae] = self.reservedForFutureUse # reserved
-        self.tags[0xaf] = self.reservedForFutureUse # reserved
-
-        self.tags[0xb7] = self.reservedForFutureUse # reserved
-
-        self.tags[0xba] = self.reservedForFutureUse # reserved
-        self.tags[0xbb] = self.reservedForFutureUse # reserved
-        self.tags[0xbc] = self.reservedForFutureUse # reserved
-        self.tags[0xbd] = self.reservedForFutureUse # reserved
-        self.tags[0xbe] = self.reservedForFutureUse # reserved
-
-        # self.tags[0xbf] = self.passThrough # PassThrough mode should already be taken care of automatically
-
-        self.tags[0xc0] = 1 # ubyte
-        self.tags[0xc1] = 2 # uint16
-        self.tags[0xc2] = 4 # uint32
-        self.tags[0xc3] = 2 # sint16
-        self.tags[0xc4] = 4 # sint32
-        self.tags[0xc5] = 4 # real32
-
-        self.tags[0xc6] = self.reservedForFutureUse # reserved
-        self.tags[0xc7] = self.reservedForFutureUse # reserved
-
-        self.tags[0xc8] = self.array_8  # ubyte_array
-        self.tags[0xc9] = self.array_16 # uint16_array
-        self.tags[0xca] = self.array_32 # uint32_array
-        self.tags[0xcb] = self.array_16 # sint16_array
-        self.tags[0xcc] = self.array_32 # sint32_array
-        self.tags[0xcd] = self.array_32 # real32_array and unfortunately Canon ImageRunner
-
-        self.tags[0xce] = self.reservedForFutureUse # reserved
-        self.tags[0xcf] = self.reservedForFutureUse # reserved
-
-        self.tags[0xd0] = 2 # ubyte_xy
-        self.tags[0xd1] = 4 # uint16_xy
-        self.tags[0xd2] = 8 # uint32_xy
-        self.tags[0xd3] = 4 # sint16_xy
-        self.tags[0xd4] = 8 # sint32_xy
-        self.tags[0xd5] = 8 # real32_xy
-        self.tags[0xd6] = self.reservedForFutureUse # reserved
-        self.tags[0xd7] = self.reservedForFutureUse # reserved
-        self.tags[0xd8] = self.reservedForFutureUse # reserved
-        self.tags[0xd9] = self.reservedForFutureUse # reserved
-        self.tags[0xda] = self.reservedForFutureUse # reserved
-        self.tags[0xdb] = self.reservedForFutureUse # reserved
-        self.tags[0xdc] = self.reservedForFutureUse # reserved
-        self.tags[0xdd] = self.reservedForFutureUse # reserved
-        self.tags[0xde] = self.reservedForFutureUse # reserved
-        self.tags[0xdf] = self.reservedForFutureUse # reserved
-
-        self.tags[0xe0] = 4  # ubyte_box
-        self.tags[0xe1] = 8  # uint16_box
-        self.tags[0xe2] = 16 # uint32_box
-        self.tags[0xe3] = 8  # sint16_box
-        self.tags[0xe4] = 16 # sint32_box
-        self.tags[0xe5] = 16 # real32_box
-        self.tags[0xe6] = self.reservedForFutureUse # reserved
-        self.tags[0xe7] = self.reservedForFutureUse # reserved
-        self.tags[0xe8] = self.reservedForFutureUse # reserved
-        self.tags[0xe9] = self.reservedForFutureUse # reserved
-        self.tags[0xea] = self.reservedForFutureUse # reserved
-        self.tags[0xeb] = self.reservedForFutureUse # reserved
-        self.tags[0xec] = self.reservedForFutureUse # reserved
-        self.tags[0xed] = self.reservedForFutureUse # reserved
-        self.tags[0xee] = self.reservedForFutureUse # reserved
-        self.tags[0xef] = self.reservedForFutureUse # reserved
-
-        self.tags[0xf0] = self.reservedForFutureUse # reserved
-        self.tags[0xf1] = self.reservedForFutureUse # reserved
-        self.tags[0xf2] = self.reservedForFutureUse # reserved
-        self.tags[0xf3] = self.reservedForFutureUse # reserved
-        self.tags[0xf4] = self.reservedForFutureUse # reserved
-        self.tags[0xf5] = self.reservedForFutureUse # reserved
-        self.tags[0xf6] = self.reservedForFutureUse # reserved
-        self.tags[0xf7] = self.reservedForFutureUse # reserved
-
-        self.tags[0xf8] = 1 # attr_ubyte
-        self.tags[0xf9] = 2 # attr_uint16
-
-        self.tags[0xfa] = self.embeddedData      # dataLength
-        self.tags[0xfb] = self.embeddedDataSmall # dataLengthByte
-
-        self.tags[0xfc] = self.reservedForFutureUse # reserved
-        self.tags[0xfd] = self.reservedForFutureUse # reserved
-        self.tags[0xfe] = self.reservedForFutureUse # reserved
-        self.tags[0xff] = self.reservedForFutureUse # reserved
-
-        # color spaces
-        self.BWColorSpace = "".join([chr(0x00), chr(0xf8), chr(0x03)])
-        self.GrayColorSpace = "".join([chr(0x01), chr(0xf8), chr(0x03)])
-        self.RGBColorSpace = "".join([chr(0x02), chr(0xf8), chr(0x03)])
-
-        # set number of copies
-        self.setNumberOfCopies = "".join([chr(0xf8), chr(0x31)])
+        tags[0x28] = self.bigEndian    # BigEndian
+        tags[0x29] = self.littleEndian # LittleEndian
+
+        tags[0x31] = self.x31_class3   # What's this ? Does it always follow 0x46 ?
+        tags[0x43] = self.beginPage    # BeginPage
+        tags[0x44] = self.endPage      # EndPage
+
+        tags[0x46] = self.x46_class3
+
+        tags[0x6a] = self.setColorSpace    # to detect color/b&w mode
+
+        # Other arrays and embedded datas are skipped by the scanner itself
+        tags[0xcd] = self.array_32_ImageRunner # real32_array and unfortunately Canon ImageRunner
 
         # subcodes for undocumented tag 0x46 and the negative
         # offset to grab the value from.
@@ -592,10 +436,6 @@ class Parser(pdlparser.PDLParser):
                                0x98: 2,
                              }
 
-        # Markers for Canon ImageRunner printers
-        self.imagerunnermarker1 = chr(0xcd) + chr(0xca) + chr(0x10) + chr(0x00)
-        self.imagerunnermarker2 = chr(0xcd) + chr(0xca) + chr(0x10) + chr(0x02)
-
         self.pages = { 0: { "copies": 1,
                              "orientation": "Default",
                              "mediatype": "Plain",
@@ -604,29 +444,41 @@ class Parser(pdlparser.PDLParser):
                              "duplex": None,
                            }
                      }
-        tags = self.tags
         self.pagecount = 0
+        self.pagestarts = []
+        self.pageends = []
         self.escapedStuff = {}   # For escaped datas, mostly PJL commands
         self.prescribeStuff = {} # For Kyocera Prescribe commands
-        pos = oldpos = 0
+        self.data = data = memoryview(minfile)
+        skips = SKIPS
+        pos = 0
         try:
             try:
                 while 1:
-                    try:
-                        tag = ord(minfile[pos])
-                    except OverflowError:
-                        pos = oldpos + 1
-                    #self.logdebug("0x%08x: 0x%02x" % (pos, tag))
-                    pos += 1
-                    length = tags[tag]
-                    if length:
-                        if isinstance(length, collections.Callable):
-                            length = length(pos)
-                        oldpos = pos
-                        pos += length
-            except IndexError: # EOF ?
+                    #self.logdebug("0x%08x: 0x%02x" % (pos, data[pos]))
+                    skip = skips[data[pos]]
+                    if skip > 0:
+                        pos += skip
+                    elif skip:
+                        # An array, skipped at once
+                        unpacker = self.unpackers[data[pos+1]]
+                        pos += 2 + unpacker.size - skip * unpacker.unpack_from(data, pos + 2)[0]
+                    else:
+                        tag = data[pos]
+                        pos += 1
+                        if tag == 0xfa: # dataLength
+                            pos += 4 + self.unpackers[0xc2].unpack_from(data, pos)[0]
+                        elif tag == 0xfb: # dataLengthByte
+                            pos += 1 + data[pos]
+                        else:
+                            pos += tags[tag](pos)
+            except KeyError:
+                raise pdlparser.PDLParserError("Error on array size at %x" % pos)
+            except (IndexError, struct.error): # EOF ?
                 pass
         finally:
+            self.data = None
+            data.release()
             self.minfile.close()
 
         # now handle number of copies for each page (may differ).
@@ -641,6 +493,8 @@ class Parser(pdlparser.PDLParser):
         oldpjlcopies = -1
         oldduplexmode = ""
         oldpapersize = ""
+        pjlparsers = {}
+        self.pagesdetails = []
         for pnum in range(1, self.pagecount + 1):
             # if no number of copies defined, take 1, as explained
             # in PCLXL documentation.
@@ -648,9 +502,15 @@ class Parser(pdlparser.PDLParser):
             # but the formula below is still correct: we want
             # to decrease the total number of pages in this case.
             page = self.pages.get(pnum, self.pages.get(1, { "copies": 1, "mediasize": "Default", "duplex": None }))
-            pjlstuff = self.escapedStuff.get(pnum, self.escapedStuff.get(0, []))
+            if pnum in self.escapedStuff:
+                pjlkey = pnum
+            else:
+                pjlkey = 0
+            pjlstuff = self.escapedStuff.get(pjlkey, [])
             if pjlstuff:
-                pjlparser = pjl.PJLParser("".join(pjlstuff))
+                pjlparser = pjlparsers.get(pjlkey)
+                if pjlparser is None: # Pages without PJL share the first one
+                    pjlparser = pjlparsers[pjlkey] = pjl.PJLParser("".join(pjlstuff))
                 nbdefaultcopies = int(pjlparser.default_variables.get("COPIES", -1))
                 nbcopies = int(pjlparser.environment_variables.get("COPIES", -1))
                 nbdefaultqty = int(pjlparser.default_variables.get("QTY", -1))
@@ -723,6 +583,14 @@ class Parser(pdlparser.PDLParser):
             oldpapersize = papersize
             copies = max(pjlcopies, page["copies"]) # Was: pjlcopies * page["copies"]
             self.pagecount += (copies - 1)
+            self.pagesdetails.append({ "copies": copies,
+                                       "mediatype": page["mediatype"],
+                                       "mediasize": papersize,
+                                       "orientation": page["orientation"],
+                                       "mediasource": page["mediasource"],
+                                       "duplex": duplexmode,
+                                       "colormode": colormode,
+                                     })
             self.logdebug("%s*%s*%s*%s*%s*%s*%s" % (copies,
                                                  page["mediatype"],
                                                  papersize,
@@ -730,4 +598,6 @@ class Parser(pdlparser.PDLParser):
                                                  page["mediasource"],
                                                  duplexmode,
                                                  colormode))
+        if self.wantsPageIndex():
+            self.buildPageIndex(self.pagestarts, self.pageends)
         return self.pagecount
@@ -24,24 +24,441 @@
    Some informations taken from PDF Reference v1.7 by Adobe.
 """
 
+import os
 import re
+import mmap
+import zlib
+import logging
 
 from . import pdlparser
 
-PDFWHITESPACE = chr(0) \
-                + chr(9) \
-                + chr(10) \
-                + chr(12) \
-                + chr(13) \
-                + chr(32)
-PDFDELIMITERS = r"()<>[]{}/%"
+LOG = logging.getLogger("pkpgcounter.pdf")
+
+PDFWHITESPACE = b"\x00\t\n\x0c\r "
+PDFDELIMITERS = b"()<>[]{}/%"
 PDFMEDIASIZE = "/MediaBox [xmin ymin xmax ymax]" # an example. MUST be present in Page objects
 
+STARTXREFWINDOW = 4 * pdlparser.KILOBYTE # Where to look for startxref at the end of file
+
+# Regular expressions used to read PDF structures
+WHITESPACERE = re.compile(rb"(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*)+")
+REFERENCERE = re.compile(rb"(\d+)\s+(\d+)\s+R")
+NUMBERRE = re.compile(rb"[+-]?(?:\d+\.?\d*|\.\d+)")
+NAMERE = re.compile(rb"/([^\x00\t\n\x0c\r ()<>\[\]{}/%]*)")
+KEYWORDRE = re.compile(rb"[a-zA-Z]+")
+OBJHEADERRE = re.compile(rb"\s*(\d+)\s+(\d+)\s+obj")
+XREFSUBSECTIONRE = re.compile(rb"\s*(\d+)\s+(\d+)[ \t]*[\r\n]+")
+XREFENTRYRE = re.compile(rb"\s*(\d{10})\s+(\d{5})\s+([nf])")
+STARTXREFRE = re.compile(rb"startxref\s+(\d+)")
+STREAMRE = re.compile(rb"\s*stream(?:\r\n|\n|\r)")
+NAMEESCAPERE = re.compile(rb"#([0-9a-fA-F]{2})")
+
+class PDFName(str):
+    """A PDF name, e.g. /Type, stored without its leading slash."""
+    pass
+
+class PDFReference:
+    """A reference to an indirect PDF object."""
+    def __init__(self, number, generation):
+        """Initializes the reference."""
+        self.number = number
+        self.generation = generation
+
+    def __repr__(self):
+        return "%i %i R" % (self.number, self.generation)
+
+class PDFStream:
+    """A PDF stream, i.e. a dictionnary and the position of its raw datas."""
+    def __init__(self, dictionnary, start, end):
+        """Initializes the stream."""
+        self.dictionnary = dictionnary
+        self.start = start
+        self.end = end
+
+class PDFObjectParser:
+    """A parser for direct PDF objects."""
+    def __init__(self, datas):
+        """Initializes the parser on some datas (bytes or memory map)."""
+        self.datas = datas
+
+    def skipWhitespace(self, pos):
+        """Skips whitespace and comments."""
+        match = WHITESPACERE.match(self.datas, pos)
+        if match is not None:
+            return match.end()
+        return pos
+
+    def parseObject(self, pos):
+        """Parses a direct object, returns it with the position after it."""
+        datas = self.datas
+        pos = self.skipWhitespace(pos)
+        char = datas[pos:pos+1]
+        if not char:
+            raise pdlparser.PDLParserError("Unexpected end of PDF document.")
+        if char == b"/":
+            match = NAMERE.match(datas, pos)
+            name = NAMEESCAPERE.sub(lambda m: bytes([int(m.group(1), 16)]), match.group(1))
+            return (PDFName(name.decode("latin-1")), match.end())
+        elif char == b"<":
+            if datas[pos+1:pos+2] == b"<":
+                return self.parseDictionnary(pos + 2)
+            end = datas.find(b">", pos)
+            if end == -1:
+                raise pdlparser.PDLParserError("Unterminated hexadecimal string at %i" % pos)
+            return (datas[pos+1:end], end + 1)
+        elif char == b"[":
+            array = []
+            pos += 1
+            while True:
+                pos = self.skipWhitespace(pos)
+                if datas[pos:pos+1] == b"]":
+                    return (array, pos + 1)
+                (value, pos) = self.parseObject(pos)
+                array.append(value)
+        elif char == b"(":
+            return self.parseString(pos)
+        elif char in b"+-.0123456789":
+            match = REFERENCERE.match(datas, pos)
+            if match is not None:
+                return (PDFReference(int(match.group(1)), int(match.group(2))), match.end())
+            match = NUMBERRE.match(datas, pos)
+            if match is None:
+                raise pdlparser.PDLParserError("Invalid number at %i" % pos)
+            number = match.group()
+            if (b"." in number):
+                return (float(number), match.end())
+            return (int(number), match.end())
+        else:
+            match = KEYWORDRE.match(datas, pos)
+            if match is not None:
+                keyword = match.group()
+                if keyword == b"true":
+                    return (True, match.end())
+                elif keyword == b"false":
+                    return (False, match.end())
+                elif keyword == b"null":
+                    return (None, match.end())
+            raise pdlparser.PDLParserError("Unexpected data %s at %i" % (repr(datas[pos:pos+16]), pos))
+
+    def parseDictionnary(self, pos):
+        """Parses a dictionnary, pos being just after the opening <<."""
+        dictionnary = {}
+        datas = self.datas
+        while True:
+            pos = self.skipWhitespace(pos)
+            if datas[pos:pos+2] == b">>":
+                return (dictionnary, pos + 2)
+            (key, pos) = self.parseObject(pos)
+            if not isinstance(key, PDFName):
+                raise pdlparser.PDLParserError("Invalid dictionnary key at %i" % pos)
+            (value, pos) = self.parseObject(pos)
+            dictionnary[key] = value
+
+    def parseString(self, pos):
+        """Parses a literal string, returns its raw content."""
+        datas = self.datas
+        depth = 0
+        start = pos
+        while True:
+            char = datas[pos:pos+1]
+            if not char:
+                raise pdlparser.PDLParserError("Unterminated string at %i" % start)
+            if char == b"\\":
+                pos += 1
+            elif char == b"(":
+                depth += 1
+            elif char == b")":
+                depth -= 1
+                if not depth:
+                    return (datas[start+1:pos], pos + 1)
+            pos += 1
+
+class PDFDocument(PDFObjectParser):
+    """A reader for the structure of a PDF document.
+
+       It only reads what it needs from the file's cross reference
+       tables or streams, starting from the end of the file,
+       and never loads the whole document in memory.
+    """
+    def __init__(self, minfile):
+        """Initializes the reader on a memory mapped PDF document."""
+        PDFObjectParser.__init__(self, minfile)
+        self.minfile = minfile
+        self.base = max(minfile.find(b"%PDF-"), 0) # Offsets are relative to the header
+        self.xref = {}          # number => (type, field2, field3) as in xref streams
+        self.trailer = None
+        self.objects = {}       # Cache for already read objects
+        self.objectstreams = {} # Cache for already decompressed object streams
+        self.readCrossReferences()
+
+    def parseIndirectObject(self, offset, number=None):
+        """Parses the indirect object at offset, which can be a stream."""
+        match = OBJHEADERRE.match(self.minfile, offset)
+        if (match is None) and self.base:
+            offset += self.base
+            match = OBJHEADERRE.match(self.minfile, offset)
+        if (match is None) or ((number is not None) and (int(match.group(1)) != number)):
+            raise pdlparser.PDLParserError("No object %s at offset %i" % (number, offset))
+        (value, pos) = self.parseObject(match.end())
+        if isinstance(value, dict):
+            match = STREAMRE.match(self.minfile, pos)
+            if match is not None:
+                start = match.end()
+                length = self.resolve(value.get("Length"))
+                if not isinstance(length, int) \
+                   or (self.minfile.find(b"endstream", start + length, start + length + 32) == -1):
+                    # Wrong /Length, this happens.
+                    end = self.minfile.find(b"endstream", start)
+                    if end == -1:
+                        raise pdlparser.PDLParserError("Unterminated stream at %i" % start)
+                    length = end - start
+                value = PDFStream(value, start, start + length)
+        return value
+
+    def resolve(self, value):
+        """Returns the object a value refers to, or the value itself if it's a direct object."""
+        if isinstance(value, PDFReference):
+            return self.getObject(value.number)
+        return value
+
+    def getObject(self, number):
+        """Returns the indirect object with this number."""
+        try:
+            return self.objects[number]
+        except KeyError:
+            pass
+        try:
+            (entrytype, field2, field3) = self.xref[number]
+        except KeyError:
+            raise pdlparser.PDLParserError("Object %i not found in cross reference tables." % number)
+        if entrytype == 1:
+            value = self.parseIndirectObject(field2, number)
+        elif entrytype == 2:
+            value = self.getCompressedObject(field2, field3, number)
+        else:
+            raise pdlparser.PDLParserError("Object %i is free." % number)
+        self.objects[number] = value
+        return value
+
+    def getObjectStream(self, number):
+        """Returns a parser on the decompressed content of an object
+           stream, and the mapping of its objects' numbers to their offsets.
+
+           Object streams are only decompressed when needed, and only once.
+        """
+        try:
+            return self.objectstreams[number]
+        except KeyError:
+            pass
+        stream = self.getObject(number)
+        if not isinstance(stream, PDFStream) \
+           or (stream.dictionnary.get("Type") != "ObjStm"):
+            raise pdlparser.PDLParserError("Object %i is not an object stream." % number)
+        nbobjects = self.resolve(stream.dictionnary.get("N"))
+        first = self.resolve(stream.dictionnary.get("First"))
+        if not (isinstance(nbobjects, int) and isinstance(first, int)):
+            raise pdlparser.PDLParserError("Invalid object stream %i" % number)
+        parser = PDFObjectParser(self.decodeStream(stream))
+        offsets = {}
+        pos = 0
+        for i in range(nbobjects):
+            (objnumber, pos) = parser.parseObject(pos)
+            (offset, pos) = parser.parseObject(pos)
+            offsets[objnumber] = first + offset
+        self.objectstreams[number] = (parser, offsets)
+        LOG.debug("Object stream %i decompressed (%i objects)" % (number, nbobjects))
+        return (parser, offsets)
+
+    def getCompressedObject(self, streamnumber, index, number):
+        """Returns an object stored in an object stream."""
+        (parser, offsets) = self.getObjectStream(streamnumber)
+        try:
+            offset = offsets[number]
+        except KeyError:
+            raise pdlparser.PDLParserError("Object %i not found in object stream %i (index %i)" % (number, streamnumber, index))
+        return parser.parseObject(offset)[0]
+
+    def decodeStream(self, stream):
+        """Returns the decoded content of a stream."""
+        datas = self.minfile[stream.start:stream.end]
+        filters = self.resolve(stream.dictionnary.get("Filter"))
+        parameters = self.resolve(stream.dictionnary.get("DecodeParms"))
+        if not isinstance(filters, list):
+            filters = [filters]
+        if not isinstance(parameters, list):
+            parameters = [parameters]
+        for (index, filtername) in enumerate(filters):
+            if filtername is None:
+                continue
+            if filtername not in ("FlateDecode", "Fl"):
+                raise pdlparser.PDLParserError("Unsupported stream filter %s" % filtername)
+            try:
+                datas = zlib.decompress(datas)
+            except zlib.error as msg:
+                raise pdlparser.PDLParserError("Invalid compressed stream at %i: %s" % (stream.start, msg))
+            decodeparms = None
+            if index < len(parameters):
+                decodeparms = self.resolve(parameters[index])
+            if decodeparms:
+                datas = self.unpredict(datas, decodeparms)
+        return datas
+
+    def unpredict(self, datas, decodeparms):
+        """Reverses the PNG predictors applied to some compressed datas."""
+        predictor = self.resolve(decodeparms.get("Predictor", 1))
+        if predictor < 10:
+            if predictor != 1:
+                raise pdlparser.PDLParserError("Unsupported predictor %s" % predictor)
+            return datas
+        columns = self.resolve(decodeparms.get("Columns", 1))
+        rowlength = columns + 1
+        result = bytearray()
+        previous = bytearray(columns)
+        for start in range(0, len(datas), rowlength):
+            filtertype = datas[start]
+            row = bytearray(datas[start+1:start+rowlength])
+            if filtertype == 1:   # Sub
+                for i in range(1, len(row)):
+                    row[i] = (row[i] + row[i-1]) & 0xff
+            elif filtertype == 2: # Up
+                for i in range(len(row)):
+                    row[i] = (row[i] + previous[i]) & 0xff
+            elif filtertype == 3: # Average
+                for i in range(len(row)):
+                    left = (i and row[i-1]) or 0
+                    row[i] = (row[i] + ((left + previous[i]) >> 1)) & 0xff
+            elif filtertype == 4: # Paeth
+                for i in range(len(row)):
+                    left = (i and row[i-1]) or 0
+                    upleft = (i and previous[i-1]) or 0
+                    up = previous[i]
+                    estimate = left + up - upleft
+                    (pa, pb, pc) = (abs(estimate - left), abs(estimate - up), abs(estimate - upleft))
+                    if (pa <= pb) and (pa <= pc):
+                        row[i] = (row[i] + left) & 0xff
+                    elif pb <= pc:
+                        row[i] = (row[i] + up) & 0xff
+                    else:
+                        row[i] = (row[i] + upleft) & 0xff
+            elif filtertype:
+                raise pdlparser.PDLParserError("Unsupported PNG predictor %i" % filtertype)
+            result.extend(row)
+            previous = row
+        return bytes(result)
+
+    def addEntry(self, number, entry):
+        """Adds an entry to the cross reference, unless a newer one exists."""
+        if number not in self.xref:
+            self.xref[number] = entry
+
+    def readCrossReferenceTable(self, pos):
+        """Reads a cross reference table and returns its trailer."""
+        minfile = self.minfile
+        pos += 4 # skip "xref"
+        while True:
+            match = XREFSUBSECTIONRE.match(minfile, pos)
+            if match is None:
+                break
+            first = int(match.group(1))
+            pos = match.end()
+            for number in range(first, first + int(match.group(2))):
+                entry = XREFENTRYRE.match(minfile, pos)
+                if entry is None:
+                    raise pdlparser.PDLParserError("Invalid cross reference entry at %i" % pos)
+                if entry.group(3) == b"n":
+                    self.addEntry(number, (1, int(entry.group(1)), int(entry.group(2))))
+                else:
+                    self.addEntry(number, (0, 0, 0))
+                pos = entry.end()
+        pos = self.skipWhitespace(pos)
+        if minfile[pos:pos+7] != b"trailer":
+            raise pdlparser.PDLParserError("No trailer after cross reference table at %i" % pos)
+        (trailer, pos) = self.parseObject(pos + 7)
+        if not isinstance(trailer, dict):
+            raise pdlparser.PDLParserError("Invalid trailer at %i" % pos)
+        xrefstm = trailer.get("XRefStm")
+        if isinstance(xrefstm, int):
+            # Hybrid-reference file: this xref stream takes precedence
+            # over the previous sections, but not over this one.
+            self.readCrossReferenceStream(xrefstm)
+        return trailer
+
+    def readCrossReferenceStream(self, pos):
+        """Reads a cross reference stream and returns its dictionnary."""
+        stream = self.parseIndirectObject(pos)
+        if not isinstance(stream, PDFStream) \
+           or (stream.dictionnary.get("Type") != "XRef"):
+            raise pdlparser.PDLParserError("No cross reference stream at %i" % pos)
+        dictionnary = stream.dictionnary
+        widths = dictionnary.get("W")
+        if not (isinstance(widths, list) and (len(widths) == 3)):
+            raise pdlparser.PDLParserError("Invalid /W in cross reference stream at %i" % pos)
+        index = dictionnary.get("Index", [0, dictionnary.get("Size", 0)])
+        datas = self.decodeStream(stream)
+        entrylength = sum(widths)
+        offset = 0
+        for i in range(0, len(index) - 1, 2):
+            for number in range(index[i], index[i] + index[i+1]):
+                fields = []
+                for width in widths:
+                    value = 0
+                    for byte in datas[offset:offset+width]:
+                        value = (value << 8) + byte
+                    fields.append(value)
+                    offset += width
+                if not widths[0]:
+                    fields[0] = 1 # Default type
+                self.addEntry(number, tuple(fields))
+                if offset > len(datas):
+                    raise pdlparser.PDLParserError("Truncated cross reference stream at %i" % pos)
+        return dictionnary
+
+    def readCrossReferences(self):
+        """Reads all the cross reference sections, from the newest to the oldest."""
+        minfile = self.minfile
+        start = max(len(minfile) - STARTXREFWINDOW, 0)
+        pos = minfile.rfind(b"startxref", start)
+        if pos == -1:
+            pos = minfile.rfind(b"startxref")
+        match = (pos != -1) and STARTXREFRE.match(minfile, pos)
+        if not match:
+            raise pdlparser.PDLParserError("No startxref found.")
+        offset = int(match.group(1))
+        seen = set()
+        while (offset is not None) and (offset not in seen):
+            seen.add(offset)
+            pos = self.skipWhitespace(offset)
+            if (minfile[pos:pos+4] != b"xref") and self.base:
+                pos = self.skipWhitespace(offset + self.base)
+            if minfile[pos:pos+4] == b"xref":
+                trailer = self.readCrossReferenceTable(pos)
+            else:
+                trailer = self.readCrossReferenceStream(offset)
+            if self.trailer is None:
+                self.trailer = trailer
+            offset = trailer.get("Prev")
+            if not isinstance(offset, int):
+                offset = None
+
+    def getPageCount(self):
+        """Returns the /Count of the root of the pages tree."""
+        catalog = self.resolve(self.trailer.get("Root"))
+        if not isinstance(catalog, dict):
+            raise pdlparser.PDLParserError("Invalid document catalog.")
+        pages = self.resolve(catalog.get("Pages"))
+        if not isinstance(pages, dict):
+            raise pdlparser.PDLParserError("Invalid pages tree root.")
+        count = self.resolve(pages.get("Count"))
+        if not isinstance(count, int) or isinstance(count, bool) or (count < 0):
+            raise pdlparser.PDLParserError("Invalid /Count in pages tree root.")
+        return count
+
 class Parser(pdlparser.PDLParser):
     """A parser for PDF documents."""
     totiffcommands = [ 'gs -sDEVICE=tiff24nc -dPARANOIDSAFER -dNOPAUSE -dBATCH -dQUIET -r"%(dpi)i" -sOutputFile="%(outfname)s" "%(infname)s"' ]
+    inkcovcommand = 'gs -sDEVICE=%(device)s -dPARANOIDSAFER -dNOPAUSE -dBATCH -dQUIET -r"%(dpi)i" -sOutputFile=- "%(infname)s"'
     required = [ "gs" ]
-    openmode = "rU"
+    gsnative = True
     format = "PDF"
     def isValid(self):
         """Returns True if data is PDF, else False."""
@@ -64,50 +481,67 @@ class Parser(pdlparser.PDLParser):
            where an existing PDF object is replaced with one
            with the same major number a higher minor number.
         """
-        newpageregexp = re.compile(r"/Type\s*/Page[/>\s]")
+        newpageregexp = re.compile(rb"/Type\s*/Page[/>\s]")
         return len(newpageregexp.findall(self.infile.read()))
 
     def getJobSize(self):
         """Counts pages in a PDF document.
 
-           A faster way seems to be possible by extracting the
-           "/Type/Pages/Count xxxx" value where there's no /Parent
-           (i.e. the root of the page tree)
-           Unfortunately I can't make a regexp work for this currently.
+           The cross reference tables or streams are followed from
+           the end of the file to the document's catalog, and the
+           /Count of the root of the pages tree is returned, so
+           only a few objects are read.
+
+           If the document's structure is broken, we fall back
+           to a full scan of the document's objects.
+        """
+        infileno = self.infile.fileno()
+        minfile = mmap.mmap(infileno, os.fstat(infileno)[6], prot=mmap.PROT_READ, flags=mmap.MAP_SHARED)
+        try:
+            try:
+                pagecount = PDFDocument(minfile).getPageCount()
+            except (pdlparser.PDLParserError, IndexError, ValueError, TypeError, AttributeError, RecursionError) as msg:
+                self.logdebug("Broken PDF structure (%s), scanning all objects instead." % msg)
+            else:
+                self.logdebug("Pages tree root says: %i pages" % pagecount)
+                return pagecount
+            return self.scanJobSize(minfile)
+        finally:
+            minfile.close()
+
+    def getNbPages(self):
+        """Returns the number of pages in a PDF document, which are never copied."""
+        return self.getJobSize()
+
+    def scanJobSize(self, minfile):
+        """Counts pages in a PDF document by scanning all its objects.
 
-           At least the actual method below is accurate, even if 25%
-           slower than the old one. But we will be able to extract
-           other informations as well when needed, like orientation
-           and size.
+           At least this method is accurate, even if slow, because
+           it takes care of objects replaced with ones with the
+           same major number and a higher minor number.
         """
         # Regular expression to extract objects from a PDF document
-        oregexp = re.compile(r"\s+(\d+)\s+(\d+)\s+(obj\s*.+?\s*?endobj)", \
+        oregexp = re.compile(rb"\s+(\d+)\s+(\d+)\s+(obj\s*.+?\s*?endobj)", \
                              re.DOTALL)
 
         # Regular expression indicating a new page
-        npregexp = re.compile(r"/Type\s*/Page[/>\s]")
+        npregexp = re.compile(rb"/Type\s*/Page[/>\s]")
 
         # Regular expression indicating an empty page
         # (usually to delete an existing one with a lower minor number)
-        epregexp = re.compile(r"obj\s*<<\s*/Type\s*/Page\s*>>\s*endobj")
+        epregexp = re.compile(rb"obj\s*<<\s*/Type\s*/Page\s*>>\s*endobj")
 
         # First we build a mapping of objects to keep because
         # if two objects with the same major number are found,
         # we only keep the one with the higher minor number:
         # this is the way in PDF to replace existing objects.
         objtokeep = {}
-        for (smajor, sminor, content) in oregexp.findall(self.infile.read()):
+        for (smajor, sminor, content) in oregexp.findall(minfile):
             major = int(smajor)
             minor = int(sminor)
             (prevmin, prevcont) = objtokeep.get(major, (None, None))
-            if (minor >= prevmin): # Handles both None and real previous minor
+            if (prevmin is None) or (minor >= prevmin):
                 objtokeep[major] = (minor, content)
-                #if prevmin is not None:
-                #    self.logdebug("Object %i.%i overwritten with %i.%i" \
-                #                     % (major, prevmin, \
-                #                        major, minor))
-                #else:
-                #    self.logdebug("Object %i.%i OK" % (major, minor))
 
         # Now that we have deleted all unneeded objects, we
         # can count the ones which are new pages, minus the ones
@@ -118,7 +552,5 @@ class Parser(pdlparser.PDLParser):
             count = len(npregexp.findall(content))
             if count:
                 emptycount = len(epregexp.findall(content))
-                #if not emptycount:
-                #    self.logdebug("%i.%i: %s\n" % (major, minor, repr(content)))
                 pagecount += count - emptycount
         return pagecount
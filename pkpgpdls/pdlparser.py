@@ -23,13 +23,27 @@
 
 import sys
 import os
+import re
+import time
+import signal
 import logging
+import contextlib
+import subprocess
 
 KILOBYTE = 1024
 MEGABYTE = 1024 * KILOBYTE
 FIRSTBLOCKSIZE = 16 * KILOBYTE
 LASTBLOCKSIZE = int(KILOBYTE / 4)
 
+TIFFDEVICE = "-sDEVICE=tiff24nc"    # Ghostscript device used to compute ink coverage
+RASTERDEVICE = "-sDEVICE=ppmraw"    # Same, but when rendering one file per page
+RASTERPAGENAME = "page%08d.ppm"     # Pattern of the per page files names
+POLLDELAY = 0.05                    # Seconds between checks for new rendered pages
+NOTIMING = contextlib.nullcontext() # Used instead of timing phases when timings are disabled
+INKDEVICE = "ink_cov"               # Ghostscript device which computes the CMYK ink coverage of each page
+# ink_cov prints the percents of ink used, where inkcov prints the fractions of pixels marked
+INKCOVLINE = re.compile(rb"^\s*(\d+\.\d+)\s+(\d+\.\d+)\s+(\d+\.\d+)\s+(\d+\.\d+)\s+CMYK\s+OK\s*$", re.M)
+
 LOG = logging.getLogger("pkpgcounter.pdlparser")
 
 class PDLParserError(Exception):
@@ -41,12 +55,90 @@ class PDLParserError(Exception):
         return self.message
     __str__ = __repr__
 
+def killProcessGroup(pid):
+    """Kills a command started in a new session, and all its subprocesses."""
+    try:
+        os.killpg(pid, signal.SIGTERM)
+    except OSError:
+        pass
+
+async def runCommand(commandline):
+    """Runs a shell command line from a coroutine, and returns its exit status.
+
+       The command and all its subprocesses are killed if the
+       coroutine is cancelled.
+    """
+    import asyncio
+    child = await asyncio.create_subprocess_shell(commandline, start_new_session=True)
+    try:
+        return await child.wait()
+    except asyncio.CancelledError:
+        killProcessGroup(child.pid)
+        await child.wait()
+        raise
+
+async def runInExecutor(executor, function, *args):
+    """Runs a blocking function in an executor from a coroutine, and returns its result.
+
+       The function can't be interrupted, so if the coroutine is
+       cancelled it still waits for the function to return before
+       letting the cancellation through, for the caller not to close
+       files the function is using.
+    """
+    import asyncio
+    future = asyncio.get_running_loop().run_in_executor(executor, function, *args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        while not future.done():
+            try:
+                await asyncio.wait([future])
+            except asyncio.CancelledError:
+                pass
+        if not future.cancelled():
+            future.exception() # Else asyncio would complain it is never retrieved
+        raise
+
+_gsdevices = None
+
+def getGhostScriptDevices():
+    """Returns the set of Ghostscript's output devices, empty if Ghostscript is missing."""
+    global _gsdevices
+    if _gsdevices is None:
+        try:
+            output = subprocess.run(["gs", "-h"],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL,
+                                    timeout=60).stdout
+        except (OSError, subprocess.SubprocessError) as msg:
+            LOG.debug("Impossible to list Ghostscript's devices (%s)" % msg)
+            output = b""
+        # The devices are listed between these two headings
+        devices = output.partition(b"Available devices:")[2].partition(b"Search path:")[0]
+        _gsdevices = set(devices.decode("ascii", "replace").split())
+    return _gsdevices
+
+def parseInkCoverage(output):
+    """Returns a list of dictionnaries containing for each page the percents
+       of cyan, magenta, yellow and black inks, from the output of
+       Ghostscript's ink_cov device.
+    """
+    pages = [dict(zip("CMYK", [float(value) for value in match.groups()]))
+                 for match in INKCOVLINE.finditer(output)]
+    if (not pages) or (len(pages) != output.count(b"CMYK")):
+        raise PDLParserError("Unexpected output from Ghostscript's %s device." % INKDEVICE)
+    return pages
+
 class PDLParser:
     """Generic PDL parser."""
     totiffcommands = None       # Default command to convert to TIFF
+    inkcovcommand = None        # Default command to compute the ink coverage with Ghostscript
     required = []               # Default list of required commands
     openmode = "rb"             # Default file opening mode
     format = "Unknown"          # Default file format
+    gsnative = False            # True if Ghostscript reads this format directly
+    pagesdetails = None         # Copies, media and duplex of each page, if getJobSize() extracts them
+    pageindex = None            # Offsets and details of each page, if getJobSize() was asked for them
     def __init__(self, parent, filename, xxx_todo_changeme):
         """Initialize the generic parser."""
         (firstblock, lastblock) = xxx_todo_changeme
@@ -96,6 +188,13 @@ class PDLParser:
         """Logs a debug message if needed."""
         LOG.debug(message)
 
+    def timePhase(self, name, **details):
+        """Times a phase of the analysis, see analyzer.PDLAnalyzer.timePhase()."""
+        timephase = getattr(self.parent, "timePhase", None)
+        if timephase is None:
+            return NOTIMING
+        return timephase(name, **details)
+
     def isValid(self):
         """Returns True if data is in the expected format, else False."""
         raise RuntimeError("Not implemented !")
@@ -104,10 +203,55 @@ class PDLParser:
         """Counts pages in a document."""
         raise RuntimeError("Not implemented !")
 
+    def getNbPages(self):
+        """Returns the number of pages in a document, without copies,
+           or None if it can't be known without Ghostscript.
+        """
+        return None
+
+    def wantsPageIndex(self):
+        """Returns True if the options ask for an index of the pages, else False."""
+        return bool(getattr(getattr(self.parent, "options", None), "pageindex", False))
+
+    def buildPageIndex(self, starts, ends):
+        """Builds the index of the pages from their offsets and details."""
+        from . import pageindex
+        self.pageindex = pageindex.PageIndex(os.fstat(self.infile.fileno()).st_size)
+        self.pageindex.addPages(starts, ends, self.pagesdetails)
+
+    async def asyncGetJobSize(self, executor=None):
+        """Counts pages in a document without blocking the event loop.
+
+           The document is scanned in the executor, which defaults
+           to the event loop's one. Parsers which launch external
+           commands to count pages can run them as subprocesses instead.
+        """
+        return await runInExecutor(executor, self.getJobSize)
+
+    def getGhostScriptPool(self):
+        """Returns the pool of Ghostscript interpreters to use, or None.
+
+           The pool is used only if the options ask for it and
+           if Ghostscript can directly read our file format.
+        """
+        size = getattr(getattr(self.parent, "options", None), "gspool", None)
+        if size and self.gsnative:
+            from . import gspool
+            return gspool.getPool(size)
+        return None
+
     def convertToTiffMultiPage24NC(self, outfname, dpi):
         """Converts the input file to TIFF format, X dpi, 24 bits per pixel, uncompressed.
            Writes TIFF datas to the file named by outfname.
         """
+        pool = self.getGhostScriptPool()
+        if pool is not None:
+            try:
+                with pool.borrow() as interpreter:
+                    interpreter.convertToTiffMultiPage24NC(self.filename, outfname, dpi)
+                return
+            except PDLParserError as msg:
+                self.logdebug("%s, launching a new Ghostscript instead." % msg)
         if self.totiffcommands:
             if self.isMissing(self.required):
                 raise PDLParserError("At least one of the following commands is missing and should be installed for the computation of ink coverage: %s" % repr(self.required))
@@ -133,3 +277,182 @@ class PDLParser:
                 raise PDLParserError("Problem during conversion to TIFF.")
         else:
             raise PDLParserError("Impossible to compute ink coverage for this file format.")
+
+    async def asyncConvertToTiffMultiPage24NC(self, outfname, dpi, executor=None):
+        """Same as convertToTiffMultiPage24NC(), but without blocking the event loop.
+
+           Conversion commands are run as subprocesses, killed if
+           the coroutine is cancelled.
+        """
+        if self.getGhostScriptPool() is not None:
+            # The pool's interpreters can only be used synchronously
+            return await runInExecutor(executor, self.convertToTiffMultiPage24NC, outfname, dpi)
+        if not self.totiffcommands:
+            raise PDLParserError("Impossible to compute ink coverage for this file format.")
+        if self.isMissing(self.required):
+            raise PDLParserError("At least one of the following commands is missing and should be installed for the computation of ink coverage: %s" % repr(self.required))
+        infname = self.filename
+        for totiffcommand in self.totiffcommands:
+            commandline = totiffcommand % locals()
+            self.logdebug("Executing '%s'" % commandline)
+            status = await runCommand(commandline)
+            if (not status) and os.path.exists(outfname) and os.stat(outfname).st_size:
+                return          # Conversion worked fine it seems.
+            sys.stderr.write("Command failed: %s\n" % repr(commandline))
+        raise PDLParserError("Problem during conversion to TIFF.")
+
+    def getShardCommand(self, outfname, dpi, first, last=None):
+        """Returns the command which converts the pages first to last of the
+           input file to TIFF, or up to its end if last is None, or None if
+           the input file can't be converted by ranges of pages.
+
+           Only file formats which Ghostscript reads directly are converted
+           this way, because other ones would be converted again as a whole
+           for each range.
+        """
+        if not self.gsnative:
+            return None
+        infname = self.filename
+        pagerange = "%s -dFirstPage=%i" % (TIFFDEVICE, first)
+        if last is not None:
+            pagerange += " -dLastPage=%i" % last
+        for totiffcommand in self.totiffcommands or []:
+            if totiffcommand.find(TIFFDEVICE) != -1:
+                return totiffcommand.replace(TIFFDEVICE, pagerange) % locals()
+        return None
+
+    def canConvertShards(self):
+        """Returns True if the input file can be converted to TIFF by ranges of pages, else False."""
+        return self.getShardCommand("shard.tiff", 72, 1) is not None
+
+    def convertShardsToTiff(self, outfnames, dpi, shards):
+        """Converts ranges of pages of the input file to TIFF format, X dpi, 24 bits
+           per pixel, uncompressed, all at the same time in as many processes.
+
+           shards is a list of (first, last) pages numbers, starting at 1,
+           last being None for the range which goes up to the end of the
+           input file. The TIFF datas of each range are written to the file
+           named by the item at the same index in outfnames, which may be
+           left empty or missing if the range is past the input file's end.
+        """
+        if self.isMissing(self.required):
+            raise PDLParserError("At least one of the following commands is missing and should be installed for the computation of ink coverage: %s" % repr(self.required))
+        children = []
+        try:
+            for (outfname, (first, last)) in zip(outfnames, shards):
+                commandline = self.getShardCommand(outfname, dpi, first, last)
+                if commandline is None:
+                    raise PDLParserError("Impossible to convert this file format by ranges of pages.")
+                self.logdebug("Executing '%s'" % commandline)
+                children.append(subprocess.Popen(commandline, shell=True, start_new_session=True))
+            for child in children:
+                child.wait()
+        finally:
+            for child in children:
+                self.killConverter(child)
+        for (child, (first, last)) in zip(children, shards):
+            if child.returncode:
+                raise PDLParserError("Problem during conversion of the pages %i to %s to TIFF." % (first, last or "end"))
+
+    def canComputeInkCoverage(self):
+        """Returns True if Ghostscript can directly compute the CMYK ink coverage of the input file, else False."""
+        return bool(self.inkcovcommand) \
+               and (not self.isMissing(self.required)) \
+               and (INKDEVICE in getGhostScriptDevices())
+
+    def computeInkCoverage(self, dpi):
+        """Returns a list of dictionnaries containing for each page the percents
+           of cyan, magenta, yellow and black inks, X dpi, computed by Ghostscript
+           without rendering the input file to TIFF.
+        """
+        if not self.canComputeInkCoverage():
+            raise PDLParserError("Ghostscript's %s device can't be used for this file format." % INKDEVICE)
+        infname = self.filename
+        device = INKDEVICE
+        commandline = self.inkcovcommand % locals()
+        self.logdebug("Executing '%s'" % commandline)
+        child = subprocess.Popen(commandline, shell=True, stdout=subprocess.PIPE, start_new_session=True)
+        try:
+            output = child.stdout.read()
+        finally:
+            child.stdout.close()
+            self.killConverter(child)
+        if child.returncode:
+            raise PDLParserError("Problem during the computation of ink coverage by Ghostscript.")
+        return parseInkCoverage(output)
+
+    def getRasterCommands(self, outpattern, dpi, pages=None):
+        """Returns the commands which render the input file to raw PPM, X dpi,
+           one file per page, with names built from the outpattern printf-like
+           pattern.
+
+           If pages is a list of page numbers, starting at 1, only these
+           pages are rendered, and the files are numbered in their order.
+
+           These are derived from the commands used to convert to TIFF,
+           so only the ones which end with Ghostscript's tiff24nc device
+           can be used.
+        """
+        commands = []
+        infname = self.filename
+        outfname = outpattern
+        device = RASTERDEVICE
+        if pages:
+            device += " -sPageList=%s" % ",".join([str(p) for p in sorted(pages)])
+        for totiffcommand in self.totiffcommands or []:
+            if totiffcommand.find(TIFFDEVICE) != -1:
+                commands.append(totiffcommand.replace(TIFFDEVICE, device) % locals())
+        return commands
+
+    def canRenderPages(self):
+        """Returns True if the input file can be rendered one file per page, else False."""
+        return bool(self.getRasterCommands(RASTERPAGENAME, 72))
+
+    def killConverter(self, child):
+        """Kills a running conversion command and all its subprocesses."""
+        if child.poll() is None:
+            killProcessGroup(child.pid)
+        child.wait()
+
+    def convertToRasterPages(self, outdir, dpi, pages=None):
+        """Converts the input file to raw PPM, X dpi, one file per page in outdir.
+
+           This is a generator which yields each page's file name as soon
+           as it is completely written, while the rendering of the next
+           pages goes on. The caller is responsible for deleting the files.
+
+           If pages is a list of page numbers, starting at 1, only these
+           pages are rendered, in ascending order.
+        """
+        if self.isMissing(self.required):
+            raise PDLParserError("At least one of the following commands is missing and should be installed for the computation of ink coverage: %s" % repr(self.required))
+        outpattern = os.path.join(outdir, RASTERPAGENAME)
+        commands = self.getRasterCommands(outpattern, dpi, pages)
+        if not commands:
+            raise PDLParserError("Impossible to render this file format page per page.")
+        for commandline in commands:
+            self.logdebug("Executing '%s'" % commandline)
+            child = subprocess.Popen(commandline, shell=True, start_new_session=True)
+            pagenum = 1
+            try:
+                while True:
+                    status = child.poll()
+                    current = outpattern % pagenum
+                    # A page's file is complete once the next one was
+                    # created, or once the command has exited.
+                    if os.path.exists(outpattern % (pagenum + 1)) \
+                       or ((status is not None) and os.path.exists(current)):
+                        yield current
+                        pagenum += 1
+                    elif status is not None:
+                        break
+                    else:
+                        time.sleep(POLLDELAY)
+            finally:
+                self.killConverter(child)
+            if not status and (pagenum > 1):
+                return          # Conversion worked fine it seems.
+            sys.stderr.write("Command failed: %s\n" % repr(commandline))
+            if pagenum > 1:
+                break           # Too late to try another command.
+        raise PDLParserError("Problem during conversion to raster.")
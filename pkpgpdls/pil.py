@@ -21,6 +21,8 @@
 
 """This modules implements a page counter for image formats supported by the Python Imaging Library."""
 
+import sys
+
 from . import pdlparser
 
 try:
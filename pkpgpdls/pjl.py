@@ -113,7 +113,7 @@ class PJLParser:
                     self.logdebug("Invalid JL statement [%s]" % repr(statement))
             elif (not statement) \
                   or (statement == r"%-12345X@PJL EOJ") \
-                  or statement[2:].startswith(b"HP-PCL XL;"):
+                  or statement[2:].startswith("HP-PCL XL;"):
                 self.logdebug("Ignored JL statement [%s]" % repr(statement))
             else:
                 self.logdebug("Invalid JL statement [%s]" % repr(statement))
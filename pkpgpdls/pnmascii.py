@@ -25,13 +25,13 @@ from . import pdlparser
 
 class Parser(pdlparser.PDLParser):
     """A parser for PNM (ascii) documents."""
-    openmode = "rU"
+    openmode = "r"
     format = "PNM (ascii)"
     def isValid(self):
         """Returns True if data is ASCII PNM, else False."""
         split = self.firstblock.split()
-        if len(split) > 0 and split[0] in ("P1", "P2", "P3"):
-            self.marker = self.firstblock[:2]
+        if len(split) > 0 and split[0] in (b"P1", b"P2", b"P3"):
+            self.marker = self.firstblock[:2].decode("ascii")
             return True
         else:
             return False
@@ -44,7 +44,7 @@ class Parser(pdlparser.PDLParser):
         marker = self.marker
         for line in self.infile:
             linecount += 1
-            if (linecount == 2) and (line.find(b"device=pksm") != -1):
+            if (linecount == 2) and (line.find("device=pksm") != -1):
                 # Special case of cmyk map
                 divby = 4
             # Unfortunately any whitespace is valid,
@@ -23,15 +23,47 @@
 
 import sys
 import os
+import re
+import mmap
 
 from . import pdlparser
-from . import inkcoverage
+
+# Lines the DSC scanner must look at, once stripped. The other ones,
+# e.g. those of embedded images, are skipped by the regular expression.
+# Lines with "@copies" as their second word are searched for separately,
+# since this can't be done as fast.
+DSCLINE = rb"([ \t\f\v]*(?:%|!R!|/#copies|\(%%\[Page:|1[ \t\f\v]|\{|/languagelevel)[^\r\n]*)"
+FIRSTDSCLINE = re.compile(DSCLINE)
+DSCLINES = re.compile(rb"\n" + DSCLINE)        # Much faster, when possible
+DSCCRLINES = re.compile(rb"[\r\n]" + DSCLINE)  # When there are lone CRs
+BEGINDATA = re.compile(rb"%%Begin(Data|Binary):[ \t]*(\d+)(?:[ \t]+\S+(?:[ \t]+(\S+))?)?")
+ENDDATA = re.compile(rb"(?:\r\n|\r|\n)?[ \t\f\v]*%%End(?:Data|Binary)")
+ENDOFLINE = re.compile(rb"\r\n|\r|\n")
+LONECR = re.compile(rb"\r(?!\n)")
+
+# For the count from the trailer's %%Pages: comment
+DSCWINDOWSIZE = 64 * pdlparser.KILOBYTE # Read at the start and at the end of the job
+FIRSTPAGE = re.compile(rb"(?:\A|[\r\n])[ \t\f\v]*%%Page:")
+TRAILERPAGES = re.compile(rb"[\r\n][ \t\f\v]*%%Pages:[ \t]*(\d+)")
+COPIESOVERRIDE = re.compile(rb"#copies|NumCopies|@copies|numcopies\(")
+
+PAGECOMMENTS = (r"%%Page:", r"(%%[Page:") # First word of the lines which count
+
+def getPageNumber(line):
+    """Returns the page number of a %%Page: comment line, or None."""
+    try:
+        # treats both "%%Page: x x" and "%%Page: (x-y) z" (probably N-up mode)
+        return int(line.split(']')[0].split()[-1])
+    except (ValueError, IndexError):
+        return None # It seems that sometimes it's not an integer but an EPS file name
 
 class Parser(pdlparser.PDLParser):
     """A parser for PostScript documents."""
     totiffcommands = [ 'gs -sDEVICE=tiff24nc -dPARANOIDSAFER -dNOPAUSE -dBATCH -dQUIET -r"%(dpi)i" -sOutputFile="%(outfname)s" "%(infname)s"' ]
+    inkcovcommand = 'gs -sDEVICE=%(device)s -dPARANOIDSAFER -dNOPAUSE -dBATCH -dQUIET -r"%(dpi)i" -sOutputFile=- "%(infname)s"'
     required = [ "gs" ]
-    openmode = "rU"
+    gsnative = True
+    openmode = "rb"
     format = "PostScript"
     def isValid(self):
         """Returns True if data is PostScript, else False."""
@@ -53,6 +85,16 @@ class Parser(pdlparser.PDLParser):
         if self.isMissing(self.required):
             raise pdlparser.PDLParserError("The gs interpreter is nowhere to be found in your PATH (%s)" % os.environ.get("PATH", ""))
         infname = self.filename
+        pool = self.getGhostScriptPool()
+        if pool is not None:
+            try:
+                with pool.borrow() as interpreter:
+                    pagecount = interpreter.countPages(infname)
+            except pdlparser.PDLParserError as msg:
+                self.logdebug("%s, launching a new Ghostscript instead." % msg)
+            else:
+                self.logdebug("GhostScript said: %s pages" % pagecount)
+                return pagecount * self.copies
         command = 'gs -sDEVICE=bbox -dPARANOIDSAFER -dNOPAUSE -dBATCH -dQUIET "%(infname)s" 2>&1 | grep -c "%%HiResBoundingBox:" 2>/dev/null'
         pagecount = 0
         fromchild = os.popen(command % locals(), "r")
@@ -67,6 +109,34 @@ class Parser(pdlparser.PDLParser):
         self.logdebug("GhostScript said: %s pages" % pagecount)
         return pagecount * self.copies
 
+    async def asyncThroughGhostScript(self, executor=None):
+        """Same as throughGhostScript(), but without blocking the event loop.
+
+           Ghostscript is killed if the coroutine is cancelled.
+        """
+        import asyncio
+        if (self.getGhostScriptPool() is not None) or self.isMissing(self.required):
+            return await pdlparser.runInExecutor(executor, self.throughGhostScript)
+        self.logdebug("Internal parser sucks, using GhostScript instead...")
+        child = await asyncio.create_subprocess_exec("gs", "-sDEVICE=bbox", "-dPARANOIDSAFER", "-dNOPAUSE", "-dBATCH", "-dQUIET", self.filename,
+                                                     stdout=asyncio.subprocess.PIPE,
+                                                     stderr=asyncio.subprocess.STDOUT,
+                                                     start_new_session=True)
+        pagecount = 0
+        try:
+            async for line in child.stdout:
+                if line.startswith(b"%%HiResBoundingBox:"):
+                    pagecount += 1
+            await child.wait()
+        except asyncio.CancelledError:
+            pdlparser.killProcessGroup(child.pid)
+            await child.wait()
+            raise
+        if not pagecount:
+            raise pdlparser.PDLParserError("Problem during analysis of Binary PostScript document")
+        self.logdebug("GhostScript said: %s pages" % pagecount)
+        return pagecount * self.copies
+
     def setcopies(self, pagenum, txtvalue):
         """Tries to extract a number of copies from a textual value and set the instance attributes accordingly."""
         try:
@@ -77,18 +147,109 @@ class Parser(pdlparser.PDLParser):
             if number > self.pages[pagenum]["copies"]:
                 self.pages[pagenum]["copies"] = number
 
+    def skipData(self, data, line, pos):
+        """Returns the position after the datas announced by a
+           %%BeginData: or %%BeginBinary: comment line ending at pos,
+           or None if they can't be skipped safely.
+        """
+        begin = BEGINDATA.match(line)
+        if begin is None:
+            return None
+        count = int(begin.group(2))
+        eol = ENDOFLINE.match(data, pos)
+        if eol is not None:
+            pos = eol.end()
+        if (begin.group(1) == b"Data") and (begin.group(3) == b"Lines"):
+            for i in range(count):
+                eol = ENDOFLINE.search(data, pos)
+                if eol is None:
+                    return None
+                pos = eol.end()
+        else:
+            pos += count
+        # Trust the count only if the datas end where announced.
+        if ENDDATA.match(data, pos) is None:
+            return None
+        return pos
+
+    def iterCopiesLines(self, data):
+        """Yields the start and end of each line containing "@copies"."""
+        end = 0
+        pos = data.find(b"@copies")
+        while pos != -1:
+            start = max(data.rfind(b"\n", end, pos), data.rfind(b"\r", end, pos), end - 1) + 1
+            eol = ENDOFLINE.search(data, pos)
+            if eol is None:
+                end = len(data)
+            else:
+                end = eol.start()
+            yield (start, end)
+            pos = data.find(b"@copies", end)
+
+    def iterDSCLines(self, data):
+        """Yields the start and the stripped content of each line
+           which may matter to the DSC scanner, skipping embedded
+           datas when their size is known.
+        """
+        if LONECR.search(data) is None:
+            dsclines = DSCLINES
+        else:
+            dsclines = DSCCRLINES
+        copieslines = self.iterCopiesLines(data)
+        nextcopies = next(copieslines, None)
+        match = FIRSTDSCLINE.match(data) or dsclines.search(data)
+        while True:
+            if (nextcopies is not None) and ((match is None) or (nextcopies[0] < match.start(1))):
+                (start, pos) = nextcopies
+                line = data[start:pos].strip()
+            elif match is not None:
+                (start, pos) = match.span(1)
+                line = match.group(1).strip()
+                if line.startswith(b"%%Begin"):
+                    pos = self.skipData(data, line, pos) or pos
+            else:
+                break
+            yield (start, line.decode("latin-1"))
+            while (nextcopies is not None) and (nextcopies[0] < pos):
+                nextcopies = next(copieslines, None)
+            match = dsclines.search(data, pos)
+
+    def getPreviousLine(self, data, linestart):
+        """Returns the line before the one starting at linestart, stripped."""
+        end = linestart
+        if data[end-2:end] == b"\r\n":
+            end -= 2
+        elif end > 0:
+            end -= 1
+        start = max(data.rfind(b"\n", 0, end), data.rfind(b"\r", 0, end)) + 1
+        return data[start:end].strip().decode("latin-1")
+
     def natively(self):
-        """Count pages in a DSC compliant PostScript document."""
+        """Count pages in a DSC compliant PostScript document.
+
+           The document is mapped in memory, and a regular expression
+           extracts the only lines which may be of interest.
+        """
+        infileno = self.infile.fileno()
+        size = os.fstat(infileno).st_size
+        if not size:
+            return (0, False)
+        data = mmap.mmap(infileno, size, prot=mmap.PROT_READ, flags=mmap.MAP_SHARED)
+        try:
+            return self.scanDSCLines(data)
+        finally:
+            data.close()
+
+    def scanDSCLines(self, data):
+        """Count pages from the DSC comments and copies settings."""
         pagecount = 0
         self.pages = { 0: { "copies": 1 } }
         oldpagenum = 0
-        previousline = ""
         notrust = False
         prescribe = False # Kyocera's Prescribe commands
         acrobatmarker = False
         pagescomment = None
-        for line in self.infile:
-            line = line.strip()
+        for (linestart, line) in self.iterDSCLines(data):
             parts = line.split()
             nbparts = len(parts)
             if nbparts >= 1:
@@ -129,22 +290,12 @@ class Parser(pdlparser.PDLParser):
                   and (nbparts > 6):
                 # handle # of copies set by firefox/kprinter/cups (alternate syntax)
                 self.setcopies(pagecount, parts[6])
-            elif (part0 == r"%%Page:") or (part0 == r"(%%[Page:"):
-                proceed = True
-                try:
-                    # treats both "%%Page: x x" and "%%Page: (x-y) z" (probably N-up mode)
-                    newpagenum = int(line.split(']')[0].split()[-1])
-                except:
-                    notinteger = True # It seems that sometimes it's not an integer but an EPS file name
-                else:
-                    notinteger = False
-                    if newpagenum <= oldpagenum:
-                        # Now correctly handles multiple copies when printed from MSOffice.
-                        # Thanks to Jiri Popelka for the fix.
-                        proceed = False
-                    else:
-                        oldpagenum = newpagenum
-                if proceed and not notinteger:
+            elif part0 in PAGECOMMENTS:
+                newpagenum = getPageNumber(line)
+                # Now correctly handles multiple copies when printed from MSOffice.
+                # Thanks to Jiri Popelka for the fix.
+                if (newpagenum is not None) and (newpagenum > oldpagenum):
+                    oldpagenum = newpagenum
                     pagecount += 1
                     self.pages[pagecount] = { "copies": self.pages[pagecount-1]["copies"] }
             elif (not prescribe) \
@@ -152,10 +303,9 @@ class Parser(pdlparser.PDLParser):
                and not acrobatmarker:
                 notrust = True # Let this stuff be managed by GhostScript, but we still extract number of copies
             elif line.startswith(r"/languagelevel where{pop languagelevel}{1}ifelse 2 ge{1 dict dup/NumCopies"):
-                self.setcopies(pagecount, previousline[2:])
+                self.setcopies(pagecount, self.getPreviousLine(data, linestart)[2:])
             elif (nbparts > 1) and (parts[1] == "@copies"):
                 self.setcopies(pagecount, part0)
-            previousline = line
 
         # extract max number of copies to please the ghostscript parser, just
         # in case we will use it later
@@ -164,6 +314,7 @@ class Parser(pdlparser.PDLParser):
         # now apply the number of copies to each page
         if not pagecount and pagescomment:
             pagecount = pagescomment
+        self.nbpages = pagecount
         for pnum in range(1, pagecount + 1):
             page = self.pages.get(pnum, self.pages.get(1, self.pages.get(0, { "copies": 1 })))
             copies = page["copies"]
@@ -173,14 +324,87 @@ class Parser(pdlparser.PDLParser):
         self.logdebug("Internal parser said: %s pages" % pagecount)
         return (pagecount, notrust)
 
-    def getJobSize(self):
-        """Count pages in PostScript document."""
+    def fromTrailer(self):
+        """Counts pages from the %%Pages: comment in the trailer, and
+           the copies asked for in the prolog and setup sections.
+
+           Only the start and the end of the job are read. Returns
+           None if the count can't be trusted this way, e.g. if the
+           trailer is incomplete or if copies are set in a page.
+        """
+        size = os.fstat(self.infile.fileno()).st_size
+        if size <= 2 * DSCWINDOWSIZE:
+            return None # Small enough to be scanned entirely
+        self.infile.seek(0)
+        head = self.infile.read(DSCWINDOWSIZE)
+        self.infile.seek(-DSCWINDOWSIZE, 2)
+        tail = self.infile.read(DSCWINDOWSIZE)
+        trailer = tail.rfind(b"%%Trailer")
+        if (trailer == -1) or (tail.find(b"%%EOF", trailer) == -1):
+            self.logdebug("No complete trailer found.")
+            return None
+        pagescomments = TRAILERPAGES.findall(tail, trailer)
+        if not pagescomments:
+            self.logdebug("No %%Pages: comment in the trailer.")
+            return None
+        firstpage = FIRSTPAGE.search(head)
+        if firstpage is None:
+            self.logdebug("The prolog and setup sections are too long.")
+            return None
+        if (COPIESOVERRIDE.search(head, firstpage.start()) is not None) \
+           or (COPIESOVERRIDE.search(tail, 0, trailer) is not None):
+            self.logdebug("Copies are set in a page.")
+            return None
+        notrust = self.scanDSCLines(head[:firstpage.start()])[1]
+        if notrust:
+            return None
+        pagecount = int(pagescomments[-1]) * self.copies
+        self.logdebug("Trailer said: %s pages" % pagecount)
+        return pagecount
+
+    def countNatively(self):
+        """Counts pages without Ghostscript.
+
+           Returns the number of pages, and True if Ghostscript
+           should be asked too, else False.
+        """
+        self.copies = 1
+        if getattr(getattr(self.parent, "options", None), "dsctrailer", False):
+            pagecount = self.fromTrailer()
+            if pagecount:
+                return (pagecount, False)
+        return self.natively()
+
+    def getNbPages(self):
+        """Returns the number of pages from the DSC comments, without
+           copies, or None if they can't be trusted.
+        """
         self.copies = 1
         (nbpages, notrust) = self.natively()
+        if notrust or not nbpages:
+            return None
+        return self.nbpages
+
+    def getJobSize(self):
+        """Count pages in PostScript document."""
+        (nbpages, notrust) = self.countNatively()
+        newnbpages = nbpages
+        if notrust or not nbpages:
+            try:
+                with self.timePhase("ghostscript"):
+                    newnbpages = self.throughGhostScript()
+            except pdlparser.PDLParserError as msg:
+                self.logdebug(msg)
+        return max(nbpages, newnbpages)
+
+    async def asyncGetJobSize(self, executor=None):
+        """Count pages in PostScript document, without blocking the event loop."""
+        (nbpages, notrust) = await pdlparser.runInExecutor(executor, self.countNatively)
         newnbpages = nbpages
         if notrust or not nbpages:
             try:
-                newnbpages = self.throughGhostScript()
+                with self.timePhase("ghostscript"):
+                    newnbpages = await self.asyncThroughGhostScript(executor)
             except pdlparser.PDLParserError as msg:
                 self.logdebug(msg)
         return max(nbpages, newnbpages)
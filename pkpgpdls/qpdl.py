@@ -29,6 +29,11 @@ from struct import unpack
 from . import pdlparser
 from . import pjl
 
+PAGEHEADERSIZE = 16    # After the 0x00 tag
+PAGEFOOTERSIZE = 2     # After the 0x01 tag
+BANDHEADERSIZE = 10    # After the 0x0c tag, the band's length is at offset 6
+EOFMARKER = b"\033%-12345X"
+
 class Parser(pdlparser.PDLParser):
     """A parser for QPDL (aka SPL2) documents."""
     format = "QPDL (aka SPL2)"
@@ -84,8 +89,8 @@ class Parser(pdlparser.PDLParser):
         self.pagecount += 1
 
         copies = unpack(self.unpackShort, self.minfile[nextpos+1:nextpos+3])[0]
-        mediasize = ord(self.minfile[nextpos+3])
-        mediasource = ord(self.minfile[nextpos+8])
+        mediasize = self.minfile[nextpos+3]
+        mediasource = self.minfile[nextpos+8]
         duplexmode = unpack(self.unpackShort, self.minfile[nextpos+10:nextpos+12])[0]
 
         self.pages[self.pagecount] = { "copies": copies,
@@ -93,7 +98,9 @@ class Parser(pdlparser.PDLParser):
                                        "mediasource": self.mediasources.get(mediasource, str(mediasource)),
                                        "duplex": duplexmode,
                                      }
-        return 16       # Length of a page header
+        self.pagestarts.append(nextpos - 1)
+        self.pageends.append(None)
+        return PAGEHEADERSIZE
 
     def endPage(self, nextpos):
         """Indicates the end of a page."""
@@ -101,12 +108,14 @@ class Parser(pdlparser.PDLParser):
         bpcopies = self.pages[self.pagecount]["copies"]
         if epcopies != bpcopies:
             self.logdebug("ERROR: discrepancy between beginPage (%i) and endPage (%i) copies" % (bpcopies, epcopies))
-        return 2        # Length of a page footer
+        if self.pageends:
+            self.pageends[-1] = nextpos + 2
+        return PAGEFOOTERSIZE
 
     def beginBand(self, nextpos):
         """Indicates the beginning of a new band."""
         bandlength = unpack(self.unpackLong, self.minfile[nextpos+6:nextpos+10])[0]
-        return bandlength + 10 # Length of a band header - length of checksum
+        return bandlength + BANDHEADERSIZE # Without the length of the checksum
 
     def littleEndian(self):
         """Toggles to little endianness."""
@@ -126,28 +135,28 @@ class Parser(pdlparser.PDLParser):
         """Handles the ESC code."""
         pos = endpos = nextpos
         minfile = self.minfile
-        if minfile[pos: pos+8] == r"%-12345X":
+        if minfile[pos: pos+8] == b"%-12345X":
             endpos = pos + 9
-            endmark = chr(0x0c) + chr(0x00) + chr(0x1b)
-            asciilimit = chr(0x80)
+            endmark = b"\x0c\x00\x1b"
+            asciilimit = 0x80
             quotes = 0
             while (minfile[endpos] not in endmark) and \
                    ((minfile[endpos] < asciilimit) or (quotes % 2)):
-                if minfile[endpos] == '"':
+                if minfile[endpos] == 0x22: # double quote
                     quotes += 1
                 endpos += 1
 
             # Store this in a per page mapping.
             # NB: First time will be at page 0 (i.e. **before** page 1) !
             stuff = self.escapedStuff.setdefault(self.pagecount, [])
-            stuff.append(minfile[pos: endpos])
+            stuff.append(minfile[pos: endpos].decode("latin-1"))
             self.logdebug("Escaped datas: [%s]" % repr(minfile[pos: endpos]))
         return endpos - pos
 
     def maybeEOF(self, nextpos):
         """Tries to detect the EOF marker."""
-        if self.minfile[nextpos:nextpos+9] == self.eofmarker:
-            return 9
+        if self.minfile[nextpos:nextpos+len(EOFMARKER)] == EOFMARKER:
+            return len(EOFMARKER)
         else:
             return 0
 
@@ -171,8 +180,6 @@ class Parser(pdlparser.PDLParser):
         self.tags[0x0c] = self.beginBand
         self.tags[0x1b] = self.escape # The escape code
 
-        self.eofmarker = "\033%-12345X"
-
         infileno = self.infile.fileno()
         self.pages = { 0: { "copies": 1,
                              "orientation": "Default",
@@ -184,6 +191,8 @@ class Parser(pdlparser.PDLParser):
                      }
         self.minfile = minfile = mmap.mmap(infileno, os.fstat(infileno)[6], prot=mmap.PROT_READ, flags=mmap.MAP_SHARED)
         self.pagecount = 0
+        self.pagestarts = []
+        self.pageends = []
         self.escapedStuff = {}   # For escaped datas, mostly PJL commands
         self.bigEndian()
         pos = 0
@@ -191,7 +200,7 @@ class Parser(pdlparser.PDLParser):
         try:
             try:
                 while 1:
-                    tag = ord(minfile[pos])
+                    tag = minfile[pos]
                     pos += 1
                     pos += tags[tag](pos)
             except IndexError: # EOF ?
@@ -205,6 +214,7 @@ class Parser(pdlparser.PDLParser):
         oldpjlcopies = -1
         oldduplexmode = ""
         oldpapersize = ""
+        self.pagesdetails = []
         for pnum in range(1, self.pagecount + 1):
             # NB: is number of copies is 0, the page won't be output
             # but the formula below is still correct: we want
@@ -285,8 +295,15 @@ class Parser(pdlparser.PDLParser):
             oldpapersize = papersize
             copies = max(pjlcopies, page["copies"]) # Was: pjlcopies * page["copies"]
             self.pagecount += (copies - 1)
+            self.pagesdetails.append({ "copies": copies,
+                                       "mediasize": papersize,
+                                       "mediasource": page["mediasource"],
+                                       "duplex": duplexmode,
+                                     })
             self.logdebug("%s*%s*%s*%s" % (copies,
                                            papersize,
                                            page["mediasource"],
                                            duplexmode))
+        if self.wantsPageIndex():
+            self.buildPageIndex(self.pagestarts, self.pageends)
         return self.pagecount
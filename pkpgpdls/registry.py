@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter: a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+
+
+"""This modules implements the registry of parsers, and the detection
+   of the format of a document from its first block.
+
+   Each parser module is described by an entry holding its signature,
+   and is only imported when a document may be in its format, so
+   counting the pages of a PCL document doesn't import PIL.
+
+   Other packages can provide their own parsers, by declaring a
+   ParserEntry as an entry point in the 'pkpgcounter.parsers' group,
+   e.g. with setuptools:
+
+     entry_points = { "pkpgcounter.parsers" :
+                        [ "foo = foopdl.plugin:ENTRY" ] }
+
+   with, in foopdl/plugin.py:
+
+     from pkpgpdls.registry import ParserEntry
+     ENTRY = ParserEntry("foo", "foopdl.parser", magics=(b"FOO",))
+
+   The parser module must define a Parser class, derived from
+   pdlparser.PDLParser. Plugins are tried after the builtin parsers,
+   except the plain text one.
+"""
+
+import re
+import logging
+import importlib
+
+LOG = logging.getLogger("pkpgcounter.registry")
+
+ENTRYPOINTS = "pkpgcounter.parsers"
+
+UEL = b"\033%-12345X"           # Universal Exit Language
+LANGUAGERE = re.compile(rb"LANGUAGE *= *(\w+)")
+HEADSIZE = 128                  # A PJL header starts in these first bytes
+
+class ParserEntry:
+    """A parser module and its signature.
+
+       The first block of a document in this format starts with one
+       of the magics, or its PJL header enters one of the languages,
+       or it contains one of the markers. An entry without any of
+       them is always tried. In any case the parser's isValid() method
+       has the final word.
+    """
+    def __init__(self, name, modulename=None, magics=(), languages=(), markers=()):
+        """Initializes the entry, modulename defaults to a builtin parser's one."""
+        self.name = name
+        self.modulename = modulename or "%s.%s" % (__package__, name)
+        self.magics = magics
+        self.languages = languages
+        self.markers = markers
+        self.parser = None
+
+    def getParser(self):
+        """Returns the parser class, importing its module on first use."""
+        if self.parser is None:
+            LOG.debug("Importing %s" % self.modulename)
+            self.parser = importlib.import_module(self.modulename).Parser
+        return self.parser
+
+# IMPORTANT: the order is important below. FIXME.
+BUILTINS = (ParserEntry("postscript",
+                        magics=(b"%!", b"\004%!", b"\033%-12345X%!PS"),
+                        languages=(b"POSTSCRIPT", b"Postscript"),
+                        markers=(b"%!PS-Adobe",)),
+            ParserEntry("pclxl",
+                        magics=(b"\xcd\xca",),
+                        languages=(b"PCLXL",),
+                        markers=(b"BROTHER XL2HB;",)),
+            ParserEntry("pdf",
+                        magics=(b"%PDF-", b"\033%-12345X%PDF-"),
+                        languages=(b"PDF",),
+                        markers=(b"%PDF-",)),
+            ParserEntry("qpdl", languages=(b"QPDL",)),
+            ParserEntry("spl1", languages=(b"SMART",)),
+            ParserEntry("dvi", magics=(b"\xf7",)),
+            ParserEntry("tiff", magics=(b"II\x2a\x00", b"MM\x00\x2a")),
+            ParserEntry("cfax", magics=(b"Sfff",)),
+            ParserEntry("zjstream", magics=(b"ZJZJ", b"JZJZ")),
+            ParserEntry("ooo", magics=(b"PK",)),
+            ParserEntry("hbp", markers=(b"@PJL ENTER LANGUAGE = HBP\n",)),
+            ParserEntry("lidil", magics=(b"$\x01\x00\x00\x07",)),
+            ParserEntry("pcl345", markers=(b"\033",)),
+            ParserEntry("escp2", magics=(b"\033@", b"\033*", b"\n\033@", b"\0\0\0\033\1@EJL")),
+            ParserEntry("escpages03", magics=(b"\033\1@EJL",)),
+            ParserEntry("bj", magics=(b"\033[K\002\000",)),
+            ParserEntry("pnmascii", markers=(b"P1", b"P2", b"P3")),
+            ParserEntry("pil",
+                        magics=(b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF87a", b"GIF89a", b"BM",
+                                b"P1", b"P2", b"P3", b"P4", b"P5", b"P6", b"P7",
+                                b"\x0a\x00\x01", b"\x0a\x02\x01", b"\x0a\x03\x01", b"\x0a\x04\x01", b"\x0a\x05\x01",
+                                b"8BPS", b"RIFF", b"\x00\x00\x01\x00", b"icns", b"\x01\xda", b"qoif", b"DDS ",
+                                b"\x00\x00\x00\x0cjP  \r\n\x87\n", b"\xff\x4f\xff\x51", b"#define", b"/* XPM */")),
+            ParserEntry("mscrap",
+                        magics=(b"PO^Q`", b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", b"\xfe7\x00#", b"\xdb\xa5-\x00\x00\x00", b"\x31\xbe\x00\x00"),
+                        markers=(b"MSWordDoc",)),
+           )
+
+FALLBACKS = (ParserEntry("plain", markers=(b"\n", b"\r")),) # IMPORTANT: don't move this one up !
+
+class SignatureTable:
+    """The signatures of some parsers, compiled once.
+
+       Only the parsers whose signature appears in the first block are
+       tried, so detecting a format doesn't create up to twenty parsers
+       each rescanning the same block.
+
+       A magic prefix is exclusive if no parser of a higher priority can
+       match a block starting with it, because none of its markers is
+       part of the prefix, and it has no languages or the prefix isn't a
+       PJL header. The parser of an exclusive prefix is tried first,
+       without reading the PJL header or searching for any marker.
+    """
+    def __init__(self, entries):
+        """Indexes the magic prefixes by their first byte."""
+        self.entries = entries
+        magics = {}
+        for (index, entry) in enumerate(entries):
+            for magic in entry.magics:
+                magics.setdefault(magic, set()).add(index)
+        self.magics = {}
+        for (magic, indexes) in magics.items():
+            first = min(indexes)
+            if self.isExclusive(magic, first):
+                exclusive = first
+            else:
+                exclusive = None
+            self.magics.setdefault(magic[:1], []).append((magic, indexes, exclusive))
+
+    def isExclusive(self, magic, index):
+        """Returns True if no entry before index can match a block starting with magic, else False."""
+        for entry in self.entries[:index]:
+            if not (entry.magics or entry.languages or entry.markers):
+                return False
+            if entry.languages and magic.startswith(UEL):
+                return False
+            if [marker for marker in entry.markers if magic.find(marker) != -1]:
+                return False
+        return True
+
+    def getLanguages(self, firstblock):
+        """Returns the languages entered by the PJL header of firstblock, if any."""
+        languages = []
+        if firstblock[:HEADSIZE].find(UEL) != -1:
+            pos = firstblock.find(b"LANGUAGE")
+            while pos != -1:
+                match = LANGUAGERE.match(firstblock, pos)
+                if match is not None:
+                    languages.append(match.group(1))
+                pos = firstblock.find(b"LANGUAGE", pos + 8)
+        return languages
+
+    def getCandidates(self, firstblock):
+        """Yields the entries which may handle firstblock, in priority order.
+
+           The first block is searched for each marker once at most,
+           and only when needed.
+        """
+        matched = set()
+        exclusives = []
+        for (magic, indexes, first) in self.magics.get(firstblock[:1], ()):
+            if firstblock.startswith(magic):
+                matched.update(indexes)
+                if first is not None:
+                    exclusives.append(first)
+        exclusive = None
+        if exclusives and (min(exclusives) == min(matched)):
+            exclusive = min(exclusives)
+            yield self.entries[exclusive]
+        languages = None
+        found = {}
+        for (index, entry) in enumerate(self.entries):
+            if index == exclusive:
+                continue
+            if (index in matched) or not (entry.magics or entry.languages or entry.markers):
+                yield entry
+                continue
+            if entry.languages:
+                if languages is None:
+                    languages = self.getLanguages(firstblock)
+                if [l for l in languages if l.startswith(entry.languages)]:
+                    yield entry
+                    continue
+            for marker in entry.markers:
+                try:
+                    present = found[marker]
+                except KeyError:
+                    present = found[marker] = (firstblock.find(marker) != -1)
+                if present:
+                    yield entry
+                    break
+
+def loadPlugins(group=ENTRYPOINTS):
+    """Returns the entries registered by other packages in an entry points group."""
+    try:
+        from importlib import metadata
+    except ImportError:
+        return []
+    try:
+        entrypoints = metadata.entry_points(group=group)
+    except TypeError: # Before Python 3.10
+        entrypoints = metadata.entry_points().get(group, [])
+    plugins = []
+    for entrypoint in entrypoints:
+        try:
+            entry = entrypoint.load()
+        except Exception as msg:
+            LOG.warning("Impossible to load parser plugin %s: %s" % (entrypoint.name, msg))
+            continue
+        if not isinstance(entry, ParserEntry):
+            LOG.warning("Parser plugin %s is not a ParserEntry, ignored." % entrypoint.name)
+            continue
+        LOG.debug("Parser plugin %s registered" % entrypoint.name)
+        plugins.append(entry)
+    return plugins
+
+class Registry:
+    """The builtin parsers, those of the plugins, and the fallback ones."""
+    def __init__(self, builtins=BUILTINS, fallbacks=FALLBACKS, group=ENTRYPOINTS):
+        """Compiles the signatures of the builtin and fallback parsers."""
+        self.builtins = SignatureTable(builtins)
+        self.fallbacks = SignatureTable(fallbacks)
+        self.group = group
+        self.plugins = None
+
+    def getPlugins(self):
+        """Returns the signature table of the plugins, loading them on first use."""
+        if self.plugins is None:
+            self.plugins = SignatureTable(tuple(loadPlugins(self.group)))
+        return self.plugins
+
+    def getCandidates(self, firstblock):
+        """Yields the entries which may handle firstblock, in priority order.
+
+           Plugins are only loaded if no builtin parser accepts the document.
+        """
+        yield from self.builtins.getCandidates(firstblock)
+        yield from self.getPlugins().getCandidates(firstblock)
+        yield from self.fallbacks.getCandidates(firstblock)
+
+REGISTRY = None                 # Built on first use, see getRegistry()
+
+def getRegistry():
+    """Returns the registry of parsers."""
+    global REGISTRY
+    if REGISTRY is None:
+        REGISTRY = Registry()
+    return REGISTRY
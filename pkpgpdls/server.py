@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+#
+# pkpgcounter: a generic Page Description Language parser
+#
+# (c) 2003-2009 Jerome Alet <alet@librelogiciel.com>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# $Id$
+#
+
+"""This modules implements a long-running analysis daemon, and its client.
+
+   The daemon keeps pkpgcounter loaded and answers requests made
+   over a Unix socket, so the cost of starting Python and importing
+   the parsers is paid once instead of once per document.
+
+   Each request and each answer is a line of JSON. Requests look like:
+
+     { "command": "pagecount" }
+     { "command": "inkcoverage", "colorspace": "cmyk", "resolution": 150 }
+     { "command": "metadata", "filename": "/var/spool/cups/d00042-001" }
+
+   The document to analyze is either the file descriptor passed along
+   with the request (SCM_RIGHTS), or the file named in the request.
+   Answers have a "status" of "ok" with the results, or of "error"
+   with a "message".
+
+   Since the daemon reads the files named in requests with its own
+   rights, its socket is only accessible to its owner and group.
+"""
+
+import os
+import sys
+import copy
+import json
+import stat
+import signal
+import socket
+import logging
+import threading
+import concurrent.futures
+
+from . import pdlparser
+from . import analyzer
+
+LOG = logging.getLogger("pkpgcounter.server")
+
+COMMANDS = ("pagecount", "inkcoverage", "metadata")
+DEFAULTWORKERS = 4              # Requests handled at the same time
+MAXMESSAGESIZE = 64 * pdlparser.KILOBYTE
+MAXFDS = 4                      # File descriptors accepted with a request
+SOCKETUMASK = 0o117             # The socket is rw-rw----
+
+class ServerError(pdlparser.PDLParserError):
+    """An exception for the analysis daemon and its clients."""
+    pass
+
+class Connection:
+    """A Unix socket connection which exchanges lines of JSON,
+       possibly along with file descriptors.
+    """
+    def __init__(self, sock):
+        """Initializes the connection."""
+        self.sock = sock
+        self.buffer = b""
+        self.fds = []
+
+    def close(self):
+        """Closes the connection and the file descriptors not yet handed out."""
+        closeFDs(self.fds)
+        self.fds = []
+        self.sock.close()
+
+    def send(self, message, fds=None):
+        """Sends a message, and file descriptors if any."""
+        data = ("%s\n" % json.dumps(message)).encode("utf-8")
+        if fds:
+            sent = socket.send_fds(self.sock, [data], fds)
+            data = data[sent:]
+        if data:
+            self.sock.sendall(data)
+
+    def receive(self):
+        """Returns the next message and the file descriptors received with it.
+
+           Returns (None, []) when the peer has closed the connection.
+        """
+        while b"\n" not in self.buffer:
+            if len(self.buffer) > MAXMESSAGESIZE:
+                raise ServerError("Message too long")
+            (data, fds, flags, address) = socket.recv_fds(self.sock, MAXMESSAGESIZE, MAXFDS)
+            self.fds.extend(fds)
+            if flags & socket.MSG_CTRUNC:
+                raise ServerError("Too many file descriptors received")
+            if not data:
+                if self.buffer:
+                    raise ServerError("Connection closed in the middle of a message")
+                return (None, [])
+            self.buffer += data
+        (line, self.buffer) = self.buffer.split(b"\n", 1)
+        (fds, self.fds) = (self.fds, [])
+        try:
+            message = json.loads(line.decode("utf-8"))
+            if not isinstance(message, dict):
+                raise ValueError("not an object")
+        except ValueError as msg:
+            closeFDs(fds)
+            raise ServerError("Invalid message: %s" % msg)
+        return (message, fds)
+
+def closeFDs(fds):
+    """Closes file descriptors, ignoring errors."""
+    for fd in fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+class AnalysisServer:
+    """A daemon which analyzes documents on request."""
+    def __init__(self, address, options=None, workers=DEFAULTWORKERS):
+        """Listens on the Unix socket at address.
+
+           options are the defaults for all requests, see
+           analyzer.AnalyzerOptions.
+        """
+        self.address = address
+        self.options = options or analyzer.AnalyzerOptions(resolution=72)
+        self.sock = None
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.removeStaleSocket()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        oldumask = os.umask(SOCKETUMASK)
+        try:
+            self.sock.bind(address)
+        finally:
+            os.umask(oldumask)
+        self.sock.listen(socket.SOMAXCONN)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        LOG.debug("Listening on %s with %i workers." % (address, workers))
+
+    def removeStaleSocket(self):
+        """Removes the socket left by a previous daemon, unless it is still running."""
+        try:
+            if not stat.S_ISSOCK(os.stat(self.address).st_mode):
+                return
+        except OSError:
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.address)
+        except OSError:
+            LOG.debug("Removing stale socket %s" % self.address)
+            os.remove(self.address)
+        else:
+            raise ServerError("Another daemon already listens on %s" % self.address)
+        finally:
+            probe.close()
+
+    def close(self):
+        """Stops listening, and waits for the requests in progress."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.remove(self.address)
+            except OSError:
+                pass
+            with self.lock:
+                for sock in self.connections:
+                    try:
+                        sock.shutdown(socket.SHUT_RD) # Wakes up idle connections
+                    except OSError:
+                        pass
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def serveForever(self):
+        """Accepts connections until interrupted, each one is handled by a worker."""
+        try:
+            while True:
+                (sock, dummy) = self.sock.accept()
+                self.executor.submit(self.handleConnection, sock)
+        finally:
+            self.close()
+
+    def handleConnection(self, sock):
+        """Answers the requests made on a connection, until the client closes it."""
+        connection = Connection(sock)
+        with self.lock:
+            self.connections.add(sock)
+        try:
+            while True:
+                (request, fds) = connection.receive()
+                if request is None:
+                    break
+                connection.send(self.handleRequest(request, fds))
+        except (OSError, ServerError) as msg:
+            LOG.debug("Connection error: %s" % msg)
+        finally:
+            with self.lock:
+                self.connections.discard(sock)
+            connection.close()
+
+    def handleRequest(self, request, fds):
+        """Handles a request and returns the answer."""
+        try:
+            try:
+                answer = self.analyze(request, fds)
+            finally:
+                closeFDs(fds[1:])
+        except (IOError, OSError, RuntimeError, pdlparser.PDLParserError) as msg:
+            return { "status": "error", "message": str(msg) }
+        except Exception as msg:
+            LOG.exception("Unexpected error while handling %s" % request)
+            return { "status": "error", "message": "Internal error: %s" % msg }
+        answer["status"] = "ok"
+        return answer
+
+    def getOptions(self, request):
+        """Returns the options to use for a request, starting from the daemon's ones."""
+        options = copy.copy(self.options)
+        options.streaming = False
+        colorspace = request.get("colorspace")
+        if colorspace is not None:
+            colorspace = str(colorspace).lower()
+            if colorspace not in analyzer.VALID_COLORSPACES:
+                raise ServerError("Invalid colorspace %s" % colorspace)
+            options.colorspace = colorspace
+        resolution = request.get("resolution")
+        if resolution is not None:
+            if (not isinstance(resolution, int)) or not (72 <= resolution <= 1200):
+                raise ServerError("The resolution must be between 72 and 1200.")
+            options.resolution = resolution
+        return options
+
+    def analyze(self, request, fds):
+        """Analyzes the document of a request, and returns the results."""
+        infile = None
+        if fds:
+            infile = document = os.fdopen(fds[0], "rb")
+        else:
+            document = request.get("filename")
+        try:
+            command = request.get("command")
+            if command not in COMMANDS:
+                raise ServerError("Unknown command %s" % repr(command))
+            if not document:
+                raise ServerError("No document to analyze")
+            options = self.getOptions(request)
+            parser = analyzer.PDLAnalyzer(document, options)
+            try:
+                if command == "inkcoverage":
+                    (cspace, pages) = parser.getInkCoverage()
+                    return { "colorspace": cspace, "pages": pages }
+                pagecount = parser.getJobSize()
+                if command == "pagecount":
+                    return { "pagecount": pagecount }
+                return { "pagecount": pagecount,
+                         "format": parser.pdlhandler.format,
+                       }
+            finally:
+                parser.close()
+        finally:
+            if infile is not None:
+                infile.close()
+
+def serve(address, options=None, workers=DEFAULTWORKERS):
+    """Runs the daemon until it is interrupted or terminated."""
+    def terminate(signum, frame):
+        """Stops the daemon."""
+        raise SystemExit(0)
+    server = AnalysisServer(address, options, workers)
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        pass
+
+class Client:
+    """A client of the analysis daemon."""
+    def __init__(self, address):
+        """Connects to the daemon listening on address."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(address)
+        except OSError as msg:
+            sock.close()
+            raise ServerError("Impossible to connect to the daemon on %s: %s" % (address, msg))
+        self.connection = Connection(sock)
+
+    def close(self):
+        """Closes the connection to the daemon."""
+        self.connection.close()
+
+    def request(self, command, document, **parameters):
+        """Sends a request about a document and returns the answer.
+
+           document is a filename, '-' for stdin, or an opened file
+           whose descriptor is passed to the daemon. Filenames are
+           opened here too, so the daemon can read all the documents
+           we can read.
+        """
+        mustclose = False
+        if hasattr(document, "fileno"):
+            infile = document
+        elif document == "-":
+            infile = sys.stdin
+        else:
+            infile = open(document, "rb")
+            mustclose = True
+        try:
+            request = { "command": command }
+            request.update([(k, v) for (k, v) in parameters.items() if v is not None])
+            self.connection.send(request, [infile.fileno()])
+            (answer, fds) = self.connection.receive()
+        finally:
+            if mustclose:
+                infile.close()
+        closeFDs(fds)
+        if answer is None:
+            raise ServerError("The daemon closed the connection")
+        if answer.get("status") != "ok":
+            raise ServerError(answer.get("message", "Unknown error"))
+        return answer
+
+    def getJobSize(self, document):
+        """Returns the number of pages in a document."""
+        return self.request("pagecount", document)["pagecount"]
+
+    def getInkCoverage(self, document, colorspace=None, resolution=None):
+        """Returns the colorspace used and the ink coverage of each page of a document."""
+        answer = self.request("inkcoverage", document, colorspace=colorspace, resolution=resolution)
+        return (answer["colorspace"], answer["pages"])
+
+    def getMetadata(self, document):
+        """Returns the format and number of pages of a document."""
+        answer = self.request("metadata", document)
+        del answer["status"]
+        return answer
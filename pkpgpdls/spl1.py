@@ -28,7 +28,7 @@ import struct
 from . import pdlparser
 from . import version
 
-ESCAPECHARS = (chr(0x1b), chr(0x24))
+ESCAPECHARS = (0x1b, 0x24)
 
 class Parser(pdlparser.PDLParser):
     """A parser for SPL1 documents."""
@@ -64,18 +64,18 @@ class Parser(pdlparser.PDLParser):
         self.isbitmap = False
         pos = endpos = nextpos
         minfile = self.minfile
-        if minfile[pos: pos+8] == r"%-12345X":
+        if minfile[pos: pos+8] == b"%-12345X":
             endpos = pos + 9
         elif minfile[pos-1] in ESCAPECHARS:
             endpos = pos
         else:
             return 0
-        endmark = (chr(0x1b), chr(0x00))
-        asciilimit = chr(0x80)
+        endmark = (0x1b, 0x00)
+        asciilimit = 0x80
         quotes = 0
         while (minfile[endpos] not in endmark) and \
                ((minfile[endpos] < asciilimit) or (quotes % 2)):
-            if minfile[endpos] == '"':
+            if minfile[endpos] == 0x22: # double quote
                 quotes += 1
             endpos += 1
 
@@ -84,7 +84,7 @@ class Parser(pdlparser.PDLParser):
         stuff = self.escapedStuff.setdefault(self.pagecount, [])
         datas = minfile[pos-1: endpos]
         stuff.append(datas)
-        if datas.endswith("$PJL BITMAP START\r\n"):
+        if datas.endswith(b"$PJL BITMAP START\r\n"):
             self.isbitmap = True
             # self.logdebug("New bitmap")
         self.logdebug("Escaped datas: [%s]" % repr(datas))
@@ -98,6 +98,8 @@ class Parser(pdlparser.PDLParser):
         infileno = self.infile.fileno()
         self.minfile = minfile = mmap.mmap(infileno, os.fstat(infileno)[6], prot=mmap.PROT_READ, flags=mmap.MAP_SHARED)
         self.pagecount = 0
+        self.pagestarts = []
+        self.pageends = []
         self.escapedStuff = {}   # For escaped datas, mostly PJL commands
         self.bigEndian()
         self.isbitmap = False
@@ -118,11 +120,17 @@ class Parser(pdlparser.PDLParser):
                         if not seqnum:
                             # Sequence number resets to 0 for each new page.
                             self.pagecount += 1
+                            self.pagestarts.append(pos)
+                            self.pageends.append(None)
                         pos += 4 + offset
+                        if self.pageends:
+                            self.pageends[-1] = pos
             except struct.error as msg:
                 raise pdlparser.PDLParserError("Unfortunately SPL1 is incompletely recognized (%s). Parsing aborted. Please report the problem to %s" % (msg, version.__authoremail__))
             except IndexError: # EOF ?
                 pass
         finally:
             minfile.close()
+        if self.wantsPageIndex():
+            self.buildPageIndex(self.pagestarts, self.pageends)
         return self.pagecount
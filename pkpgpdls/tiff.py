@@ -35,8 +35,8 @@ class Parser(pdlparser.PDLParser):
     format = "TIFF"
     def isValid(self):
         """Returns True if data is TIFF, else False."""
-        littleendian = (chr(0x49)*2) + chr(0x2a) + chr(0)
-        bigendian = (chr(0x4d)*2) + chr(0) + chr(0x2a)
+        littleendian = b"II\x2a\x00"
+        bigendian = b"MM\x00\x2a"
         if self.firstblock[:4] in (littleendian, bigendian):
             return True
         else:
@@ -54,8 +54,8 @@ class Parser(pdlparser.PDLParser):
         infileno = self.infile.fileno()
         minfile = mmap.mmap(infileno, os.fstat(infileno)[6], prot=mmap.PROT_READ, flags=mmap.MAP_SHARED)
         pagecount = 0
-        littleendian = (chr(0x49)*2) + chr(0x2a) + chr(0)
-        bigendian = (chr(0x4d)*2) + chr(0) + chr(0x2a)
+        littleendian = b"II\x2a\x00"
+        bigendian = b"MM\x00\x2a"
         if minfile[:4] == littleendian:
             integerbyteorder = "<I"
             shortbyteorder = "<H"
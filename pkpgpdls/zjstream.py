@@ -29,10 +29,10 @@ class Parser(pdlparser.PDLParser):
     """A parser for ZjStream documents."""
     def isValid(self):
         """Returns True if data is ZjStream, else False."""
-        if self.firstblock[:4] == "ZJZJ":
+        if self.firstblock[:4] == b"ZJZJ":
             self.format = "Zenographics ZjStream (little endian)"
             return self.littleEndian()
-        elif self.firstblock[:4] == "JZJZ":
+        elif self.firstblock[:4] == b"JZJZ":
             self.format = "Zenographics ZjStream (big endian)"
             return self.bigEndian()
         else: